@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-18 14:32
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_images(apps, schema_editor):
+    UserProfile = apps.get_model('accounts', 'UserProfile')
+    GeneratedImage = apps.get_model('images', 'GeneratedImage')
+    counts = GeneratedImage.objects.values('user_id').annotate(n=Count('id')).values_list('user_id', 'n')
+    for user_id, n in counts:
+        UserProfile.objects.filter(user_id=user_id).update(image_count=n)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_userprofile_phone_number'),
+        ('images', '0011_remove_generationjob_input_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='image_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_images, migrations.RunPython.noop),
+    ]
@@ -15,6 +15,7 @@ class UserProfile(models.Model):
     credits = models.IntegerField(default=3) # Default free trial
     plan_type = models.CharField(max_length=20, choices=PLAN_CHOICES, default='free')
     phone_number = models.CharField(max_length=20, blank=True, null=True)
+    image_count = models.PositiveIntegerField(default=0) # GeneratedImage rows, kept by apps.images (history total without a COUNT)
     
     def __str__(self):
         return self.user.email
@@ -1,3 +1,92 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import F
 from django.test import TestCase
+from django.urls import reverse
+from apps.accounts.models import UserProfile
+from apps.images.models import GeneratedImage
 
-# Create your tests here.
+
+class HistoryViewsQueryTests(TestCase):
+    """
+    Landing, dashboard and history render a bounded slice of the user's
+    history: the number of queries and the rows read must not grow with the
+    size of that history.
+    """
+
+    # session, user, profile, images (+ the social account lookups: one on landing, two on the dashboard)
+    QUERIES = {'core:landing': 5, 'core:dashboard': 6, 'core:history': 4}
+    LARGE_HISTORY = 500
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('history', 'history@example.com', 'password')
+        profile = cls.user.userprofile
+        profile.phone_number = '+15550000000'
+        profile.save()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def _add_images(self, count):
+        GeneratedImage.objects.bulk_create([
+            GeneratedImage(user=self.user, image_url=f'https://res.cloudinary.com/demo/image/upload/v1/{i}.png')
+            for i in range(count)
+        ])
+        # bulk_create skips the post_save receiver that keeps the profile's count
+        UserProfile.objects.filter(user=self.user).update(image_count=F('image_count') + count)
+
+    def _get(self, name, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get(reverse(name))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_query_count_does_not_grow_with_history(self):
+        for name, queries in self.QUERIES.items():
+            with self.subTest(view=name):
+                self._add_images(3)
+                self._get(name, queries)
+                self._add_images(self.LARGE_HISTORY)
+                self._get(name, queries)
+                GeneratedImage.objects.all().delete()
+
+    def test_only_rendered_columns_are_read(self):
+        self._add_images(3)
+        for name, queries in self.QUERIES.items():
+            with self.subTest(view=name):
+                history = self._get(name, queries).context['history']
+                self.assertTrue(history)
+                for img in history:
+                    self.assertIn('original_image', img.get_deferred_fields())
+
+    def test_history_renders_first_page_only(self):
+        self._add_images(settings.HISTORY_PAGE_SIZE * 3)
+        response = self._get('core:history', self.QUERIES['core:history'])
+        self.assertEqual(len(response.context['history']), settings.HISTORY_PAGE_SIZE)
+        self.assertEqual(response.context['total'], settings.HISTORY_PAGE_SIZE * 3)
+        self.assertTrue(response.context['next_cursor'])
+
+    def test_history_pages_cover_history_once(self):
+        self._add_images(settings.HISTORY_PAGE_SIZE * 2 + 5)
+        response = self._get('core:history', self.QUERIES['core:history'])
+        seen = [img.id for img in response.context['history']]
+        cursor = response.context['next_cursor']
+        while cursor:
+            # session, user, profile, images
+            with self.assertNumQueries(4):
+                page = self.client.get(reverse('core:history_page'), {'cursor': cursor}).json()
+            seen += [img['id'] for img in page['images']]
+            cursor = page['next_cursor']
+        expected = GeneratedImage.objects.filter(user=self.user).order_by('-created_at', '-id').values_list('id', flat=True)
+        self.assertEqual(seen, list(expected))
+
+    def test_history_total_follows_saved_and_deleted_images(self):
+        images = [GeneratedImage.objects.create(user=self.user, image_url=f'https://res.cloudinary.com/demo/{i}.png') for i in range(3)]
+        images[0].delete()
+        response = self._get('core:history', self.QUERIES['core:history'])
+        self.assertEqual(response.context['total'], 2)
+
+    def test_invalid_history_cursor(self):
+        response = self.client.get(reverse('core:history_page'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
@@ -7,6 +7,7 @@ urlpatterns = [
     path('', views.landing, name='landing'),
     path('app/', views.dashboard, name='dashboard'),
     path('history/', views.history_view, name='history'),
+    path('history/page/', views.history_page, name='history_page'),
     path('about/', views.about, name='about'),
     path('privacy/', views.privacy, name='privacy'),
     path('terms/', views.terms, name='terms'),
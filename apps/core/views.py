@@ -1,44 +1,101 @@
+import base64
+from datetime import datetime
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.db.models import Q
+from django.http import JsonResponse
 from django.shortcuts import render
 from apps.images.models import GeneratedImage
+from apps.images import variants
 from django.urls import path # Added import for path
 
+# Columns the history galleries render; the rest (notably the original upload) stay unread
+HISTORY_FIELDS = ('id', 'image_url', 'variants', 'created_at')
+
+def _user_history(request):
+    return GeneratedImage.objects.filter(user=request.user).only(*HISTORY_FIELDS)
+
 def landing(request):
     history = []
     if request.user.is_authenticated:
-        history = GeneratedImage.objects.filter(user=request.user)[:8]
+        history = _user_history(request)[:8]
         history = _optimize_image_urls(request, history)
     return render(request, 'core/landing.html', {'history': history})
 
 def _optimize_image_urls(request, history):
-    """Helper to optimize Cloudinary URLs for thumbnails and high-res viewing based on user plan."""
+    """Helper attaching responsive thumbnails (srcset) and the plan's high-res download URL to each image."""
     plan = 'free'
     if hasattr(request.user, 'userprofile'):
         plan = request.user.userprofile.plan_type
     
     for img in history:
-        if 'cloudinary.com' in img.image_url and '/upload/' in img.image_url:
-            img.thumbnail_url = img.image_url.replace('/upload/', '/upload/w_600,c_scale,q_auto,f_auto/')
-            # Generate high-res URL based on plan
-            res_limit = "w_4096" if plan == 'agency' else "w_2048"
-            img.high_res_url = img.image_url.replace('/upload/', f'/upload/{res_limit},c_scale,q_auto:best/')
-        else:
-            img.thumbnail_url = img.image_url
-            img.high_res_url = img.image_url
+        image_variants = variants.for_image(img.image_url, plan, img.variants)
+        img.thumbnail_url = image_variants['thumbnail']
+        img.srcset = image_variants['srcset']
+        img.sizes = settings.IMAGE_VARIANTS['sizes']
+        img.high_res_url = image_variants['high_res']
     return history
 
 def dashboard(request):
     history = []
     if request.user.is_authenticated:
-        history = GeneratedImage.objects.filter(user=request.user)[:8]
+        history = _user_history(request)[:8]
         history = _optimize_image_urls(request, history)
     return render(request, 'core/dashboard.html', {'history': history})
 
 def history_view(request):
-    history = []
+    history, next_cursor, total = [], None, 0
     if request.user.is_authenticated:
-        history = GeneratedImage.objects.filter(user=request.user)
-        history = _optimize_image_urls(request, history)
-    return render(request, 'core/history.html', {'history': history})
+        # First page only; the template fetches the rest from history_page as the user scrolls
+        history, next_cursor = _history_page(request)
+        # Kept on the profile as images are saved: no per-user COUNT on every page load
+        total = request.user.userprofile.image_count
+    return render(request, 'core/history.html', {'history': history, 'next_cursor': next_cursor, 'total': total})
+
+@login_required
+def history_page(request):
+    """The page of the user's history after `cursor` (the previous page's next_cursor), as JSON."""
+    try:
+        history, next_cursor = _history_page(request, request.GET.get('cursor'))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    return JsonResponse({
+        'images': [{
+            'id': img.id,
+            'image_url': img.image_url,
+            'thumbnail_url': img.thumbnail_url,
+            'srcset': img.srcset,
+            'high_res_url': img.high_res_url,
+            'created_at': img.created_at.isoformat(),
+        } for img in history],
+        'sizes': settings.IMAGE_VARIANTS['sizes'],
+        'next_cursor': next_cursor,
+    })
+
+def _history_page(request, cursor=None):
+    """
+    One page of the user's images, newest first, and the cursor of the next
+    page (None on the last one). Pages are keyset-paginated on
+    (created_at, id): each starts strictly after the last row of the previous
+    one, so its cost doesn't grow with how far back it is, and images added
+    meanwhile don't shift or repeat rows.
+    """
+    page_size = settings.HISTORY_PAGE_SIZE
+    history = _user_history(request).order_by('-created_at', '-id')
+    if cursor:
+        created_at, pk = _decode_cursor(cursor)
+        history = history.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+    history = list(history[:page_size + 1])
+    next_cursor = _encode_cursor(history[page_size - 1]) if len(history) > page_size else None
+    return _optimize_image_urls(request, history[:page_size]), next_cursor
+
+def _encode_cursor(img):
+    return base64.urlsafe_b64encode(f"{img.created_at.isoformat()}|{img.id}".encode()).decode()
+
+def _decode_cursor(cursor):
+    """(created_at, id) of a cursor; ValueError when it isn't one."""
+    created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(created_at), int(pk)
 
 def about(request):
     return render(request, 'core/about.html')
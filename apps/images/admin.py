@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.utils.safestring import mark_safe
-from .models import GeneratedImage
+from .models import GeneratedImage, GenerationJob, CatalogJob, QuotaBucket
+from .quota import governor
 
 @admin.register(GeneratedImage)
 class GeneratedImageAdmin(admin.ModelAdmin):
@@ -14,3 +15,41 @@ class GeneratedImageAdmin(admin.ModelAdmin):
             return mark_safe(f'<img src="{obj.image_url}" style="max-height: 100px; border-radius: 4px;" />')
         return "No image"
     image_preview.short_description = "Preview"
+
+
+@admin.register(GenerationJob)
+class GenerationJobAdmin(admin.ModelAdmin):
+    list_display = ('task_id', 'user', 'status', 'phase', 'progress', 'attempts', 'refunded', 'created_at')
+    list_filter = ('status', 'phase', 'created_at')
+    search_fields = ('task_id', 'product', 'user__username', 'user__email')
+    readonly_fields = ('created_at', 'updated_at')
+    raw_id_fields = ('catalog',)
+
+    def progress(self, obj):
+        return f"{len(obj.results)}/{obj.total}"
+    progress.short_description = "Images"
+
+
+@admin.register(CatalogJob)
+class CatalogJobAdmin(admin.ModelAdmin):
+    list_display = ('catalog_id', 'user', 'products', 'share_context', 'created_at')
+    search_fields = ('catalog_id', 'user__username', 'user__email')
+    readonly_fields = ('created_at', 'updated_at')
+
+    def products(self, obj):
+        return obj.items.count()
+    products.short_description = "Products"
+
+
+@admin.register(QuotaBucket)
+class QuotaBucketAdmin(admin.ModelAdmin):
+    list_display = ('model', 'utilization', 'queued', 'granted', 'throttled')
+    readonly_fields = ('model', 'tat', 'granted', 'throttled')
+
+    def utilization(self, obj):
+        return f"{governor.utilization(obj).get('utilization', 0):.0%}"
+    utilization.short_description = "Utilization"
+
+    def queued(self, obj):
+        return governor.utilization(obj).get('queued', 0)
+    queued.short_description = "Queued calls"
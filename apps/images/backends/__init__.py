@@ -0,0 +1,40 @@
+"""
+Pluggable backends for the generation pipeline: the image model (Director,
+Artist), the text model (Prompt Engineer) and the object storage final images
+are published to. Each is selected by a dotted path in
+settings.GENERATION_BACKENDS; fake.py provides offline stand-ins.
+"""
+import threading
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+_instances = {}
+_lock = threading.Lock()
+
+
+def get_backend(role):
+    """Process-wide instance of the backend configured for a role."""
+    with _lock:
+        backend = _instances.get(role)
+        if backend is None:
+            backend = import_string(settings.GENERATION_BACKENDS[role])()
+            _instances[role] = backend
+        return backend
+
+
+def image_model():
+    return get_backend('image_model')
+
+
+def text_model():
+    return get_backend('text_model')
+
+
+def storage():
+    return get_backend('storage')
+
+
+def reset():
+    """Forget the instances (after changing GENERATION_BACKENDS at runtime)."""
+    with _lock:
+        _instances.clear()
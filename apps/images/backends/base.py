@@ -0,0 +1,61 @@
+import asyncio
+
+
+class ImageModel:
+    """
+    Image generation backend (Director and Artist calls).
+    `contents` is the request as the pipeline builds it: an instruction string
+    followed by input Parts from file_store().
+    """
+
+    # Name used for rate limiting and the cluster-wide quota
+    model = None
+
+    def generate(self, contents):
+        """Return the generated image bytes, or None if the model returned no image."""
+        raise NotImplementedError
+
+    async def agenerate(self, contents):
+        return await asyncio.to_thread(self.generate, contents)
+
+    def file_store(self):
+        """FileRefStore that turns input bytes into Parts this backend accepts."""
+        raise NotImplementedError
+
+
+class TextModel:
+    """Text generation backend (the Prompt Engineer call)."""
+
+    model = None
+
+    def generate(self, contents):
+        """Return the response text ('' if empty)."""
+        raise NotImplementedError
+
+    async def agenerate(self, contents):
+        return await asyncio.to_thread(self.generate, contents)
+
+    def generate_json(self, contents, schema):
+        """
+        Return JSON text conforming to `schema` (a JSON schema dict).
+        Backends without constrained decoding fall back to generate() and
+        rely on the instruction; the caller validates either way.
+        """
+        return self.generate(contents)
+
+    async def agenerate_json(self, contents, schema):
+        return await asyncio.to_thread(self.generate_json, contents, schema)
+
+
+class ObjectStorage:
+    """Where final images are published. upload() returns a public URL."""
+
+    name = None
+
+    def upload(self, data, folder, fmt, eager=()):
+        """`eager`: transformations (variants.py) to derive right away; backends without derivations ignore it."""
+        raise NotImplementedError
+
+    def is_size_error(self, exc):
+        """True if the upload was rejected for its size (the caller then re-encodes smaller)."""
+        return False
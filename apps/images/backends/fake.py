@@ -0,0 +1,200 @@
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+from functools import lru_cache
+from io import BytesIO
+from PIL import Image, ImageFilter
+from django.conf import settings
+from .base import ImageModel, TextModel, ObjectStorage
+from .. import file_refs
+
+logger = logging.getLogger(__name__)
+
+
+class FakeAPIError(Exception):
+    """Raised for injected faults; `code` mirrors the HTTP status a real backend would return."""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class _Faults:
+    """
+    Seeded fault injector shared by all fake backends in the process.
+    Each call may start a burst of FAKE_BACKEND['throttle_burst'] consecutive
+    429s (probability 'throttle_rate') or fail with a 503 ('error_rate').
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rng = random.Random(settings.FAKE_BACKEND['seed'])
+        self._burst_left = 0
+
+    def latency(self, seconds):
+        jitter = settings.FAKE_BACKEND['jitter']
+        with self._lock:
+            return max(0.0, seconds * (1 + self._rng.uniform(-jitter, jitter)))
+
+    def check(self):
+        config = settings.FAKE_BACKEND
+        with self._lock:
+            if not self._burst_left and self._rng.random() < config['throttle_rate']:
+                self._burst_left = config['throttle_burst']
+            if self._burst_left:
+                self._burst_left -= 1
+                raise FakeAPIError(429, "RESOURCE_EXHAUSTED (injected)")
+            if self._rng.random() < config['error_rate']:
+                raise FakeAPIError(503, "UNAVAILABLE (injected)")
+
+
+_faults = None
+_faults_lock = threading.Lock()
+
+# Bytes that would have crossed the network, for benchmarks
+_traffic = {}
+_traffic_lock = threading.Lock()
+
+
+def faults():
+    global _faults
+    with _faults_lock:
+        if _faults is None:
+            _faults = _Faults()
+        return _faults
+
+
+def _record(**amounts):
+    with _traffic_lock:
+        for name, n in amounts.items():
+            _traffic[name] = _traffic.get(name, 0) + n
+
+
+def traffic():
+    """Requests and bytes sent/received by the fake backends since the last reset_traffic()."""
+    with _traffic_lock:
+        return dict(_traffic)
+
+
+def reset_traffic():
+    with _traffic_lock:
+        _traffic.clear()
+
+
+def _payload_bytes(contents):
+    size = 0
+    for item in contents:
+        if isinstance(item, str):
+            size += len(item.encode())
+        elif getattr(item, 'inline_data', None):
+            size += len(item.inline_data.data)
+        elif getattr(item, 'file_data', None):
+            size += len(item.file_data.file_uri)
+    return size
+
+
+def _instruction(contents):
+    return next((c for c in contents if isinstance(c, str)), '')
+
+
+@lru_cache(maxsize=32)
+def synthetic_image(key, size):
+    """Deterministic photo-like PNG for `key`: seeded low-frequency noise over a gradient."""
+    rng = random.Random(key)
+    cells = max(1, size // 16)
+    noise = Image.frombytes('RGB', (cells, cells), rng.randbytes(cells * cells * 3))
+    img = Image.blend(
+        noise.resize((size, size), Image.Resampling.BICUBIC),
+        Image.linear_gradient('L').resize((size, size)).convert('RGB'),
+        0.3
+    ).filter(ImageFilter.SMOOTH)
+    buffer = BytesIO()
+    img.save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+class _FakeCall:
+    """Shared latency + fault injection around a fake response."""
+
+    latency_key = None
+
+    def _respond(self, contents):
+        raise NotImplementedError
+
+    def generate(self, contents):
+        _record(requests=1, bytes_sent=_payload_bytes(contents))
+        time.sleep(faults().latency(settings.FAKE_BACKEND[self.latency_key]))
+        faults().check()
+        return self._received(self._respond(contents))
+
+    async def agenerate(self, contents):
+        _record(requests=1, bytes_sent=_payload_bytes(contents))
+        await asyncio.sleep(faults().latency(settings.FAKE_BACKEND[self.latency_key]))
+        faults().check()
+        return self._received(await asyncio.to_thread(self._respond, contents))
+
+    @staticmethod
+    def _received(response):
+        _record(bytes_received=len(response))
+        return response
+
+
+class FakeFileStore(file_refs.LocalFileStore):
+    """LocalFileStore that counts file uploads as sent bytes."""
+
+    def _upload(self, data, mime_type):
+        _record(file_uploads=1, bytes_sent=len(data))
+        return super()._upload(data, mime_type)
+
+
+class FakeImageModel(_FakeCall, ImageModel):
+    """Offline image model: returns a synthetic image derived from the instruction."""
+
+    model = 'gemini-3-pro-image-preview' # Same quota/limiter key as the real model
+    latency_key = 'image_latency'
+
+    def __init__(self):
+        self._file_store = FakeFileStore()
+
+    def _respond(self, contents):
+        key = hashlib.sha256(f"{settings.FAKE_BACKEND['seed']}:{_instruction(contents)}".encode()).hexdigest()
+        return synthetic_image(key, settings.FAKE_BACKEND['image_size'])
+
+    def file_store(self):
+        return self._file_store
+
+
+class FakeTextModel(_FakeCall, TextModel):
+    """Offline Prompt Engineer: returns as many JSON prompts as the instruction asks for."""
+
+    model = 'gemini-3-pro-preview'
+    latency_key = 'text_latency'
+    categories = ('hero', 'lifestyle', 'detail', 'ad')
+
+    def _respond(self, contents):
+        instruction = _instruction(contents)
+        match = re.search(r'exactly (\d+)', instruction)
+        count = int(match.group(1)) if match else 4
+        salt = hashlib.sha256(instruction.encode()).hexdigest()[:8]
+        return json.dumps({'prompts': [
+            {'category': self.categories[n % 4], 'prompt': f"Synthetic campaign scene {salt}-{n + 1}, soft key light"}
+            for n in range(count)
+        ]})
+
+
+class FakeStorage(ObjectStorage):
+    """Offline object storage: waits like an upload and returns a stable fake URL."""
+
+    name = 'fake'
+
+    def upload(self, data, folder, fmt, eager=()):
+        _record(uploads=1, bytes_sent=len(data))
+        time.sleep(faults().latency(settings.FAKE_BACKEND['upload_latency']))
+        faults().check()
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        return f"https://fake.invalid/image/upload/{folder}/{digest}.{fmt}"
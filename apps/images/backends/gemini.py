@@ -0,0 +1,82 @@
+import logging
+from google.genai import types
+from .base import ImageModel, TextModel
+from .. import clients, file_refs
+
+logger = logging.getLogger(__name__)
+
+
+def first_image(response):
+    """Return the first inline image payload of a generate_content response."""
+    if response.candidates and response.candidates[0].content.parts:
+        for part in response.candidates[0].content.parts:
+            if hasattr(part, 'inline_data') and part.inline_data:
+                return part.inline_data.data
+    return None
+
+
+def _generate_content(model, contents, **kwargs):
+    """
+    generate_content through the pooled client. If a referenced input file
+    expired or was deleted early, the references are dropped and the call is
+    made once more with the inputs inline.
+    """
+    client = clients.get_client()
+    store = file_refs.get_store(client)
+    try:
+        return client.models.generate_content(model=model, contents=store.resolve(contents), **kwargs)
+    except Exception as e:
+        if not file_refs.is_missing_file_error(e):
+            raise
+        logger.warning(f"Gemini input file missing, retrying inline: {e}")
+        return client.models.generate_content(model=model, contents=store.drop_refs(contents), **kwargs)
+
+
+async def _agenerate_content(model, contents, **kwargs):
+    """Async counterpart of _generate_content."""
+    client = clients.get_client()
+    store = file_refs.get_store(client)
+    try:
+        return await client.aio.models.generate_content(model=model, contents=store.resolve(contents), **kwargs)
+    except Exception as e:
+        if not file_refs.is_missing_file_error(e):
+            raise
+        logger.warning(f"Gemini input file missing, retrying inline: {e}")
+        return await client.aio.models.generate_content(model=model, contents=store.drop_refs(contents), **kwargs)
+
+
+class GeminiImageModel(ImageModel):
+    """Gemini 3 Pro Image through the pooled google-genai client."""
+
+    model = 'gemini-3-pro-image-preview'
+
+    def generate(self, contents):
+        return first_image(_generate_content(self.model, contents))
+
+    async def agenerate(self, contents):
+        return first_image(await _agenerate_content(self.model, contents))
+
+    def file_store(self):
+        return file_refs.get_store(clients.get_client())
+
+
+class GeminiTextModel(TextModel):
+    """Gemini 3 Pro Preview through the pooled google-genai client."""
+
+    model = 'gemini-3-pro-preview'
+
+    def generate(self, contents):
+        return _generate_content(self.model, contents).text or ""
+
+    async def agenerate(self, contents):
+        return (await _agenerate_content(self.model, contents)).text or ""
+
+    def generate_json(self, contents, schema):
+        return _generate_content(self.model, contents, config=_json_config(schema)).text or ""
+
+    async def agenerate_json(self, contents, schema):
+        return (await _agenerate_content(self.model, contents, config=_json_config(schema))).text or ""
+
+
+def _json_config(schema):
+    return types.GenerateContentConfig(response_mime_type='application/json', response_json_schema=schema)
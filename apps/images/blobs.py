@@ -0,0 +1,108 @@
+import os
+import mmap
+import uuid
+import hashlib
+import logging
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from .models import InputBlob
+
+logger = logging.getLogger(__name__)
+
+
+class BlobStore:
+    """
+    Content-addressed store for uploaded product images on local disk, so huey
+    task payloads carry a digest instead of the image bytes. Files live under
+    <root>/<d[:2]>/<d[2:4]>/<digest> and are written durably (temp file,
+    fsync, rename, fsync of the directory). Each job holding a blob counts one
+    reference in its InputBlob row; the file is removed with the last one.
+    The web process and the huey consumer must share `root`.
+    """
+
+    def __init__(self, root):
+        self.root = str(root)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put(self, chunks):
+        """Spool `chunks` (bytes, or an iterable of bytes) into the store and take a reference; returns the digest."""
+        if isinstance(chunks, (bytes, bytearray, memoryview)):
+            chunks = [chunks]
+        tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+        digest, size = hashlib.sha256(), 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            digest = digest.hexdigest()
+            try:
+                self._link(digest, size, tmp_path)
+            except IntegrityError:
+                # Another process created the row for the same content first
+                self._link(digest, size, tmp_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest
+
+    def _link(self, digest, size, tmp_path):
+        # Write before reading: the refcount update takes the row (or SQLite
+        # database) lock up front, ordering this against a concurrent release()
+        with transaction.atomic():
+            if not InputBlob.objects.filter(digest=digest).update(refs=F('refs') + 1):
+                InputBlob.objects.create(digest=digest, size=size, refs=1)
+            final = self.path(digest)
+            if os.path.exists(final):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(final), exist_ok=True)
+                os.replace(tmp_path, final)
+                _fsync_dir(os.path.dirname(final))
+
+    def release(self, digest):
+        """Drop one reference; the file is deleted with the last one."""
+        with transaction.atomic():
+            if not InputBlob.objects.filter(digest=digest, refs__gt=0).update(refs=F('refs') - 1):
+                return
+            if not InputBlob.objects.filter(digest=digest, refs=0).delete()[0]:
+                return
+            try:
+                os.remove(self.path(digest))
+            except FileNotFoundError:
+                pass
+        logger.info(f"Blob {digest[:12]} released")
+
+    @contextmanager
+    def open(self, digest):
+        """Memory-map a blob read-only; the map is file-like (read/seek) and bytes-like."""
+        with open(self.path(digest), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b''
+                return
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield mapped
+            finally:
+                mapped.close()
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+blob_store = BlobStore(root=settings.BLOB_STORE['root'])
@@ -0,0 +1,128 @@
+import os
+import time
+import hashlib
+import threading
+import logging
+from django.conf import settings
+from . import prompts, metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ArtifactCache:
+    """
+    Content-addressed cache for Director (Phase 1) and Engineer (Phase 2) outputs.
+    Entries live as files on local disk: mtime records when an entry was written
+    (TTL), atime is bumped on every hit (LRU). Eviction runs after each write and
+    keeps the directory under max_bytes.
+    """
+
+    def __init__(self, root, max_bytes, ttl):
+        self.root = str(root)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+    @staticmethod
+    def key(phase, img_bytes, *parts):
+        """Hash of the phase, prompt-template version, input bytes and any extra parts."""
+        digest = hashlib.sha256()
+        digest.update(f"{phase}:{prompts.PROMPT_VERSION}".encode())
+        digest.update(hashlib.sha256(img_bytes).digest())
+        for part in parts:
+            digest.update(b'\0' + str(part).encode())
+        return f"{phase}-{digest.hexdigest()}"
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+        metrics.ARTIFACT_CACHE_EVENTS.labels(name).inc(n)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            st = os.stat(path)
+            if time.time() - st.st_mtime > self.ttl:
+                os.remove(path)
+                raise FileNotFoundError(path)
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path, (time.time(), st.st_mtime))
+        except FileNotFoundError:
+            self._count('misses')
+            return None
+        except OSError as e:
+            logger.warning(f"Artifact cache read failed for {key}: {e}")
+            self._count('misses')
+            return None
+        self._count('hits')
+        return data
+
+    def set(self, key, data):
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+            self._count('writes')
+            self._evict()
+        except OSError as e:
+            logger.warning(f"Artifact cache write failed for {key}: {e}")
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    st = entry.stat()
+                    entries.append((entry.path, st))
+        return entries
+
+    def _evict(self):
+        now = time.time()
+        entries = []
+        for path, st in self._entries():
+            if now - st.st_mtime > self.ttl:
+                self._remove(path)
+            else:
+                entries.append((st.st_atime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        # Least recently used first
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            self._count('evictions')
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+        lookups = snapshot['hits'] + snapshot['misses']
+        snapshot['hit_rate'] = snapshot['hits'] / lookups if lookups else 0.0
+        try:
+            entries = self._entries()
+        except FileNotFoundError:
+            entries = []
+        snapshot['entries'] = len(entries)
+        snapshot['bytes'] = sum(st.st_size for _, st in entries)
+        return snapshot
+
+
+artifact_cache = ArtifactCache(
+    root=settings.ARTIFACT_CACHE['root'],
+    max_bytes=settings.ARTIFACT_CACHE['max_bytes'],
+    ttl=settings.ARTIFACT_CACHE['ttl'],
+)
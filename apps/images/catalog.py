@@ -0,0 +1,273 @@
+import io
+import csv
+import zlib
+import hashlib
+import logging
+import zipfile
+import posixpath
+from contextlib import nullcontext
+from functools import partial
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from . import uploads
+from .blobs import blob_store
+from .models import CatalogJob
+from .progress import save_artifact
+
+logger = logging.getLogger(__name__)
+
+MODES = ('creative', 'model', 'background')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.heic', '.avif', '.gif')
+CHUNK_SIZE = 64 * 1024
+
+
+class CatalogError(ValueError):
+    """The submitted catalog can't be accepted; the message is shown to the user."""
+
+
+def read_products(plan, archive=None, files=(), manifest=None, mode='creative', user_prompt='', count=4):
+    """
+    Collect the products of a bulk submission from a ZIP `archive` and/or
+    uploaded `files`. An optional CSV `manifest` (columns: file, mode,
+    user_prompt, count) overrides the defaults per product, matched on the
+    file's base name. Each image is checked against the plan's upload limits
+    and streamed into the blob store, one at a time, so a catalog is never
+    held in memory. Returns [{'name', 'input_blob', 'mode', 'user_prompt',
+    'count'}]; each input_blob holds a reference (release_products()).
+    """
+    config = settings.CATALOG
+    limits = uploads.plan_limits(plan)
+    max_mb = min(config['max_file_mb'], limits['max_mb'])
+    max_bytes = int(max_mb * 1024 * 1024)
+    with (_open_archive(archive) if archive else nullcontext()) as zf:
+        # (name, chunks) of each image; nothing is read until it is spooled
+        images = _archive_entries(zf, max_bytes, max_mb) if zf else []
+        for upload in files:
+            if upload.size > max_bytes:
+                raise CatalogError(f"{upload.name} is larger than {max_mb:g} MB")
+            images.append((posixpath.basename(upload.name), upload.chunks))
+        if not images:
+            raise CatalogError("No product images found")
+        if len(images) > config['max_products']:
+            raise CatalogError(f"A catalog can have at most {config['max_products']} products")
+
+        overrides = _read_manifest(manifest) if manifest else {}
+        products, seen = [], set()
+        for name, chunks in images:
+            if name in seen:
+                raise CatalogError(f"Duplicate file name: {name}")
+            seen.add(name)
+            row = overrides.pop(name, {})
+            products.append({
+                'name': name,
+                'chunks': chunks,
+                'mode': _mode(row.get('mode') or mode, name),
+                'user_prompt': (row.get('user_prompt') or user_prompt).strip(),
+                'count': _count(row.get('count') or count, name),
+            })
+        if overrides:
+            raise CatalogError(f"Manifest rows without a matching image: {', '.join(sorted(overrides))}")
+
+        max_pixels = int(limits['max_megapixels'] * 1_000_000)
+        try:
+            for product in products:
+                product['input_blob'] = _spool(product['name'], product.pop('chunks'), max_pixels)
+        except BaseException:
+            release_products(products)
+            raise
+    return products
+
+
+def release_products(products):
+    """Drop the blob references read_products() took (the submission was not accepted)."""
+    for product in products:
+        if product.get('input_blob'):
+            blob_store.release(product['input_blob'])
+
+
+def _spool(name, chunks, max_pixels):
+    header_check = uploads.ImageHeaderCheck(max_pixels)
+
+    def checked_chunks():
+        for chunk in chunks():
+            header_check.feed(chunk)
+            yield chunk
+        header_check.finish()
+
+    try:
+        return blob_store.put(checked_chunks())
+    except uploads.UploadRejected as e:
+        raise CatalogError(f"{name}: {e.message}")
+    except (zipfile.BadZipFile, zlib.error, EOFError):
+        raise CatalogError(f"{name} is corrupt in the archive")
+
+
+def _open_archive(archive):
+    try:
+        return zipfile.ZipFile(archive)
+    except zipfile.BadZipFile:
+        raise CatalogError("The archive is not a valid ZIP file")
+
+
+def _archive_entries(zf, max_bytes, max_mb):
+    images = []
+    for info in zf.infolist():
+        name = posixpath.basename(info.filename)
+        if info.is_dir() or info.filename.startswith('__MACOSX/') or name.startswith('.'):
+            continue
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        if info.flag_bits & 0x1:
+            raise CatalogError(f"{name} is encrypted in the archive")
+        # file_size is the declared uncompressed size (and zipfile never inflates past it): refuse up front
+        if info.file_size > max_bytes:
+            raise CatalogError(f"{name} is larger than {max_mb:g} MB")
+        images.append((name, partial(_member_chunks, zf, info)))
+        if len(images) > settings.CATALOG['max_products']:
+            break
+    return images
+
+
+def _member_chunks(zf, info):
+    with zf.open(info) as member:
+        yield from iter(partial(member.read, CHUNK_SIZE), b'')
+
+
+def max_request_bytes():
+    """Largest catalog request any plan may send: every product at its size limit, plus room for the manifest and fields."""
+    max_mb = min(settings.CATALOG['max_file_mb'], max(limits['max_mb'] for limits in settings.UPLOAD_LIMITS.values()))
+    return int(settings.CATALOG['max_products'] * max_mb * 1024 * 1024) + 1024 * 1024
+
+
+def _read_manifest(manifest):
+    try:
+        text = manifest.read().decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise CatalogError("The manifest must be a UTF-8 CSV file")
+    rows = {}
+    for row in csv.DictReader(io.StringIO(text)):
+        row = {(k or '').strip().lower(): (v or '').strip() for k, v in row.items()}
+        name = posixpath.basename(row.get('file') or row.get('filename') or '')
+        if not name:
+            raise CatalogError("Every manifest row needs a 'file' column")
+        rows[name] = {
+            'mode': row.get('mode', '').lower(),
+            'user_prompt': row.get('user_prompt') or row.get('prompt', ''),
+            'count': row.get('count', ''),
+        }
+    return rows
+
+
+def _mode(value, name):
+    if value not in MODES:
+        raise CatalogError(f"{name}: unknown mode '{value}'")
+    return value
+
+
+def _count(value, name):
+    try:
+        count = int(value)
+    except (TypeError, ValueError):
+        count = 0
+    if count < 1:
+        raise CatalogError(f"{name}: count must be a positive number")
+    return count
+
+
+# Shared Director/Engineer context.
+# Products with the same mode and prompt reuse the first product's reference
+# image (and, for the same image count, its prompt list) through the job
+# checkpoints, so each extra product only pays for its Artist calls.
+
+def context_key(mode, user_prompt):
+    return f"{mode}:{hashlib.sha256(user_prompt.encode()).hexdigest()[:12]}"
+
+
+def seed_job(job):
+    """Pre-fill a catalog item's checkpoints from artifacts already shared in its catalog."""
+    catalog = job.catalog
+    if not catalog or not catalog.share_context or job.reference_image:
+        return
+    key = context_key(job.mode, job.user_prompt)
+    reference = catalog.context.get(f"reference:{key}")
+    if not reference:
+        return
+    try:
+        with default_storage.open(reference, 'rb') as f:
+            job.reference_image = save_artifact(job, 'reference', f.read())
+    except OSError as e:
+        logger.warning(f"Catalog {catalog.catalog_id}: shared reference unreadable: {e}")
+        return
+    job.prompts = job.prompts or catalog.context.get(f"prompts:{key}:{job.count}", [])
+    job.save(update_fields=['reference_image', 'prompts', 'updated_at'])
+    logger.info(f"Job {job.task_id}: reusing catalog context {key} ({len(job.prompts)} prompts)")
+
+
+def share_reference(job, data):
+    key = f"reference:{context_key(job.mode, job.user_prompt)}"
+    if key not in job.catalog.context:
+        path = default_storage.save(f"catalogs/{job.catalog.catalog_id}/{key.replace(':', '-')}", ContentFile(data))
+        if not _share(job.catalog, key, path):
+            default_storage.delete(path)
+
+
+def share_prompts(job, prompts):
+    _share(job.catalog, f"prompts:{context_key(job.mode, job.user_prompt)}:{job.count}", prompts)
+
+
+def _share(catalog, key, value):
+    """Record a shared artifact unless another product got there first; returns whether it was stored."""
+    with transaction.atomic():
+        locked = CatalogJob.objects.select_for_update().get(id=catalog.id)
+        if key in locked.context:
+            catalog.context = locked.context
+            return False
+        locked.context[key] = value
+        locked.save(update_fields=['context', 'updated_at'])
+        catalog.context = locked.context
+        return True
+
+
+def delete_context(catalog):
+    for key, path in catalog.context.items():
+        if key.startswith('reference:') and default_storage.exists(path):
+            default_storage.delete(path)
+
+
+def summary(catalog, items):
+    """Aggregate progress and the result manifest of a catalog's items."""
+    finished = [item for item in items if item.status in ('success', 'error')]
+    if len(finished) < len(items):
+        status = 'processing'
+    else:
+        status = 'success' if any(item.status == 'success' for item in items) else 'error'
+    return {
+        'catalog_id': catalog.catalog_id,
+        'status': status,
+        'products': {
+            'total': len(items),
+            'done': sum(1 for item in finished if item.status == 'success'),
+            'failed': sum(1 for item in finished if item.status == 'error'),
+        },
+        'images': {
+            'completed': sum(len(item.results) for item in items),
+            'total': sum(item.total or item.count for item in items),
+        },
+        'items': [
+            {
+                'product': item.product,
+                'task_id': item.task_id,
+                'mode': item.mode,
+                'status': item.status,
+                'phase': item.phase,
+                'completed': len(item.results),
+                'total': item.total or item.count,
+                'urls': [r['url'] for r in item.results],
+                'refunded': item.refunded,
+                'message': item.message,
+            }
+            for item in items
+        ],
+    }
@@ -0,0 +1,119 @@
+import os
+import threading
+import logging
+import httpx
+from google import genai
+from google.genai import types
+from django.conf import settings
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Process-wide registry of Gemini clients, one per API key.
+# Each client keeps a keep-alive httpx pool so the 2+N calls of every job
+# (and of every following job) reuse warm TLS connections.
+_clients = {}
+_lock = threading.Lock()
+_stats = {}
+
+
+def _reset_stats():
+    _stats.update({
+        'clients_created': 0,
+        'client_reuses': 0,
+        'requests': 0,
+        'connections_opened': 0,
+    })
+
+
+_reset_stats()
+
+
+def _after_fork():
+    # Sockets inherited from the parent must never be shared with it:
+    # drop every pooled client and start with a fresh lock in the child.
+    global _lock
+    _lock = threading.Lock()
+    _clients.clear()
+    _reset_stats()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
+    metrics.GEMINI_HTTP_EVENTS.labels(key).inc()
+
+
+def _trace(event_name, info):
+    if event_name == 'connection.connect_tcp.complete':
+        _count('connections_opened')
+
+
+async def _atrace(event_name, info):
+    _trace(event_name, info)
+
+
+def _on_request(request):
+    _count('requests')
+    request.extensions['trace'] = _trace
+
+
+async def _aon_request(request):
+    _count('requests')
+    request.extensions['trace'] = _atrace
+
+
+def _build_client(api_key):
+    pool = settings.GEMINI_HTTP_POOL
+    limits = httpx.Limits(
+        max_connections=pool['max_connections'],
+        max_keepalive_connections=pool['max_keepalive_connections'],
+        keepalive_expiry=pool['keepalive_expiry'],
+    )
+    http_options = types.HttpOptions(
+        client_args={'limits': limits, 'event_hooks': {'request': [_on_request]}},
+        async_client_args={'limits': limits, 'event_hooks': {'request': [_aon_request]}},
+    )
+    return genai.Client(api_key=api_key, http_options=http_options)
+
+
+def get_client(api_key=None):
+    """
+    Return the pooled Gemini client for an API key, creating it on first use.
+    The async side (client.aio) binds its pool to the first event loop that
+    uses it, which is the shared loop in runner.py.
+    """
+    api_key = api_key or settings.GOOGLE_API_KEY
+    with _lock:
+        client = _clients.get(api_key)
+        if client is not None:
+            _stats['client_reuses'] += 1
+            metrics.GEMINI_HTTP_EVENTS.labels('client_reuses').inc()
+            return client
+        client = _build_client(api_key)
+        _clients[api_key] = client
+        _stats['clients_created'] += 1
+    metrics.GEMINI_HTTP_EVENTS.labels('clients_created').inc()
+    logger.info("Created pooled Gemini client")
+    return client
+
+
+def warm_up(api_key=None):
+    """Open a connection ahead of the first job with a cheap model listing."""
+    try:
+        next(iter(get_client(api_key).models.list(config={'page_size': 1})), None)
+        logger.info(f"Gemini client warmed up: {stats()}")
+    except Exception as e:
+        logger.warning(f"Gemini warm-up failed: {e}")
+
+
+def stats():
+    """Snapshot of registry counters; connection_reuses = requests served on an existing connection."""
+    with _lock:
+        snapshot = dict(_stats)
+    snapshot['connection_reuses'] = max(0, snapshot['requests'] - snapshot['connections_opened'])
+    return snapshot
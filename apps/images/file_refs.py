@@ -0,0 +1,207 @@
+import os
+import time
+import asyncio
+import hashlib
+import tempfile
+import threading
+import logging
+from io import BytesIO
+from google.genai import types
+from pydantic import PrivateAttr
+from django.conf import settings
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RefPart(types.Part):
+    """A by-reference Part that keeps the bytes it was uploaded from, to inline them if the file is gone."""
+
+    _source: bytes = PrivateAttr(default=None)
+
+
+def is_missing_file_error(exc):
+    """True when Gemini refused a request because a referenced file expired or was deleted."""
+    return getattr(exc, 'code', None) in (403, 404) and 'file' in str(exc).lower()
+
+
+class FileRefStore:
+    """
+    Turns image bytes into request Parts, uploading each distinct input once
+    and referencing it by URI in every later call instead of inlining it.
+    References are remembered per content hash until shortly before they
+    expire (GEMINI_FILE_REFS['expiry_margin']), then re-uploaded. Inputs
+    below 'min_bytes', or whose upload fails, are inlined as before. A
+    reference the provider no longer has (drop_refs) is forgotten, and
+    requests still holding it send the bytes inline instead (resolve).
+    Subclasses implement _upload(data, mime_type) -> (uri, expires_at).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refs = {}
+        self._dropped = set() # URIs found missing
+        self._stats = {'uploads': 0, 'reuses': 0, 'inlined': 0, 'upload_errors': 0, 'dropped': 0}
+
+    def _upload(self, data, mime_type):
+        raise NotImplementedError
+
+    async def _aupload(self, data, mime_type):
+        return await asyncio.to_thread(self._upload, data, mime_type)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+        metrics.FILE_REF_EVENTS.labels(name).inc()
+
+    def _lookup(self, digest):
+        margin = settings.GEMINI_FILE_REFS['expiry_margin']
+        with self._lock:
+            ref = self._refs.get(digest)
+            if ref and ref[2] - time.time() > margin:
+                self._stats['reuses'] += 1
+                metrics.FILE_REF_EVENTS.labels('reuses').inc()
+                return ref
+            self._refs.pop(digest, None)
+            return None
+
+    def _remember(self, digest, uri, mime_type, expires_at):
+        with self._lock:
+            self._refs[digest] = (uri, mime_type, expires_at)
+            self._stats['uploads'] += 1
+        metrics.FILE_REF_EVENTS.labels('uploads').inc()
+
+    def _should_inline(self, data):
+        config = settings.GEMINI_FILE_REFS
+        return not config['enabled'] or len(data) < config['min_bytes']
+
+    def _inline(self, data, mime_type):
+        self._count('inlined')
+        # Inline data must be real bytes (a no-op for bytes; copies a memory-mapped input)
+        return types.Part.from_bytes(data=bytes(data), mime_type=mime_type)
+
+    def part_for(self, data, mime_type):
+        if self._should_inline(data):
+            return self._inline(data, mime_type)
+        digest = hashlib.sha256(data).hexdigest()
+        ref = self._lookup(digest)
+        if ref is None:
+            try:
+                uri, expires_at = self._upload(data, mime_type)
+            except Exception as e:
+                logger.warning(f"File upload failed, inlining instead: {e}")
+                self._count('upload_errors')
+                return self._inline(data, mime_type)
+            self._remember(digest, uri, mime_type, expires_at)
+            ref = (uri, mime_type, expires_at)
+        return self._ref_part(ref, data)
+
+    async def apart_for(self, data, mime_type):
+        if self._should_inline(data):
+            return self._inline(data, mime_type)
+        digest = hashlib.sha256(data).hexdigest()
+        ref = self._lookup(digest)
+        if ref is None:
+            try:
+                uri, expires_at = await self._aupload(data, mime_type)
+            except Exception as e:
+                logger.warning(f"File upload failed, inlining instead: {e}")
+                self._count('upload_errors')
+                return self._inline(data, mime_type)
+            self._remember(digest, uri, mime_type, expires_at)
+            ref = (uri, mime_type, expires_at)
+        return self._ref_part(ref, data)
+
+    @staticmethod
+    def _ref_part(ref, data):
+        part = RefPart(file_data=types.FileData(file_uri=ref[0], mime_type=ref[1]))
+        part._source = data
+        return part
+
+    def invalidate(self, data):
+        """Forget the reference for these bytes (e.g. the provider deleted it early)."""
+        with self._lock:
+            self._refs.pop(hashlib.sha256(data).hexdigest(), None)
+
+    def drop_refs(self, contents):
+        """
+        A request failed on a missing file: forget every reference in
+        `contents` (the error doesn't say which one) and return the contents
+        with all of them inlined. Later part_for() calls upload again.
+        """
+        for item in contents:
+            if isinstance(item, RefPart):
+                self.invalidate(item._source)
+                with self._lock:
+                    self._dropped.add(item.file_data.file_uri)
+                self._count('dropped')
+        return self.resolve(contents)
+
+    def resolve(self, contents):
+        """`contents` with references found missing replaced by inline parts."""
+        with self._lock:
+            if not self._dropped:
+                return contents
+            dropped = set(self._dropped)
+        return [
+            self._inline(item._source, item.file_data.mime_type)
+            if isinstance(item, RefPart) and item.file_data.file_uri in dropped else item
+            for item in contents
+        ]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, cached_refs=len(self._refs))
+
+
+class GeminiFileStore(FileRefStore):
+    """Gemini Files API: uploads expire after 48 hours."""
+
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+
+    @staticmethod
+    def _expiry(uploaded):
+        if uploaded.expiration_time:
+            return uploaded.expiration_time.timestamp()
+        return time.time() + 47 * 3600
+
+    def _upload(self, data, mime_type):
+        uploaded = self.client.files.upload(file=BytesIO(data), config=types.UploadFileConfig(mime_type=mime_type))
+        logger.info(f"Uploaded input to Gemini Files API: {uploaded.uri} ({len(data)} bytes)")
+        return uploaded.uri, self._expiry(uploaded)
+
+    async def _aupload(self, data, mime_type):
+        uploaded = await self.client.aio.files.upload(file=BytesIO(data), config=types.UploadFileConfig(mime_type=mime_type))
+        logger.info(f"Uploaded input to Gemini Files API: {uploaded.uri} ({len(data)} bytes)")
+        return uploaded.uri, self._expiry(uploaded)
+
+
+class LocalFileStore(FileRefStore):
+    """Stand-in for tests and offline runs: writes inputs to a temp directory with a fixed TTL."""
+
+    def __init__(self, root=None, ttl=48 * 3600):
+        super().__init__()
+        self.root = root or tempfile.mkdtemp(prefix='file-refs-')
+        self.ttl = ttl
+
+    def _upload(self, data, mime_type):
+        path = os.path.join(self.root, hashlib.sha256(data).hexdigest())
+        with open(path, 'wb') as f:
+            f.write(data)
+        return f"file://{path}", time.time() + self.ttl
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(client):
+    """Process-wide Gemini file store for a (pooled) client."""
+    with _stores_lock:
+        store = _stores.get(id(client))
+        if store is None or store.client is not client:
+            store = GeminiFileStore(client)
+            _stores[id(client)] = store
+        return store
@@ -0,0 +1,84 @@
+import mmap
+import logging
+from io import BytesIO
+from PIL import Image, ImageOps
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def sniff_mime(data):
+    """Detect the real image type from magic bytes (None if unknown)."""
+    head = bytes(data[:16])
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[4:8] == b'ftyp' and head[8:12] in (b'heic', b'heix', b'mif1', b'msf1'):
+        return 'image/heic'
+    if head[4:8] == b'ftyp' and head[8:12] in (b'avif', b'avis'):
+        return 'image/avif'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    return None
+
+
+def _has_alpha(img):
+    if img.mode in ('RGBA', 'LA'):
+        return img.getextrema()[-1][0] < 255
+    return img.mode == 'P' and 'transparency' in img.info
+
+
+def normalize_input(data):
+    """
+    Prepare the uploaded product photo once for all 2+N Gemini calls:
+    sniff the real format, apply EXIF orientation, downsample to
+    GEMINI_INPUT['max_edge'] and re-encode compactly (JPEG, or PNG when the
+    image has transparency). Small, upright, Gemini-native inputs are
+    passed through unchanged. Returns (bytes, mime_type).
+    """
+    limits = settings.GEMINI_INPUT
+    mime = sniff_mime(data)
+
+    if isinstance(data, mmap.mmap):
+        # Pillow reads the mapping like a file, without copying it into a buffer first
+        data.seek(0)
+        source = data
+    else:
+        source = BytesIO(data)
+
+    try:
+        img = Image.open(source)
+    except Image.UnidentifiedImageError:
+        if mime:
+            # e.g. HEIC without a Pillow plugin: Gemini reads it natively
+            return data, mime
+        raise
+
+    with img:
+        max_edge = limits['max_edge']
+        oriented = img.getexif().get(0x0112, 1) in (1, None)
+        fits = max(img.size) <= max_edge
+        if mime in ('image/png', 'image/jpeg', 'image/webp') and oriented and fits and len(data) <= limits['passthrough_bytes']:
+            return data, mime
+
+        if img.format == 'JPEG' and not fits:
+            scale = max_edge / max(img.size)
+            img.draft('RGB', (int(img.width * scale), int(img.height * scale)))
+
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+        buffer = BytesIO()
+        if _has_alpha(img):
+            img.convert('RGBA').save(buffer, format='PNG', compress_level=6)
+            out_mime = 'image/png'
+        else:
+            img.convert('RGB').save(buffer, format='JPEG', quality=limits['jpeg_quality'], optimize=True)
+            out_mime = 'image/jpeg'
+
+    out = buffer.getvalue()
+    logger.info(f"Input normalized: {mime} {len(data)} bytes -> {out_mime} {len(out)} bytes ({img.width}x{img.height})")
+    return out, out_mime
@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import asyncio
+import resource
+import platform
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from huey.exceptions import RetryTask
+from apps.images import backends, services
+from apps.images.backends import fake
+from apps.images.progress import NullProgress
+from apps.images.runner import runner
+from .bench_postprocess import synthetic_image
+
+FAKE_BACKENDS = {
+    'image_model': 'apps.images.backends.fake.FakeImageModel',
+    'text_model': 'apps.images.backends.fake.FakeTextModel',
+    'storage': 'apps.images.backends.fake.FakeStorage',
+}
+
+PHASES = ('director', 'engineer', 'artist')
+
+# Options echoed into the report so runs can be compared like for like
+CONFIG_KEYS = (
+    'jobs', 'parallel', 'count', 'plan', 'path', 'input_size', 'image_size', 'image_latency', 'text_latency',
+    'upload_latency', 'jitter', 'error_rate', 'throttle_rate', 'seed', 'with_limits', 'with_cache',
+)
+
+
+class TimingProgress(NullProgress):
+    """Records when the pipeline enters each phase and when it returns."""
+
+    def __init__(self):
+        self.marks = {}
+        self.images = 0
+
+    def phase(self, name, total=None):
+        self.marks[name] = time.perf_counter()
+
+    def image_ready(self, index, result):
+        self.images += 1
+
+    def durations(self, end):
+        marks = sorted(self.marks.items(), key=lambda m: m[1]) + [('end', end)]
+        return {name: later - at for (name, at), (_, later) in zip(marks, marks[1:]) if name in PHASES}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile (None for no values)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        'mean': round(sum(values) / len(values), 4),
+        'p50': round(percentile(values, 50), 4),
+        'p95': round(percentile(values, 95), 4),
+        'p99': round(percentile(values, 99), 4),
+        'max': round(max(values), 4),
+    }
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1048576 if platform.system() == 'Darwin' else 1024)
+
+
+class Command(BaseCommand):
+    help = "Benchmark the three-phase generation pipeline against the offline fake backends"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jobs', type=int, default=8, help="Jobs to run")
+        parser.add_argument('--parallel', type=int, default=2, help="Jobs in flight at once (like HUEY_WORKERS)")
+        parser.add_argument('--count', type=int, default=4, help="Images per job")
+        parser.add_argument('--plan', default='agency', choices=sorted(settings.GENERATION_CONCURRENCY))
+        parser.add_argument('--path', default='sync', choices=['sync', 'async', 'task'],
+                            help="generate_campaign_images, agenerate_campaign_images, or generate_images_task end to end")
+        parser.add_argument('--input-size', type=int, default=2048, help="Edge of the synthetic product photo (px)")
+        parser.add_argument('--image-size', type=int, default=1024, help="Edge of the fake model's output (px)")
+        parser.add_argument('--image-latency', type=float, default=1.0)
+        parser.add_argument('--text-latency', type=float, default=0.5)
+        parser.add_argument('--upload-latency', type=float, default=0.2)
+        parser.add_argument('--jitter', type=float, default=0.2)
+        parser.add_argument('--error-rate', type=float, default=0.0)
+        parser.add_argument('--throttle-rate', type=float, default=0.0)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--with-limits', action='store_true',
+                            help="Keep the configured rate limiter and quota (off by default: they would dominate the timings)")
+        parser.add_argument('--with-cache', action='store_true', help="Keep the artifact cache enabled")
+        parser.add_argument('--output', help="Write the JSON report here (default: stdout only)")
+
+    def handle(self, *args, **options):
+        overrides = {
+            'GENERATION_BACKENDS': FAKE_BACKENDS,
+            'FAKE_BACKEND': {
+                'image_latency': options['image_latency'],
+                'text_latency': options['text_latency'],
+                'upload_latency': options['upload_latency'],
+                'jitter': options['jitter'],
+                'error_rate': options['error_rate'],
+                'throttle_rate': options['throttle_rate'],
+                'throttle_burst': settings.FAKE_BACKEND['throttle_burst'],
+                'image_size': options['image_size'],
+                'seed': options['seed'],
+            },
+        }
+        if not options['with_limits']:
+            overrides['GEMINI_QUOTA'] = dict(settings.GEMINI_QUOTA, enabled=False)
+            overrides['GEMINI_RATE_LIMIT'] = dict(settings.GEMINI_RATE_LIMIT, rate=1000.0, max_rate=1000.0, burst=1000)
+        if not options['with_cache']:
+            overrides['ARTIFACT_CACHE'] = dict(settings.ARTIFACT_CACHE, enabled=False)
+
+        with override_settings(**overrides):
+            backends.reset()
+            fake.reset_traffic()
+            try:
+                report = self.run(options)
+            finally:
+                backends.reset()
+
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(text + '\n')
+        self.stdout.write(text)
+        self.print_summary(report)
+
+    def run(self, options):
+        # Each job gets a distinct input so neither file refs nor caches collapse them
+        inputs = [
+            synthetic_image(options['input_size'], options['input_size'] + n, 'JPEG')
+            for n in range(options['jobs'])
+        ]
+        cpu_start, wall_start = cpu_seconds(), time.perf_counter()
+        if options['path'] == 'async':
+            jobs = runner.run(self.run_async_batch(inputs, options))
+        else:
+            run_job = self.run_task if options['path'] == 'task' else self.run_sync
+            with ThreadPoolExecutor(max_workers=options['parallel'], thread_name_prefix='bench-job') as pool:
+                jobs = list(pool.map(lambda data: run_job(data, options), inputs))
+        wall, cpu = time.perf_counter() - wall_start, cpu_seconds() - cpu_start
+        if options['path'] == 'task':
+            self.bench_user().delete()
+
+        latencies = [job['latency'] for job in jobs]
+        phases = {
+            name: summarize([job['phases'][name] for job in jobs if name in job.get('phases', {})])
+            for name in PHASES
+        }
+        images = sum(job['images'] for job in jobs)
+        return {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'config': {name: options[name] for name in CONFIG_KEYS},
+            'host': {'python': platform.python_version(), 'cpus': os.cpu_count(), 'pid': os.getpid()},
+            'jobs': len(jobs),
+            'images': images,
+            'failed_images': len(jobs) * options['count'] - images,
+            'wall_seconds': round(wall, 4),
+            'throughput_images_per_min': round(images / wall * 60, 2) if wall else None,
+            'cpu_seconds': round(cpu, 4),
+            'cpu_seconds_per_job': round(cpu / len(jobs), 4) if jobs else None,
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'job_latency': summarize(latencies),
+            'phases': phases,
+            'traffic': fake.traffic(),
+        }
+
+    def run_sync(self, data, options):
+        progress = TimingProgress()
+        start = time.perf_counter()
+        results = services.generate_campaign_images(
+            data, count=options['count'], plan=options['plan'], progress=progress
+        )
+        end = time.perf_counter()
+        return {'latency': end - start, 'phases': progress.durations(end), 'images': len(results)}
+
+    async def arun_job(self, data, options):
+        progress = TimingProgress()
+        start = time.perf_counter()
+        results = await services.agenerate_campaign_images(
+            data, count=options['count'], plan=options['plan'], progress=progress
+        )
+        end = time.perf_counter()
+        return {'latency': end - start, 'phases': progress.durations(end), 'images': len(results)}
+
+    async def run_async_batch(self, inputs, options):
+        slots = asyncio.Semaphore(options['parallel'])
+
+        async def bounded(data):
+            async with slots:
+                return await self.arun_job(data, options)
+
+        return await asyncio.gather(*(bounded(data) for data in inputs))
+
+    def run_task(self, data, options):
+        """generate_images_task end to end: job record, checkpoints, progress writes (no per-phase split)."""
+        from django.db import connection
+        from apps.images.blobs import blob_store
+        from apps.images.models import GenerationJob
+        from apps.images.progress import delete_artifacts
+        from apps.images.tasks import generate_images_task
+
+        user = self.bench_user()
+        input_blob = blob_store.put(data)
+        task = generate_images_task.s(
+            user_id=user.id, image_data=None, count=options['count'], mode='creative',
+            user_prompt='', plan=options['plan'], input_blob=input_blob
+        )
+        GenerationJob.objects.create(user=user, task_id=task.id, total=options['count'], count=options['count'],
+                                     plan=options['plan'], input_blob=input_blob)
+        start = time.perf_counter()
+        try:
+            task.execute()
+        except RetryTask:
+            pass # Came up short; counted through the job's results
+        finally:
+            latency = time.perf_counter() - start
+            job = GenerationJob.objects.get(task_id=task.id)
+            # A job left short isn't finalized: release its blob and checkpoints before the user is deleted
+            delete_artifacts(job)
+            connection.close()
+        return {'latency': latency, 'images': len(job.results)}
+
+    _bench_user_lock = threading.Lock()
+
+    def bench_user(self):
+        from django.contrib.auth.models import User
+        with self._bench_user_lock:
+            user, _ = User.objects.get_or_create(username='bench-pipeline', defaults={'email': 'bench@localhost'})
+            return user
+
+    def print_summary(self, report):
+        latency = report['job_latency'] or {}
+        self.stderr.write(
+            f"{report['jobs']} jobs / {report['images']} images in {report['wall_seconds']:.2f}s "
+            f"({report['throughput_images_per_min']} img/min), CPU {report['cpu_seconds']:.2f}s, "
+            f"peak RSS {report['peak_rss_mb']} MB"
+        )
+        if latency:
+            self.stderr.write(f"job latency p50 {latency['p50']:.2f}s  p95 {latency['p95']:.2f}s  p99 {latency['p99']:.2f}s")
+        for name, stats in report['phases'].items():
+            if stats:
+                self.stderr.write(f"  {name:9} p50 {stats['p50']:.3f}s  p95 {stats['p95']:.3f}s")
+        self.stderr.write(f"traffic: {report['traffic']}")
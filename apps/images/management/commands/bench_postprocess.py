@@ -0,0 +1,82 @@
+import time
+from io import BytesIO
+from PIL import Image, ImageFilter
+from django.core.management.base import BaseCommand
+from apps.images import postprocess
+
+
+def legacy_safeguard(data):
+    """The pre-postprocess path: safeguard resize, then the up-to-3-attempt optimize loop."""
+    with Image.open(BytesIO(data)) as img:
+        width, height = img.size
+        mp = (width * height) / 1000000
+        mb = len(data) / (1024 * 1024)
+        if mp > 24.8 or mb > 9.8:
+            scale = min(1.0, (24.0 / mp)**0.5 if mp > 24.0 else 0.9)
+            new_size = (int(width * scale), int(height * scale))
+            optimized_img = img.resize(new_size, Image.Resampling.LANCZOS)
+            temp_buffer = BytesIO()
+            optimized_img.save(temp_buffer, format="PNG", optimize=True)
+            data = temp_buffer.getvalue()
+
+    # Cloudinary rejection fallback, re-opened from bytes as before
+    with Image.open(BytesIO(data)) as img:
+        width, height = img.size
+        mp = (width * height) / 1000000
+        mb = len(data) / (1024 * 1024)
+        current_img = img
+        attempts = 0
+        while (mp > 24.5 or mb > 9.3) and attempts < 3:
+            attempts += 1
+            scale = 0.85
+            if mp > 25.0: scale = (24.0 / mp) ** 0.5
+            new_size = (int(current_img.size[0] * scale), int(current_img.size[1] * scale))
+            current_img = current_img.resize(new_size, Image.Resampling.LANCZOS)
+            temp_buffer = BytesIO()
+            current_img.save(temp_buffer, format="PNG", optimize=True)
+            data = temp_buffer.getvalue()
+            mp = (new_size[0] * new_size[1]) / 1000000
+            mb = len(data) / (1024 * 1024)
+    return data
+
+
+def synthetic_image(width, height, fmt):
+    """Photo-like test image: smooth gradients with fine grain (hard to compress, like real output)."""
+    base = Image.linear_gradient('L').resize((width, height))
+    grain = Image.effect_noise((width, height), 24).filter(ImageFilter.GaussianBlur(1))
+    img = Image.merge('RGB', (base, grain, base.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    buffer = BytesIO()
+    img.save(buffer, format=fmt, **({'quality': 95} if fmt == 'JPEG' else {}))
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = "Benchmark final-image post-processing (postprocess.fit_for_upload) against the legacy resize loop"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--width', type=int, default=6144)
+        parser.add_argument('--height', type=int, default=4608)
+        parser.add_argument('--format', default='PNG', choices=['PNG', 'JPEG'])
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--encoders', default='png,webp-lossless,webp')
+
+    def handle(self, *args, **options):
+        data = synthetic_image(options['width'], options['height'], options['format'])
+        w, h, _ = postprocess.probe(data)
+        self.stdout.write(f"Input: {w}x{h} {options['format']} {len(data) / 1048576:.1f} MB ({w * h / 1e6:.1f} MP)")
+
+        candidates = [('legacy loop', legacy_safeguard)]
+        for encoder in options['encoders'].split(','):
+            candidates.append((f"fit_for_upload[{encoder}]", lambda d, e=encoder: postprocess.fit_for_upload(d, encoder=e)[0]))
+
+        for name, fn in candidates:
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                out = fn(data)
+                timings.append(time.perf_counter() - start)
+            ow, oh, ofmt = postprocess.probe(out)
+            self.stdout.write(
+                f"{name:32} best {min(timings):6.2f}s  mean {sum(timings) / len(timings):6.2f}s  "
+                f"-> {ow}x{oh} {ofmt} {len(out) / 1048576:.2f} MB"
+            )
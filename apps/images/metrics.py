@@ -0,0 +1,190 @@
+"""
+Prometheus instrumentation for the generation pipeline.
+
+Metrics are process-local unless PROMETHEUS_MULTIPROC_DIR is set (see
+entrypoint.sh), in which case every gunicorn worker and the huey consumer
+write to that directory and /metrics aggregates them. Gauges that describe
+shared state (queue depth, queued job age) are computed at scrape time.
+"""
+import os
+import time
+import logging
+from contextlib import contextmanager
+from functools import wraps
+from asgiref.sync import iscoroutinefunction
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+from django.conf import settings
+from . import ratelimit
+
+logger = logging.getLogger(__name__)
+
+PHASE_SECONDS = Histogram(
+    'generation_phase_seconds', 'Wall time of each pipeline phase',
+    ['phase', 'path'], buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600),
+)
+JOB_SECONDS = Histogram(
+    'generation_job_seconds', 'Wall time of one generation task run',
+    ['status'], buckets=(5, 10, 20, 30, 60, 120, 300, 600, 900, 1800),
+)
+TASK_WAIT_SECONDS = Histogram(
+    'generation_task_wait_seconds', 'Time a job spent queued before a worker started it',
+    ['queue', 'plan'], buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+GEMINI_THROTTLED = Counter(
+    'gemini_throttled_total', 'Gemini 429 / RESOURCE_EXHAUSTED responses', ['model'],
+)
+UPLOAD_SECONDS = Histogram(
+    'upload_seconds', 'Duration of final image uploads', ['backend'],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+UPLOAD_BYTES = Histogram(
+    'upload_bytes', 'Size of uploaded final images', ['backend'],
+    buckets=tuple(mb * 1048576 for mb in (0.25, 0.5, 1, 2, 4, 6, 8, 10)),
+)
+POSTPROCESS_EVENTS = Counter(
+    'postprocess_events_total', 'Final image post-processing outcomes',
+    ['action'], # passthrough | resize | reencode | rejected
+)
+POSTPROCESS_SECONDS = Histogram(
+    'postprocess_seconds', 'Time spent fitting final images for upload',
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+)
+ENGINEER_PROMPTS = Counter(
+    'engineer_prompts_total', 'Prompt Engineer list items after validation',
+    ['outcome'], # accepted | rejected | reasked
+)
+DEDUPLICATED = Counter(
+    'generation_deduplicated_total', 'Generate requests attached to an identical job already in flight',
+)
+REQUESTS = Counter(
+    'generation_http_requests_total', 'Generate/status endpoint requests', ['endpoint', 'status'],
+)
+EVENT_STREAMS = Gauge(
+    'generation_event_streams', 'Open job progress event streams', multiprocess_mode='livesum',
+)
+GEMINI_HTTP_EVENTS = Counter(
+    'gemini_http_events_total', 'Pooled Gemini client activity (requests - connections_opened = reused connections)',
+    ['event'], # clients_created | client_reuses | requests | connections_opened
+)
+FILE_REF_EVENTS = Counter(
+    'gemini_file_ref_events_total', 'How input images were sent to Gemini',
+    ['event'], # uploads | reuses | inlined | upload_errors | dropped (found missing)
+)
+ARTIFACT_CACHE_EVENTS = Counter(
+    'artifact_cache_events_total', 'Director/Engineer artifact cache activity',
+    ['event'], # hits | misses | writes | evictions
+)
+
+
+class PhaseClock:
+    """Observes generation_phase_seconds for consecutive pipeline phases."""
+
+    def __init__(self, path):
+        self.path = path
+        self.current = None
+        self.started = None
+
+    def start(self, phase):
+        self.stop()
+        self.current = phase
+        self.started = time.perf_counter()
+
+    def stop(self):
+        if self.current:
+            PHASE_SECONDS.labels(self.current, self.path).observe(time.perf_counter() - self.started)
+            self.current = None
+
+
+@contextmanager
+def counting_throttles(model):
+    """Count a 429 raised inside the block against `model`, then re-raise it."""
+    try:
+        yield
+    except Exception as e:
+        if ratelimit.is_rate_limit_error(e):
+            GEMINI_THROTTLED.labels(model).inc()
+        raise
+
+
+def count_requests(endpoint):
+    """View decorator counting responses by status code (sync and async views)."""
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                response = await view(request, *args, **kwargs)
+                REQUESTS.labels(endpoint, str(response.status_code)).inc()
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            REQUESTS.labels(endpoint, str(response.status_code)).inc()
+            return response
+        return wrapper
+    return decorator
+
+
+class QueueCollector:
+    """Scrape-time gauges for the shared huey queues and queued GenerationJobs."""
+
+    def describe(self):
+        # Registering must not query the database
+        return []
+
+    def collect(self):
+        from django.db.models import Min
+        from django.utils import timezone
+        from django_huey import get_queue
+        from .models import GenerationJob
+
+        depth = GaugeMetricFamily('huey_queue_depth', 'Tasks waiting in each huey queue', labels=['queue', 'state'])
+        for name in settings.GENERATION_QUEUES:
+            try:
+                queue = get_queue(name)
+                depth.add_metric([name, 'pending'], queue.pending_count())
+                depth.add_metric([name, 'scheduled'], queue.scheduled_count())
+            except Exception as e:
+                logger.warning(f"Metrics: huey queue {name} unavailable: {e}")
+        yield depth
+
+        oldest = GenerationJob.objects.filter(status='queued').aggregate(oldest=Min('created_at'))['oldest']
+        yield GaugeMetricFamily(
+            'generation_oldest_queued_job_seconds', 'Age of the oldest job not yet started',
+            value=(timezone.now() - oldest).total_seconds() if oldest else 0,
+        )
+
+
+class ArtifactCacheCollector:
+    """Scrape-time size of the artifact cache directory, which every process on the host shares."""
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        from .cache import artifact_cache
+
+        stats = artifact_cache.stats()
+        yield GaugeMetricFamily('artifact_cache_entries', 'Entries in the artifact cache', value=stats['entries'])
+        yield GaugeMetricFamily('artifact_cache_bytes', 'Size of the artifact cache on disk', value=stats['bytes'])
+
+
+_collectors = [QueueCollector(), ArtifactCacheCollector()]
+if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    for _collector in _collectors:
+        REGISTRY.register(_collector)
+
+
+def render():
+    """Text exposition of all metrics (aggregated across processes in multiprocess mode)."""
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for collector in _collectors:
+        registry.register(collector)
+    return generate_latest(registry)
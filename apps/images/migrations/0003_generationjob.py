@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-18 12:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0002_alter_generatedimage_original_image'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.CharField(max_length=64, unique=True)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('processing', 'Processing'), ('success', 'Success'), ('error', 'Error')], default='queued', max_length=20)),
+                ('phase', models.CharField(choices=[('queued', 'Queued'), ('director', 'Phase 1: Reference Image'), ('engineer', 'Phase 2: Prompts'), ('artist', 'Phase 3: Final Images'), ('done', 'Done')], default='queued', max_length=20)),
+                ('total', models.IntegerField(default=0)),
+                ('results', models.JSONField(blank=True, default=list)),
+                ('message', models.CharField(blank=True, max_length=500)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generation_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
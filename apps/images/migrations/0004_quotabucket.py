@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 12:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0003_generationjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuotaBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100, unique=True)),
+                ('tat', models.FloatField(default=0.0)),
+                ('granted', models.PositiveBigIntegerField(default=0)),
+                ('throttled', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
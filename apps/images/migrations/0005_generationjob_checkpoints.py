@@ -0,0 +1,63 @@
+# Generated by Django 6.0 on 2026-10-18 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0004_quotabucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='failures',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='input_image',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='mode',
+            field=models.CharField(default='creative', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='plan',
+            field=models.CharField(default='free', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='prompts',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='reference_image',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='refunded',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='user_prompt',
+            field=models.TextField(blank=True),
+        ),
+    ]
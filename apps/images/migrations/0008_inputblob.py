@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-18 12:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0007_generationjob_request_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InputBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('refs', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='input_blob',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 13:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0008_inputblob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generatedimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-18 13:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0009_generatedimage_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='generatedimage',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='generatedimage_user_recent'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-18 13:41
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0010_generatedimage_user_recent_index'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='generationjob',
+            name='input_image',
+        ),
+    ]
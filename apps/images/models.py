@@ -1,16 +1,150 @@
 from django.db import models
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from cloudinary.models import CloudinaryField
+from apps.accounts.models import UserProfile
 
 class GeneratedImage(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='generated_images')
     original_image = CloudinaryField('image', folder='originals')
     image_url = models.URLField(max_length=500) # Drive link or local path
+    variants = models.JSONField(default=dict, blank=True) # Responsive URLs derived at upload (variants.py)
     created_at = models.DateTimeField(auto_now_add=True)
     count = models.IntegerField(default=1)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # A user's history, newest first (id breaks ties for keyset pages), without sorting it
+            models.Index(fields=['user', '-created_at', '-id'], name='generatedimage_user_recent'),
+        ]
 
     def __str__(self):
         return f"{self.user.email} - {self.created_at}"
+
+@receiver(post_save, sender=GeneratedImage)
+def count_generated_image(sender, instance, created, **kwargs):
+    if created:
+        UserProfile.objects.filter(user_id=instance.user_id).update(image_count=F('image_count') + 1)
+
+@receiver(post_delete, sender=GeneratedImage)
+def uncount_generated_image(sender, instance, **kwargs):
+    UserProfile.objects.filter(user_id=instance.user_id, image_count__gt=0).update(image_count=F('image_count') - 1)
+
+
+class CatalogJob(models.Model):
+    """
+    A bulk submission: one GenerationJob per product, dispatched a few at a
+    time (CATALOG['max_parallel']) so a whole catalog shares one concurrency
+    budget. Products with the same mode and prompt can reuse the first one's
+    Director/Engineer output, kept in `context`.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='catalog_jobs')
+    catalog_id = models.CharField(max_length=64, unique=True)
+    plan = models.CharField(max_length=20, default='free')
+    share_context = models.BooleanField(default=True)
+    context = models.JSONField(default=dict, blank=True) # Shared artifacts: {'reference:<key>': path, 'prompts:<key>:<count>': [...]}
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.catalog_id} ({self.user})"
+
+
+class GenerationJob(models.Model):
+    """
+    Durable progress record and checkpoint of one generation task. Phase
+    artifacts (input, reference image, prompt list) and per-image outcomes are
+    saved as they are produced, so a retried or resumed job continues from
+    the step that failed instead of repeating paid Gemini calls.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('processing', 'Processing'),
+        ('success', 'Success'),
+        ('error', 'Error'),
+    ]
+    PHASE_CHOICES = [
+        ('queued', 'Queued'),
+        ('director', 'Phase 1: Reference Image'),
+        ('engineer', 'Phase 2: Prompts'),
+        ('artist', 'Phase 3: Final Images'),
+        ('done', 'Done'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='generation_jobs')
+    task_id = models.CharField(max_length=64, unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    phase = models.CharField(max_length=20, choices=PHASE_CHOICES, default='queued')
+    total = models.IntegerField(default=0) # Images expected in Phase 3
+    results = models.JSONField(default=list, blank=True) # [{'index', 'url', 'prompt'}] in index order
+    message = models.CharField(max_length=500, blank=True)
+
+    # Request parameters, kept so a stalled job can be resumed without its huey payload
+    count = models.IntegerField(default=0) # Credits charged
+    mode = models.CharField(max_length=20, default='creative')
+    user_prompt = models.TextField(blank=True)
+    plan = models.CharField(max_length=20, default='free')
+
+    # Checkpoints (artifact paths are default_storage names)
+    input_blob = models.CharField(max_length=64, blank=True) # Uploaded image, digest in the local blob store (blobs.py)
+    reference_image = models.CharField(max_length=255, blank=True) # Phase 1 output
+    prompts = models.JSONField(default=list, blank=True) # Phase 2 output
+    failures = models.JSONField(default=list, blank=True) # [{'index', 'error'}] of the last attempt
+    attempts = models.IntegerField(default=0)
+    refunded = models.IntegerField(default=0) # Credits returned for images never delivered
+
+    # Single-flight key: hash of user + input + parameters, or of a client Idempotency-Key
+    request_key = models.CharField(max_length=64, blank=True)
+
+    # Bulk catalog membership (None for single-image jobs)
+    catalog = models.ForeignKey(CatalogJob, on_delete=models.CASCADE, null=True, blank=True, related_name='items')
+    product = models.CharField(max_length=255, blank=True) # File name within the catalog
+    dispatched_at = models.DateTimeField(null=True, blank=True) # When the catalog handed it to huey
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            # One in-flight job per identical request; duplicates attach to it
+            models.UniqueConstraint(
+                fields=['user', 'request_key'],
+                condition=models.Q(status__in=['queued', 'processing']) & ~models.Q(request_key=''),
+                name='unique_inflight_generation_request',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.task_id} ({self.status}, {len(self.results)}/{self.total})"
+
+
+class InputBlob(models.Model):
+    """Reference count of one uploaded image in the local blob store (see blobs.py)."""
+    digest = models.CharField(max_length=64, unique=True) # sha256 of the content
+    size = models.PositiveBigIntegerField(default=0)
+    refs = models.PositiveIntegerField(default=0) # Jobs still holding the blob
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.digest[:12]} ({self.refs} refs)"
+
+
+class QuotaBucket(models.Model):
+    """
+    Shared Gemini quota state for one model, used by every worker (see quota.py).
+    `tat` is the GCRA theoretical arrival time: the epoch second at which the
+    bucket drains back to empty if no further calls are reserved.
+    """
+    model = models.CharField(max_length=100, unique=True)
+    tat = models.FloatField(default=0.0)
+    granted = models.PositiveBigIntegerField(default=0) # Calls admitted since creation
+    throttled = models.PositiveIntegerField(default=0) # 429s reported back by workers
+
+    def __str__(self):
+        return self.model
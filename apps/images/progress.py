@@ -0,0 +1,150 @@
+import logging
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from .models import GeneratedImage, GenerationJob
+from .blobs import blob_store
+from .status_store import status_store
+
+logger = logging.getLogger(__name__)
+
+
+class NullProgress:
+    """Progress sink used when the pipeline runs without a job record (shell, benchmarks)."""
+
+    def phase(self, name, total=None):
+        pass
+
+    def image_ready(self, index, result):
+        pass
+
+    def image_failed(self, index, error):
+        pass
+
+    # Checkpoints: nothing is saved, so every run starts from scratch
+
+    def saved_reference(self):
+        return None
+
+    def save_reference(self, data):
+        pass
+
+    def saved_prompts(self):
+        return None
+
+    def save_prompts(self, prompts):
+        pass
+
+    def completed_results(self):
+        return {}
+
+
+class JobProgress(NullProgress):
+    """
+    Publishes pipeline progress to a GenerationJob row (and through to the
+    status store). Each finished image is saved to the user's history and
+    appended to the job as soon as it is uploaded, so the status endpoint can
+    return it right away.
+    The reference image and prompt list are checkpointed on the job, and
+    completed_results() lets a retried run skip images it already delivered.
+    Called from the thread that drives the pipeline only.
+    """
+
+    def __init__(self, job, count):
+        self.job = job
+        self.count = count
+
+    def phase(self, name, total=None):
+        self.job.phase = name
+        self.job.status = 'processing'
+        fields = ['phase', 'status', 'updated_at']
+        if total is not None:
+            self.job.total = total
+            fields.append('total')
+        self.job.save(update_fields=fields)
+        status_store.publish(self.job)
+        logger.info(f"Job {self.job.task_id}: phase {name}")
+
+    def image_ready(self, index, result):
+        GeneratedImage.objects.create(
+            user=self.job.user,
+            original_image=None,
+            image_url=result['url'],
+            variants=result.get('variants') or {},
+            count=self.count
+        )
+        entry = {'index': index, 'url': result['url'], 'prompt': result.get('prompt', ''), 'variants': result.get('variants') or {}}
+        self.job.results = sorted(
+            self.job.results + [entry],
+            key=lambda r: r['index']
+        )
+        self.job.failures = [f for f in self.job.failures if f['index'] != index]
+        self.job.save(update_fields=['results', 'failures', 'updated_at'])
+        status_store.publish(self.job)
+        logger.info(f"Job {self.job.task_id}: image {index + 1}/{self.job.total} published")
+
+    def image_failed(self, index, error):
+        self.job.failures = sorted(
+            [f for f in self.job.failures if f['index'] != index] + [{'index': index, 'error': str(error)[:200]}],
+            key=lambda f: f['index']
+        )
+        self.job.save(update_fields=['failures', 'updated_at'])
+
+    def saved_reference(self):
+        if not self.job.reference_image:
+            return None
+        try:
+            with default_storage.open(self.job.reference_image, 'rb') as f:
+                return f.read()
+        except OSError as e:
+            logger.warning(f"Job {self.job.task_id}: reference checkpoint unreadable, regenerating: {e}")
+            return None
+
+    def save_reference(self, data):
+        self.job.reference_image = save_artifact(self.job, 'reference', data)
+        self.job.save(update_fields=['reference_image', 'updated_at'])
+
+    def saved_prompts(self):
+        return self.job.prompts or None
+
+    def save_prompts(self, prompts):
+        self.job.prompts = prompts
+        self.job.save(update_fields=['prompts', 'updated_at'])
+
+    def completed_results(self):
+        return {
+            r['index']: {'url': r['url'], 'prompt': r['prompt'], 'index': r['index'], 'variants': r.get('variants') or {}}
+            for r in self.job.results
+        }
+
+
+class CatalogProgress(JobProgress):
+    """JobProgress for a catalog item: also offers its Director/Engineer output to the rest of the catalog."""
+
+    def save_reference(self, data):
+        super().save_reference(data)
+        if self.job.catalog.share_context:
+            from . import catalog
+            catalog.share_reference(self.job, data)
+
+    def save_prompts(self, prompts):
+        super().save_prompts(prompts)
+        if self.job.catalog.share_context and len(prompts) == self.job.count:
+            from . import catalog
+            catalog.share_prompts(self.job, prompts)
+
+
+def save_artifact(job, name, data):
+    """Store a job artifact (replacing any previous one); returns its storage name."""
+    path = f"jobs/{job.task_id}/{name}"
+    if default_storage.exists(path):
+        default_storage.delete(path)
+    return default_storage.save(path, ContentFile(data))
+
+
+def delete_artifacts(job):
+    if job.reference_image and default_storage.exists(job.reference_image):
+        default_storage.delete(job.reference_image)
+    # Clear the reference first so a job settled twice releases its blob once
+    if job.input_blob and GenerationJob.objects.filter(id=job.id, input_blob=job.input_blob).update(input_blob=''):
+        blob_store.release(job.input_blob)
+        job.input_blob = ''
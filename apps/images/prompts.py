@@ -1,5 +1,9 @@
 # Prompts for AI Image Generation
 
+# Bump whenever a prompt below changes: cached Director/Engineer artifacts
+# (apps/images/cache.py) are keyed on this version.
+PROMPT_VERSION = 'beta-v2.2'
+
 # ==========================================
 # 1. MODE-SPECIFIC RULES (The "Genre" Expertise)
 # ==========================================
@@ -106,6 +110,39 @@ PRIORITY LOGIC (How to distribute the {count} prompts):
 - If Count > 3: Balanced mix of Hero, Lifestyle, Detail/Texture, and Creative Ad concepts.
 
 OUTPUT FORMAT:
-Return ONLY the numbered list of prompts. Do not include intro text or reasoning.
-1. [Prompt Type]: [The actual prompt text...]
-2. [Prompt Type]: [The actual prompt text...]"""
+Return ONLY a JSON object, no intro text or reasoning:
+{{"prompts": [{{"category": "<category>", "prompt": "<the actual prompt text>"}}, ...]}}
+Categories: "hero" (Hero Studio Shot), "lifestyle" (Aspirational Lifestyle), "detail" (Detail/Texture), "ad" (Viral/Creative Ad)."""
+
+# ---------------------------------------------------------
+# PHASE 2b: ENGINEER FOLLOW-UP (Missing Prompts Only)
+# ---------------------------------------------------------
+# Sent when the Engineer's answer had fewer valid prompts than requested.
+# It asks only for the missing ones, so a short answer doesn't cost a
+# whole new prompt list (or an Artist call on a malformed prompt).
+# ---------------------------------------------------------
+BETA_V2_ENGINEER_REASK_PROMPT = """ROLE:
+You are a world-class e-commerce creative director and expert prompt engineer, completing a prompt list you already started.
+
+TASK:
+Write exactly {missing} more distinct, high-performing image prompts for the provided product.
+
+TARGET GENRE:
+{mode_context}
+
+INPUTS:
+[Image 1: The Product] - Primary reference.
+[Image 2: Context/Vibe] - Secondary reference.
+
+ALREADY ACCEPTED (do not repeat or paraphrase these):
+{accepted}
+
+STRICT CONSTRAINTS:
+1. QUANTITY: You must output exactly {missing} prompts. No more, no less.
+2. NO PRODUCT DESCRIPTION: Focus ONLY on lighting, composition, camera angle, environment, and mood.
+3. CATEGORIES: Prefer {categories}.
+
+OUTPUT FORMAT:
+Return ONLY a JSON object, no intro text or reasoning:
+{{"prompts": [{{"category": "<category>", "prompt": "<the actual prompt text>"}}, ...]}}
+Categories: "hero", "lifestyle", "detail", "ad"."""
@@ -0,0 +1,162 @@
+import math
+import time
+import asyncio
+import logging
+import sqlite3
+from contextlib import contextmanager, asynccontextmanager
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Greatest
+from .models import QuotaBucket
+from . import ratelimit
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaGovernor:
+    """
+    Cluster-wide Gemini quota, shared by every process through one QuotaBucket
+    row per model (GCRA: a token bucket stored as a single timestamp).
+
+    Callers never fail on quota: reserve() atomically books the next free slot
+    and returns how long to wait for it, so concurrent callers are queued in
+    arrival order. Each pipeline thread books one call at a time, so a large
+    job holds at most its Phase 3 concurrency in the queue and cannot starve
+    smaller ones. A 429 reported through penalize() pushes the bucket forward
+    for every worker, not just the one that saw it.
+    """
+
+    def __init__(self):
+        self._buckets = set() # Models whose QuotaBucket row this process has already created or seen
+
+    def _limits(self, model):
+        config = settings.GEMINI_QUOTA
+        if not config['enabled']:
+            return None
+        return config['models'].get(model)
+
+    def reserve(self, model, cost=1):
+        """Book `cost` calls for model. Returns seconds to wait before making them."""
+        limits = self._limits(model)
+        if not limits:
+            return 0.0
+        interval = 60.0 / limits['rpm']
+        tolerance = limits['burst'] * interval
+
+        if model not in self._buckets:
+            QuotaBucket.objects.get_or_create(model=model)
+            self._buckets.add(model)
+        now = time.time()
+        tat = self._book(model, now, interval * cost, cost)
+        if tat is None:
+            # The row was deleted behind this process's back (database reset): create it again
+            QuotaBucket.objects.get_or_create(model=model)
+            tat = self._book(model, now, interval * cost, cost)
+        return max(0.0, tat - tolerance - now)
+
+    def _book(self, model, now, increment, cost):
+        """
+        Push the bucket's tat past `now` by `increment` and return the new tat
+        (None if the row is missing). The UPDATE's row lock serializes
+        concurrent reservations; where the backend supports UPDATE ... RETURNING
+        (PostgreSQL, SQLite 3.35+) the new tat comes back in the same statement,
+        so a reservation is one short write instead of a write and a read.
+        """
+        if _update_returning():
+            table = connection.ops.quote_name(QuotaBucket._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {table} SET tat = (CASE WHEN tat > %s THEN tat ELSE %s END) + %s, granted = granted + %s"
+                    f" WHERE model = %s RETURNING tat",
+                    [now, now, increment, cost, model],
+                )
+                row = cursor.fetchone()
+            return row[0] if row else None
+        with transaction.atomic():
+            updated = QuotaBucket.objects.filter(model=model).update(
+                tat=Greatest(F('tat'), Value(now), output_field=FloatField()) + increment,
+                granted=F('granted') + cost,
+            )
+            if not updated:
+                return None
+            return QuotaBucket.objects.values_list('tat', flat=True).get(model=model)
+
+    def acquire(self, model, cost=1):
+        """Block until this process may make `cost` calls to model."""
+        wait = self.reserve(model, cost)
+        if wait:
+            logger.info(f"Quota: queued {wait:.1f}s for {model}")
+            time.sleep(wait)
+
+    async def acquire_async(self, model, cost=1):
+        """Event-loop friendly acquire()."""
+        wait = await sync_to_async(self.reserve)(model, cost)
+        if wait:
+            logger.info(f"Quota: queued {wait:.1f}s for {model}")
+            await asyncio.sleep(wait)
+
+    def penalize(self, model):
+        """Report a 429: every worker holds off `backoff` seconds on top of the queue."""
+        if not self._limits(model):
+            return
+        backoff = settings.GEMINI_QUOTA['backoff']
+        QuotaBucket.objects.filter(model=model).update(
+            tat=Greatest(F('tat'), Value(time.time()), output_field=FloatField()) + backoff,
+            throttled=F('throttled') + 1,
+        )
+        logger.warning(f"Quota: {model} throttled, all workers backing off {backoff:.0f}s")
+
+    @contextmanager
+    def penalizing_throttles(self, model):
+        """Penalize the shared bucket for a 429 raised inside the block, then re-raise it."""
+        try:
+            yield
+        except Exception as e:
+            if ratelimit.is_rate_limit_error(e):
+                self.penalize(model)
+            raise
+
+    @asynccontextmanager
+    async def penalizing_throttles_async(self, model):
+        """Event-loop friendly penalizing_throttles()."""
+        try:
+            yield
+        except Exception as e:
+            if ratelimit.is_rate_limit_error(e):
+                await sync_to_async(self.penalize)(model)
+            raise
+
+    def utilization(self, bucket):
+        """Monitoring view of one bucket (0 = idle, 1 = burst used up; `queued` calls wait beyond that)."""
+        limits = settings.GEMINI_QUOTA['models'].get(bucket.model)
+        backlog = max(0.0, bucket.tat - time.time())
+        snapshot = {
+            'model': bucket.model,
+            'backlog_seconds': round(backlog, 2),
+            'granted': bucket.granted,
+            'throttled': bucket.throttled,
+        }
+        if limits:
+            interval = 60.0 / limits['rpm']
+            tolerance = limits['burst'] * interval
+            snapshot.update({
+                'rpm': limits['rpm'],
+                'burst': limits['burst'],
+                'utilization': round(min(1.0, backlog / tolerance), 3),
+                'queued': max(0, math.ceil((backlog - tolerance) / interval)),
+            })
+        return snapshot
+
+    def snapshot(self):
+        return [self.utilization(bucket) for bucket in QuotaBucket.objects.order_by('model')]
+
+
+def _update_returning():
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and sqlite3.sqlite_version_info >= (3, 35)
+
+
+governor = QuotaGovernor()
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+import time
+import logging
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose refill rate is tuned with AIMD (additive increase,
+    multiplicative decrease): every successful call nudges the rate up,
+    every 429 / RESOURCE_EXHAUSTED halves it and drains the bucket.
+    Thread-safe, shared by all jobs in the process for a given model.
+    """
+
+    def __init__(self, rate=0.5, min_rate=0.05, max_rate=2.0, burst=4,
+                 increase=0.05, decrease=0.5):
+        self._lock = threading.Lock()
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.throttled = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _take(self):
+        """Consume a token if one is available; otherwise return seconds to wait."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Block until a token is available, then consume it."""
+        while (wait := self._take()):
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Event-loop friendly acquire(): waits with asyncio.sleep instead of blocking."""
+        while (wait := self._take()):
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = min(self.tokens, 0.0)
+            self.throttled += 1
+            logger.warning(f"Rate limited: backing off to {self.rate:.3f} req/s")
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'tokens': self.tokens,
+                'throttled': self.throttled,
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(model):
+    """Return the process-wide limiter for a model, creating it on first use."""
+    with _limiters_lock:
+        limiter = _limiters.get(model)
+        if limiter is None:
+            limiter = AdaptiveRateLimiter(**settings.GEMINI_RATE_LIMIT)
+            _limiters[model] = limiter
+        return limiter
+
+
+def is_rate_limit_error(exc):
+    """True for Gemini quota errors (HTTP 429 / RESOURCE_EXHAUSTED)."""
+    if getattr(exc, 'code', None) == 429:
+        return True
+    message = str(exc)
+    return '429' in message or 'RESOURCE_EXHAUSTED' in message
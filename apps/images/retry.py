@@ -0,0 +1,67 @@
+import random
+import logging
+import httpx
+from google.genai import errors
+from tenacity import (
+    Retrying, AsyncRetrying, stop_after_attempt, wait_random_exponential,
+    retry_if_exception, before_sleep_log,
+)
+from django.conf import settings
+from . import ratelimit
+
+logger = logging.getLogger(__name__)
+
+
+def is_transient(exc):
+    """Errors worth retrying: quota (429), Gemini 5xx, and network/timeouts."""
+    return ratelimit.is_rate_limit_error(exc) or is_server_error(exc)
+
+
+def is_server_error(exc):
+    """Gemini 5xx and network/timeouts."""
+    code = getattr(exc, 'code', None)
+    if isinstance(exc, errors.ServerError) or (isinstance(code, int) and code >= 500):
+        return True
+    return isinstance(exc, (httpx.TransportError, TimeoutError, ConnectionError))
+
+
+def _policy(retryable):
+    config = settings.GENERATION_RETRY
+    return {
+        'stop': stop_after_attempt(config['attempts']),
+        # Full jitter: sleep uniformly in [0, min(max_wait, base * 2^n)]
+        'wait': wait_random_exponential(multiplier=config['base'], max=config['max_wait']),
+        'retry': retry_if_exception(retryable),
+        'before_sleep': before_sleep_log(logger, logging.WARNING),
+        'reraise': True,
+    }
+
+
+def call(fn, *args, **kwargs):
+    """Run one pipeline step, retrying transient failures with exponential backoff and jitter."""
+    return Retrying(**_policy(is_transient))(fn, *args, **kwargs)
+
+
+async def acall(fn, *args, **kwargs):
+    """Async counterpart of call(); fn is a coroutine function."""
+    return await AsyncRetrying(**_policy(is_transient))(fn, *args, **kwargs)
+
+
+def call_throttled(fn, *args, **kwargs):
+    """
+    call() for steps that handle 429s themselves (the Artist's limiter loop):
+    only server and network errors are retried here, so a throttled call is
+    not retried by both layers and the quota governor penalized for each.
+    """
+    return Retrying(**_policy(is_server_error))(fn, *args, **kwargs)
+
+
+async def acall_throttled(fn, *args, **kwargs):
+    """Async counterpart of call_throttled()."""
+    return await AsyncRetrying(**_policy(is_server_error))(fn, *args, **kwargs)
+
+
+def job_delay(attempt):
+    """Seconds before re-running a whole job after its `attempt`-th run (full jitter)."""
+    config = settings.GENERATION_RETRY
+    return random.uniform(0, min(config['job_max_wait'], config['job_base'] * 2 ** attempt))
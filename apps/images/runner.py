@@ -0,0 +1,54 @@
+import os
+import asyncio
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncJobRunner:
+    """
+    Owns one asyncio event loop running on a daemon thread.
+    Huey worker threads hand coroutines to it with run(), so the network-bound
+    part of every generation job is multiplexed on a single loop.
+    The loop is recreated lazily after a fork (gunicorn/huey process workers).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._pid = os.getpid()
+                thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name='generation-event-loop',
+                    daemon=True
+                )
+                thread.start()
+                logger.info(f"Started generation event loop in process {self._pid}")
+            return self._loop
+
+    def submit(self, coro):
+        """Schedule a coroutine on the shared loop and return a concurrent Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def run(self, coro, timeout=None):
+        """
+        Run a coroutine on the shared loop and wait for its result. On timeout
+        the coroutine is cancelled before TimeoutError propagates, so a job
+        the caller retries never runs twice at once.
+        """
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+
+runner = AsyncJobRunner()
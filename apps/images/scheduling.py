@@ -0,0 +1,21 @@
+from django.conf import settings
+from .models import GenerationJob
+
+
+def queue_for(plan):
+    """The huey queue serving a plan (GENERATION_QUEUES); unknown plans share the default queue."""
+    for name, queue in settings.GENERATION_QUEUES.items():
+        if plan in queue['plans']:
+            return name
+    return settings.DJANGO_HUEY['default']
+
+
+def fair_priority(job):
+    """
+    Huey priority for `job`: minus the number of the same user's jobs still
+    waiting ahead of it. Huey runs higher priorities first and equal ones in
+    arrival order, so within a queue every user's next job comes before
+    anyone's second, i.e. users are served round-robin and one user's burst
+    can't starve the others.
+    """
+    return -GenerationJob.objects.filter(user_id=job.user_id, status='queued', id__lt=job.id).count()
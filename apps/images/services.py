@@ -1,47 +1,305 @@
 import os
+import json
+import mmap
 import time
+import uuid
+import hashlib
+import asyncio
 import logging
-from google import genai
-from google.genai import types
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from django.conf import settings
+from django import db
+from asgiref.sync import sync_to_async
 from PIL import Image
 from io import BytesIO
-import base64
 from datetime import datetime
-from . import prompts
-
-import cloudinary
-import cloudinary.uploader
-
-# Configure Cloudinary
-if hasattr(settings, 'CLOUDINARY_STORAGE') and settings.CLOUDINARY_STORAGE:
-    c_config = settings.CLOUDINARY_STORAGE
-    if c_config.get('CLOUD_NAME'):
-        cloudinary.config(
-            cloud_name=c_config.get('CLOUD_NAME'),
-            api_key=c_config.get('API_KEY'),
-            api_secret=c_config.get('API_SECRET'),
-            secure=True
-        )
+from . import prompts, ratelimit, quota, retry, backends, postprocess, ingest, metrics, shot_list, variants
+from .cache import ArtifactCache, artifact_cache
+from .progress import NullProgress
 
 logger = logging.getLogger(__name__)
 
-def generate_campaign_images(image_input, count=1, mode='creative', user_prompt='', plan='free'):
+def generate_campaign_images(image_input, count=1, mode='creative', user_prompt='', plan='free', progress=None):
     """
     Production-grade service using the latest google-genai SDK.
     Optimized for Free Tier with model splitting and throttling.
     Modes: 'creative', 'model', 'background'
+    Progress (phase changes, each uploaded image) is reported to `progress`.
     """
-    client = genai.Client(api_key=settings.GOOGLE_API_KEY)
+    image_model, text_model = backends.image_model(), backends.text_model()
+    progress = progress or NullProgress()
+    clock = metrics.PhaseClock('sync')
     
+    img_bytes, img_mime = _prepare_input(image_input)
+    if img_bytes is None:
+        return []
+    file_store = image_model.file_store()
+    product_part = file_store.part_for(img_bytes, img_mime)
+
+    output_dir = os.path.join(settings.MEDIA_ROOT, 'generated_campaigns')
+    os.makedirs(output_dir, exist_ok=True)
+
+    try:
+        # --- PHASE 1: GENERATE REFERENCE MODEL IMAGE (Creative Director) ---
+        clock.start('director')
+        progress.phase('director')
+        director_key = ArtifactCache.key('director', img_bytes, mode, user_prompt)
+        model_img_bytes = progress.saved_reference()
+        if model_img_bytes:
+            logger.info("Phase 1: Reference Model Image restored from job checkpoint")
+        else:
+            model_img_bytes = _cache_get(director_key)
+            if model_img_bytes:
+                logger.info(f"Phase 1: Reference Model Image served from artifact cache [Mode: {mode}]")
+            else:
+                logger.info(f"Phase 1: Generating Reference Model Image (Gemini 3 Pro Image) [Mode: {mode}]...")
+
+                model_img_bytes = retry.call(_run_director, image_model, product_part, mode, user_prompt)
+                if model_img_bytes:
+                    _cache_set(director_key, model_img_bytes)
+
+            if model_img_bytes:
+                progress.save_reference(model_img_bytes)
+            else:
+                logger.error("Failed to generate Phase 1 Model Image. Falling back...")
+                # Fallback: Just use the original image if model generation failed
+                model_img_bytes = img_bytes
+        model_part = file_store.part_for(model_img_bytes, ingest.sniff_mime(model_img_bytes) or img_mime)
+
+        # --- PHASE 2: GENERATE PROMPT LIST (Prompt Engineer) ---
+        clock.start('engineer')
+        progress.phase('engineer')
+        engineer_key = ArtifactCache.key('engineer', img_bytes, mode, user_prompt, count, _digest(model_img_bytes))
+        generated_prompts = progress.saved_prompts()
+        if generated_prompts:
+            logger.info("Phase 2: Prompt list restored from job checkpoint")
+        else:
+            generated_prompts = _cache_get_json(engineer_key)
+            if generated_prompts:
+                logger.info(f"Phase 2: Prompt list served from artifact cache [Mode: {mode}]")
+            else:
+                logger.info(f"Phase 2: Engineering {count} Prompts (Gemini 3 Pro Preview) [Mode: {mode}]...")
+
+                generated_prompts = _engineer_prompts(text_model, product_part, model_part, count, mode, user_prompt)
+                if len(generated_prompts) == count:
+                    _cache_set_json(engineer_key, generated_prompts)
+
+            if generated_prompts:
+                progress.save_prompts(generated_prompts)
+        logger.info(f"Phase 2 complete. Generated {len(generated_prompts)} prompts.")
+
+        # --- PHASE 3: EXECUTE FINAL IMAGES (Artist) ---
+        # Artist calls fan out on a bounded pool; the process-wide adaptive
+        # limiter and the cluster-wide quota governor space them out and back
+        # off when Gemini answers 429. Finished images
+        # go to a separate upload pool so Cloudinary egress overlaps with the
+        # next generation; an Artist waits for a free upload slot (back-pressure)
+        # before handing its image over. Images a previous attempt of this job
+        # already delivered are skipped.
+        total = len(generated_prompts)
+        concurrency = _phase3_concurrency(plan, total)
+        limiter = ratelimit.get_limiter(image_model.model)
+        logger.info(f"Phase 3: Generating {total} Final Images (Gemini 3 Pro Image) [Concurrency: {concurrency}]...")
+        clock.start('artist')
+        progress.phase('artist', total=total)
+
+        results_by_index = progress.completed_results()
+        if results_by_index:
+            logger.info(f"Phase 3: {len(results_by_index)}/{total} images restored from job checkpoint")
+        upload_slots = threading.BoundedSemaphore(settings.UPLOAD_MAX_PENDING)
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='artist') as artist_pool, \
+                ThreadPoolExecutor(max_workers=settings.UPLOAD_WORKERS, thread_name_prefix='upload') as upload_pool:
+
+            def generate_and_hand_off(i, p_text):
+                try:
+                    final_img_bytes = retry.call_throttled(_generate_final_image, image_model, limiter, product_part, model_part, p_text, i, total)
+                finally:
+                    # The quota governor queried the DB from this pool thread
+                    db.connections.close_all()
+                if not final_img_bytes:
+                    return None
+                upload_slots.acquire()
+                upload = upload_pool.submit(_store_final_image, final_img_bytes, i, plan, output_dir)
+                upload.add_done_callback(lambda _: upload_slots.release())
+                return upload
+
+            pending = {
+                artist_pool.submit(generate_and_hand_off, i, p_text): ('artist', i)
+                for i, p_text in enumerate(generated_prompts)
+                if i not in results_by_index
+            }
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, i = pending.pop(future)
+                    try:
+                        value = future.result()
+                    except Exception as e_inner:
+                        logger.error(f"Error in Phase 3.{i+1} ({stage}): {e_inner}")
+                        progress.image_failed(i, e_inner)
+                        continue
+                    if stage == 'artist':
+                        if value is not None:
+                            pending[value] = ('upload', i)
+                        else:
+                            progress.image_failed(i, 'No image returned')
+                    else:
+                        result = _finish_result(value, generated_prompts[i], i)
+                        results_by_index[i] = result
+                        progress.image_ready(i, result)
+
+        clock.stop()
+        return [results_by_index[i] for i in sorted(results_by_index)]
+
+    except Exception as e:
+        logger.error(f"Global AI Error: {e}")
+        return []
+
+
+async def agenerate_campaign_images(image_input, count=1, mode='creative', user_prompt='', plan='free', progress=None):
+    """
+    Asyncio twin of generate_campaign_images built on the backends' agenerate().
+    Every Gemini call and Cloudinary upload is awaited, so a single event loop
+    can keep many jobs in flight while they wait on the network.
+    """
+    image_model, text_model = backends.image_model(), backends.text_model()
+    progress = progress or NullProgress()
+    clock = metrics.PhaseClock('async')
+
+    img_bytes, img_mime = _prepare_input(image_input)
+    if img_bytes is None:
+        return []
+    file_store = image_model.file_store()
+    product_part = await file_store.apart_for(img_bytes, img_mime)
+
+    output_dir = os.path.join(settings.MEDIA_ROOT, 'generated_campaigns')
+    os.makedirs(output_dir, exist_ok=True)
+
+    try:
+        # --- PHASE 1: GENERATE REFERENCE MODEL IMAGE (Creative Director) ---
+        clock.start('director')
+        await sync_to_async(progress.phase)('director')
+        director_key = ArtifactCache.key('director', img_bytes, mode, user_prompt)
+        model_img_bytes = await sync_to_async(progress.saved_reference)()
+        if model_img_bytes:
+            logger.info("Phase 1 (async): Reference Model Image restored from job checkpoint")
+        else:
+            model_img_bytes = await asyncio.to_thread(_cache_get, director_key)
+            if model_img_bytes:
+                logger.info(f"Phase 1 (async): Reference Model Image served from artifact cache [Mode: {mode}]")
+            else:
+                logger.info(f"Phase 1 (async): Generating Reference Model Image [Mode: {mode}]...")
+
+                model_img_bytes = await retry.acall(_arun_director, image_model, product_part, mode, user_prompt)
+                if model_img_bytes:
+                    await asyncio.to_thread(_cache_set, director_key, model_img_bytes)
+
+            if model_img_bytes:
+                await sync_to_async(progress.save_reference)(model_img_bytes)
+            else:
+                logger.error("Failed to generate Phase 1 Model Image. Falling back...")
+                model_img_bytes = img_bytes
+        model_part = await file_store.apart_for(model_img_bytes, ingest.sniff_mime(model_img_bytes) or img_mime)
+
+        # --- PHASE 2: GENERATE PROMPT LIST (Prompt Engineer) ---
+        clock.start('engineer')
+        await sync_to_async(progress.phase)('engineer')
+        engineer_key = ArtifactCache.key('engineer', img_bytes, mode, user_prompt, count, _digest(model_img_bytes))
+        generated_prompts = await sync_to_async(progress.saved_prompts)()
+        if generated_prompts:
+            logger.info("Phase 2 (async): Prompt list restored from job checkpoint")
+        else:
+            generated_prompts = await asyncio.to_thread(_cache_get_json, engineer_key)
+            if generated_prompts:
+                logger.info(f"Phase 2 (async): Prompt list served from artifact cache [Mode: {mode}]")
+            else:
+                logger.info(f"Phase 2 (async): Engineering {count} Prompts [Mode: {mode}]...")
+
+                generated_prompts = await _aengineer_prompts(text_model, product_part, model_part, count, mode, user_prompt)
+                if len(generated_prompts) == count:
+                    await asyncio.to_thread(_cache_set_json, engineer_key, generated_prompts)
+
+            if generated_prompts:
+                await sync_to_async(progress.save_prompts)(generated_prompts)
+        logger.info(f"Phase 2 (async) complete. Generated {len(generated_prompts)} prompts.")
+
+        # --- PHASE 3: EXECUTE FINAL IMAGES (Artist) ---
+        total = len(generated_prompts)
+        artist_slots = asyncio.Semaphore(_phase3_concurrency(plan, total))
+        # As on the sync path: at most UPLOAD_MAX_PENDING uploads handed over, UPLOAD_WORKERS of them running
+        upload_slots = asyncio.Semaphore(settings.UPLOAD_MAX_PENDING)
+        upload_workers = asyncio.Semaphore(settings.UPLOAD_WORKERS)
+        limiter = ratelimit.get_limiter(image_model.model)
+        clock.start('artist')
+        await sync_to_async(progress.phase)('artist', total=total)
+        results_by_index = await sync_to_async(progress.completed_results)()
+        if results_by_index:
+            logger.info(f"Phase 3 (async): {len(results_by_index)}/{total} images restored from job checkpoint")
+
+        async def render(i, p_text):
+            try:
+                async with artist_slots:
+                    final_img_bytes = await retry.acall_throttled(_agenerate_final_image, image_model, limiter, product_part, model_part, p_text, i, total)
+                    if not final_img_bytes:
+                        return i, 'No image returned'
+                    # Hold the Artist slot until an upload slot frees up (back-pressure)
+                    await upload_slots.acquire()
+                try:
+                    async with upload_workers:
+                        stored = await asyncio.to_thread(_store_final_image, final_img_bytes, i, plan, output_dir)
+                finally:
+                    upload_slots.release()
+                return i, _finish_result(stored, p_text, i)
+            except Exception as e_inner:
+                logger.error(f"Error in Phase 3.{i+1}: {e_inner}")
+                return i, e_inner
+
+        remaining = [asyncio.ensure_future(render(i, p_text)) for i, p_text in enumerate(generated_prompts) if i not in results_by_index]
+        try:
+            for next_done in asyncio.as_completed(remaining):
+                i, result = await next_done
+                if isinstance(result, dict):
+                    results_by_index[i] = result
+                    await sync_to_async(progress.image_ready)(i, result)
+                else:
+                    await sync_to_async(progress.image_failed)(i, result)
+        finally:
+            # Cancelled (job timeout): stop the Artist calls still in flight as well
+            for task in remaining:
+                task.cancel()
+
+        clock.stop()
+        return [results_by_index[i] for i in sorted(results_by_index)]
+
+    except Exception as e:
+        logger.error(f"Global AI Error: {e}")
+        return []
+
+
+def _prepare_input(image_input):
+    """Load and normalize the product image once; returns (bytes, mime_type) or (None, None)."""
+    img_bytes = _load_image_bytes(image_input)
+    if img_bytes is None:
+        return None, None
+    try:
+        return ingest.normalize_input(img_bytes)
+    except Exception as e:
+        logger.warning(f"Input normalization failed, sending the upload as-is: {e}")
+        return img_bytes, ingest.sniff_mime(img_bytes) or 'image/png'
+
+
+def _load_image_bytes(image_input):
+    """Read the product image into bytes; returns None if it can't be read."""
     # Load image bytes - Try to avoid Pillow for performance
     try:
-        if hasattr(image_input, 'read'):
+        if isinstance(image_input, (bytes, mmap.mmap)):
+            # A memory-mapped blob is bytes-like: use it in place rather than read() a copy
+            img_bytes = image_input
+        elif hasattr(image_input, 'read'):
             image_input.seek(0)
             img_bytes = image_input.read()
             image_input.seek(0)
-        elif isinstance(image_input, bytes):
-            img_bytes = image_input
         else:
             # Fallback to Pillow ONLY if necessary
             with Image.open(image_input) as img:
@@ -50,227 +308,290 @@ def generate_campaign_images(image_input, count=1, mode='creative', user_prompt=
                 buffered = BytesIO()
                 img.save(buffered, format="PNG")
                 img_bytes = buffered.getvalue()
+        return img_bytes
     except Exception as e:
         logger.error(f"Error loading image bytes: {e}")
-        return []
+        return None
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _cache_get(key):
+    if not settings.ARTIFACT_CACHE['enabled']:
+        return None
+    return artifact_cache.get(key)
+
+
+def _cache_set(key, data):
+    if settings.ARTIFACT_CACHE['enabled']:
+        artifact_cache.set(key, data)
+
+
+def _cache_get_json(key):
+    data = _cache_get(key)
+    return json.loads(data) if data else None
+
+
+def _cache_set_json(key, value):
+    _cache_set(key, json.dumps(value).encode())
+
+
+def _director_prompt(mode, user_prompt):
+    # Select the high-end rules based on mode
+    mode_rules = getattr(prompts, f'MODE_RULES_{mode.upper()}', prompts.MODE_RULES_CREATIVE)
+
+    # Inject context (Rules + User Prompt)
+    director_prompt = prompts.BETA_V2_DIRECTOR_PROMPT.format(mode_rules=mode_rules)
+    if user_prompt and user_prompt.strip():
+        director_prompt += f"\n\nADDITIONAL USER REQUIREMENT: {user_prompt.strip()}"
+    return director_prompt
+
+
+def _mode_context(mode):
+    return f"The user has selected the '{mode.upper()}' generation mode. Follow the specific e-commerce rules for this genre."
+
+
+def _with_user_prompt(instruction, user_prompt):
+    if user_prompt and user_prompt.strip():
+        instruction += f"\n\nSTRICT REQUIREMENT: The user has requested: {user_prompt.strip()}"
+    return instruction
+
+
+def _engineer_prompt(count, mode, user_prompt):
+    engineer_prompt = prompts.BETA_V2_ENGINEER_PROMPT.format(count=count, mode_context=_mode_context(mode))
+    return _with_user_prompt(engineer_prompt, user_prompt)
+
+
+def _engineer_reask_prompt(shots, missing, mode, user_prompt):
+    reask_prompt = prompts.BETA_V2_ENGINEER_REASK_PROMPT.format(
+        missing=missing,
+        mode_context=_mode_context(mode),
+        accepted="\n".join(f"- [{shot['category']}] {shot['prompt']}" for shot in shots) or "(none)",
+        categories=", ".join(shot_list.missing_categories(shots)),
+    )
+    return _with_user_prompt(reask_prompt, user_prompt)
+
+
+def _engineer_prompts(text_model, product_part, model_part, count, mode, user_prompt):
+    """
+    Ask the Engineer for a schema-constrained prompt list and validate it.
+    If items are missing or malformed, re-ask (ENGINEER_REASKS times) for
+    just the missing ones instead of spending Artist calls on bad prompts.
+    """
+    response = retry.call(_run_engineer, text_model, _engineer_prompt(count, mode, user_prompt), product_part, model_part)
+    shots = shot_list.parse(response, count)
+    for _ in range(settings.ENGINEER_REASKS):
+        missing = count - len(shots)
+        if missing <= 0:
+            break
+        logger.warning(f"Phase 2: {len(shots)}/{count} valid prompts, asking for the {missing} missing")
+        metrics.ENGINEER_PROMPTS.labels('reasked').inc(missing)
+        response = retry.call(_run_engineer, text_model, _engineer_reask_prompt(shots, missing, mode, user_prompt),
+                              product_part, model_part)
+        shots += shot_list.parse(response, missing, accepted=shots)
+    return [shot['prompt'] for shot in shots]
+
+
+async def _aengineer_prompts(text_model, product_part, model_part, count, mode, user_prompt):
+    """Async counterpart of _engineer_prompts."""
+    response = await retry.acall(_arun_engineer, text_model, _engineer_prompt(count, mode, user_prompt), product_part, model_part)
+    shots = shot_list.parse(response, count)
+    for _ in range(settings.ENGINEER_REASKS):
+        missing = count - len(shots)
+        if missing <= 0:
+            break
+        logger.warning(f"Phase 2 (async): {len(shots)}/{count} valid prompts, asking for the {missing} missing")
+        metrics.ENGINEER_PROMPTS.labels('reasked').inc(missing)
+        response = await retry.acall(_arun_engineer, text_model, _engineer_reask_prompt(shots, missing, mode, user_prompt),
+                                     product_part, model_part)
+        shots += shot_list.parse(response, missing, accepted=shots)
+    return [shot['prompt'] for shot in shots]
+
+
+def _phase3_concurrency(plan, total):
+    return max(1, min(settings.GENERATION_CONCURRENCY.get(plan, 1), total or 1))
+
+
+def _artist_instruction(p_text):
+    # Instruction similar to n8n: "Generate a photo-realistic image using the provided model image and the provided product..."
+    return (
+        "Generate a photo-realistic image using the provided model image and the provided product. "
+        f"Follow these details: {p_text}"
+    )
+
+
+def _run_director(image_model, product_part, mode, user_prompt):
+    quota.governor.acquire(image_model.model)
+    with metrics.counting_throttles(image_model.model), quota.governor.penalizing_throttles(image_model.model):
+        return image_model.generate([
+            _director_prompt(mode, user_prompt),
+            product_part
+        ])
+
+
+async def _arun_director(image_model, product_part, mode, user_prompt):
+    await quota.governor.acquire_async(image_model.model)
+    async with quota.governor.penalizing_throttles_async(image_model.model):
+        with metrics.counting_throttles(image_model.model):
+            return await image_model.agenerate([
+                _director_prompt(mode, user_prompt),
+                product_part
+            ])
 
-    output_dir = os.path.join(settings.MEDIA_ROOT, 'generated_campaigns')
-    os.makedirs(output_dir, exist_ok=True)
 
+def _run_engineer(text_model, instruction, product_part, model_part):
+    quota.governor.acquire(text_model.model)
+    with metrics.counting_throttles(text_model.model), quota.governor.penalizing_throttles(text_model.model):
+        return text_model.generate_json([
+            instruction,
+            product_part,   # [Image 1: Product]
+            model_part      # [Image 2: Context/Vibe]
+        ], shot_list.SCHEMA)
+
+
+async def _arun_engineer(text_model, instruction, product_part, model_part):
+    await quota.governor.acquire_async(text_model.model)
+    async with quota.governor.penalizing_throttles_async(text_model.model):
+        with metrics.counting_throttles(text_model.model):
+            return await text_model.agenerate_json([
+                instruction,
+                product_part,
+                model_part
+            ], shot_list.SCHEMA)
+
+
+def _generate_final_image(image_model, limiter, product_part, model_part, p_text, i, total):
+    """Run one Artist call, retrying on 429 through the limiter. Returns image bytes or None."""
+    logger.info(f"Phase 3: Generating Final Image {i+1}/{total} (Gemini 3 Pro Image)...")
+
+    artist_instruction = _artist_instruction(p_text)
+
+    attempt = 0
+    while True:
+        limiter.acquire()
+        quota.governor.acquire(image_model.model)
+        try:
+            final_img_bytes = image_model.generate([
+                artist_instruction,
+                product_part,   # Input Image 1
+                model_part      # Input Image 2 (Context)
+            ])
+            limiter.on_success()
+            break
+        except Exception as e:
+            if not ratelimit.is_rate_limit_error(e) or attempt >= settings.GEMINI_MAX_RETRIES:
+                raise
+            attempt += 1
+            limiter.on_throttle()
+            metrics.GEMINI_THROTTLED.labels(image_model.model).inc()
+            quota.governor.penalize(image_model.model)
+            logger.warning(f"Phase 3.{i+1}: rate limited, retry {attempt}/{settings.GEMINI_MAX_RETRIES}")
+
+    if not final_img_bytes:
+        logger.warning(f"No image data in final response for prompt {i+1}")
+    return final_img_bytes
+
+
+async def _agenerate_final_image(image_model, limiter, product_part, model_part, p_text, i, total):
+    """Async counterpart of _generate_final_image."""
+    logger.info(f"Phase 3 (async): Generating Final Image {i+1}/{total}...")
+
+    artist_instruction = _artist_instruction(p_text)
+
+    attempt = 0
+    while True:
+        await limiter.acquire_async()
+        await quota.governor.acquire_async(image_model.model)
+        try:
+            final_img_bytes = await image_model.agenerate([
+                artist_instruction,
+                product_part,
+                model_part
+            ])
+            limiter.on_success()
+            break
+        except Exception as e:
+            if not ratelimit.is_rate_limit_error(e) or attempt >= settings.GEMINI_MAX_RETRIES:
+                raise
+            attempt += 1
+            limiter.on_throttle()
+            metrics.GEMINI_THROTTLED.labels(image_model.model).inc()
+            await sync_to_async(quota.governor.penalize)(image_model.model)
+            logger.warning(f"Phase 3.{i+1}: rate limited, retry {attempt}/{settings.GEMINI_MAX_RETRIES}")
+
+    if not final_img_bytes:
+        logger.warning(f"No image data in final response for prompt {i+1}")
+    return final_img_bytes
+
+
+def _finish_result(stored, p_text, i):
+    result = dict(stored, prompt=p_text, index=i)
+    logger.info(f"Final Image {i+1} ready at: {result['url']}")
+    return result
+
+
+def _upload(storage, data, img_format, plan):
+    start = time.perf_counter()
+    url = storage.upload(data, "generated_campaigns", img_format, eager=variants.eager_transformations(plan))
+    metrics.UPLOAD_SECONDS.labels(storage.name).observe(time.perf_counter() - start)
+    metrics.UPLOAD_BYTES.labels(storage.name).observe(len(data))
+    return url
+
+
+def _store_final_image(final_img_bytes, i, plan, output_dir):
+    """Upload a final image to the configured object storage, falling back to local media storage."""
+    storage = backends.storage()
+    cloudinary_url = None
+    img_format = 'png'
+
+    # --- SAFEGUARD: Fit Cloudinary's MP/MB limits in one pass before upload ---
     try:
-        # --- PHASE 1: GENERATE REFERENCE MODEL IMAGE (Creative Director) ---
-        logger.info(f"Phase 1: Generating Reference Model Image (Gemini 3 Pro Image) [Mode: {mode}]...")
-        
-        # Select the high-end rules based on mode
-        mode_rules = getattr(prompts, f'MODE_RULES_{mode.upper()}', prompts.MODE_RULES_CREATIVE)
-        
-        # Inject context (Rules + User Prompt)
-        director_prompt = prompts.BETA_V2_DIRECTOR_PROMPT.format(mode_rules=mode_rules)
-        if user_prompt and user_prompt.strip():
-            director_prompt += f"\n\nADDITIONAL USER REQUIREMENT: {user_prompt.strip()}"
-
-        director_res = client.models.generate_content(
-            model='gemini-3-pro-image-preview',
-            contents=[
-                director_prompt,
-                types.Part.from_bytes(data=img_bytes, mime_type='image/png')
-            ]
-        )
-        
-        model_img_bytes = None
-        if director_res.candidates and director_res.candidates[0].content.parts:
-            for part in director_res.candidates[0].content.parts:
-                if hasattr(part, 'inline_data') and part.inline_data:
-                    model_img_bytes = part.inline_data.data
-                    break
-        
-        if not model_img_bytes:
-            logger.error("Failed to generate Phase 1 Model Image. Falling back...")
-            # Fallback: Just use the original image if model generation failed
-            model_img_bytes = img_bytes
+        final_img_bytes, img_format = postprocess.fit_for_upload(final_img_bytes)
 
-        # --- PHASE 2: GENERATE PROMPT LIST (Prompt Engineer) ---
-        logger.info(f"Phase 2: Engineering {count} Prompts (Gemini 3 Pro Preview) [Mode: {mode}]...")
-        
-        mode_context = f"The user has selected the '{mode.upper()}' generation mode. Follow the specific e-commerce rules for this genre."
-        engineer_prompt = prompts.BETA_V2_ENGINEER_PROMPT.format(count=count, mode_context=mode_context)
-        if user_prompt and user_prompt.strip():
-            engineer_prompt += f"\n\nSTRICT REQUIREMENT: The user has requested: {user_prompt.strip()}"
-
-        prompt_res = client.models.generate_content(
-            model='gemini-3-pro-preview',
-            contents=[
-                engineer_prompt,
-                types.Part.from_bytes(data=img_bytes, mime_type='image/png'),   # [Image 1: Product]
-                types.Part.from_bytes(data=model_img_bytes, mime_type='image/png') # [Image 2: Context/Vibe]
-            ]
-        )
-        
-        response_text = prompt_res.text or ""
-        generated_prompts = []
-        for line in response_text.split('\n'):
-            line = line.strip()
-            if line and (line[0].isdigit() and ('. ' in line[:4] or ') ' in line[:4])):
-                if ':' in line:
-                    generated_prompts.append(line.split(':', 1)[1].strip())
-                else:
-                    # Capture everything after the first dot/parenthesis
-                    import re
-                    match = re.search(r'^\d+[\.\)]\s*(.*)', line)
-                    if match:
-                        generated_prompts.append(match.group(1).strip())
-        
-        # Fallback if parsing fails
-        if not generated_prompts:
-            generated_prompts = [line.strip() for line in response_text.split('\n') if len(line.strip()) > 30][:count]
-
-        generated_prompts = generated_prompts[:count]
-        logger.info(f"Phase 2 complete. Generated {len(generated_prompts)} prompts.")
+        try:
+            cloudinary_url = _upload(storage, final_img_bytes, img_format, plan)
+        except Exception as upload_err:
+            if storage.is_size_error(upload_err):
+                metrics.POSTPROCESS_EVENTS.labels('rejected').inc()
+                logger.warning(f"Cloudinary rejected file. Retrying with a tighter budget: {upload_err}")
 
-        # --- PHASE 3: EXECUTE FINAL IMAGES (Artist) ---
-        results = []
-        for i, p_text in enumerate(generated_prompts):
-            logger.info(f"Phase 3: Generating Final Image {i+1}/{len(generated_prompts)} (Gemini 3 Pro Image)...")
-            
-            if i > 0: time.sleep(3) # Slightly longer delay for heavy Pro models
-
-            # Instruction similar to n8n: "Generate a photo-realistic image using the provided model image and the provided product..."
-            artist_instruction = (
-                "Generate a photo-realistic image using the provided model image and the provided product. "
-                f"Follow these details: {p_text}"
-            )
-            
-            try:
-                final_res = client.models.generate_content(
-                    model='gemini-3-pro-image-preview',
-                    contents=[
-                        artist_instruction,
-                        types.Part.from_bytes(data=img_bytes, mime_type='image/png'),       # Input Image 1
-                        types.Part.from_bytes(data=model_img_bytes, mime_type='image/png') # Input Image 2 (Context)
-                    ]
+                # FALLBACK: one more pass with 20% headroom and a lossy encoder
+                limits = settings.CLOUDINARY_UPLOAD_LIMITS
+                final_img_bytes, img_format = postprocess.fit_for_upload(
+                    final_img_bytes,
+                    max_megapixels=limits['max_megapixels'] * 0.8,
+                    max_mb=limits['max_mb'] * 0.8,
+                    encoder='webp'
                 )
-                
-                final_img_bytes = None
-                if final_res.candidates and final_res.candidates[0].content.parts:
-                    for part in final_res.candidates[0].content.parts:
-                        if hasattr(part, 'inline_data') and part.inline_data:
-                            final_img_bytes = part.inline_data.data
-                            break
-                
-                if final_img_bytes:
-                    filename = f"beta_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{i}.png"
-                    cloudinary_url = None
-                    
-                    # --- SAFEGUARD: Local Check and Resize before Cloudinary ---
-                    try:
-                        with Image.open(BytesIO(final_img_bytes)) as img:
-                            width, height = img.size
-                            mp = (width * height) / 1000000
-                            mb = len(final_img_bytes) / (1024 * 1024)
-                            
-                            if mp > 24.8 or mb > 9.8:
-                                logger.info(f"Safeguard: Local resize needed before upload ({mp:.1f}MP, {mb:.1f}MB)")
-                                scale = min(1.0, (24.0 / mp)**0.5 if mp > 24.0 else 0.9)
-                                new_size = (int(width * scale), int(height * scale))
-                                optimized_img = img.resize(new_size, Image.Resampling.LANCZOS)
-                                
-                                temp_buffer = BytesIO()
-                                optimized_img.save(temp_buffer, format="PNG", optimize=True)
-                                final_img_bytes = temp_buffer.getvalue()
-                                logger.info(f"Safeguard complete: {len(final_img_bytes)} bytes")
-
-                        c_name = os.getenv('CLOUDINARY_CLOUD_NAME') or settings.CLOUDINARY_STORAGE.get('CLOUD_NAME')
-                        logger.info(f"Offloading upload to Cloudinary Cloud: {c_name} ({len(final_img_bytes)} bytes)")
-                        
-                        import cloudinary.uploader
-                        
-                        try:
-                            # ATTEMPT 1: Try direct upload without any local processing
-                            upload_res = cloudinary.uploader.upload(
-                                BytesIO(final_img_bytes),
-                                folder="generated_campaigns",
-                                resource_type="image",
-                                format='png'
-                            )
-                            cloudinary_url = upload_res.get('secure_url')
-                        except Exception as upload_err:
-                            err_msg = str(upload_err).lower()
-                            if "too large" in err_msg or "megapixel" in err_msg or "limit" in err_msg:
-                                logger.warning(f"Cloudinary rejected original file. Falling back to local optimization: {upload_err}")
-                                
-                                # FALLBACK: Pillow Optimization Only When Necessary
-                                with Image.open(BytesIO(final_img_bytes)) as img:
-                                    width, height = img.size
-                                    mp = (width * height) / 1000000
-                                    mb = len(final_img_bytes) / (1024 * 1024)
-                                    
-                                    # Optimize loop
-                                    current_img = img
-                                    attempts = 0
-                                    while (mp > 24.5 or mb > 9.3) and attempts < 3:
-                                        attempts += 1
-                                        scale = 0.85
-                                        if mp > 25.0: scale = (24.0 / mp) ** 0.5
-                                        
-                                        new_size = (int(current_img.size[0] * scale), int(current_img.size[1] * scale))
-                                        current_img = current_img.resize(new_size, Image.Resampling.LANCZOS)
-                                        
-                                        temp_buffer = BytesIO()
-                                        current_img.save(temp_buffer, format="PNG", optimize=True)
-                                        final_img_bytes = temp_buffer.getvalue()
-                                        
-                                        mp = (new_size[0] * new_size[1]) / 1000000
-                                        mb = len(final_img_bytes) / (1024 * 1024)
-                                    
-                                    # ATTEMPT 2: Try upload again after local optimization
-                                    upload_res = cloudinary.uploader.upload(
-                                        BytesIO(final_img_bytes),
-                                        folder="generated_campaigns",
-                                        resource_type="image",
-                                        format='png'
-                                    )
-                                    cloudinary_url = upload_res.get('secure_url')
-                            else:
-                                raise upload_err # Rethrow if it's not a size issue
-
-                        if cloudinary_url:
-                            logger.info(f"Cloudinary Success [Plan: {plan}]: {cloudinary_url}")
-                    except Exception as e:
-                        logger.error(f"CLOUDINARY ERROR: {str(e)}")
-
-                    
-                    # 2. URL resolution and Fallback Storage
-                    if cloudinary_url:
-                        final_url = cloudinary_url
-                        filepath = f"cloud:{filename}" # Logical path for reference
-                    else:
-                        # Fallback: Save locally ONLY if Cloudinary failed
-                        filepath = os.path.join(output_dir, filename)
-                        with open(filepath, 'wb') as f:
-                            f.write(final_img_bytes)
-                        
-                        final_url = f"{settings.MEDIA_URL}generated_campaigns/{filename}"
-                        logger.warning(f"Cloudinary upload failed for {filename}, falling back to local storage.")
-                    
-                    results.append({
-                        'path': filepath,
-                        'prompt': p_text,
-                        'url': final_url
-                    })
-                    logger.info(f"Final Image {i+1} ready at: {final_url}")
-                else:
-                    logger.warning(f"No image data in final response for prompt {i+1}")
-            
-            except Exception as e_inner:
-                logger.error(f"Error in Phase 3.{i+1}: {e_inner}")
-                if "429" in str(e_inner): break 
+                cloudinary_url = _upload(storage, final_img_bytes, img_format, plan)
+            else:
+                raise upload_err # Rethrow if it's not a size issue
+
+        if cloudinary_url:
+            logger.info(f"Upload Success [{storage.name}] [Plan: {plan}]: {cloudinary_url}")
+    except Exception as e:
+        logger.error(f"CLOUDINARY ERROR: {str(e)}")
 
-        return results
+    # Jobs store images concurrently: the random part keeps two of them from sharing a name
+    filename = f"beta_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{i}_{uuid.uuid4().hex}.{img_format}"
 
+    # 2. URL resolution and Fallback Storage
+    if cloudinary_url:
+        final_url = cloudinary_url
+        filepath = f"cloud:{filename}" # Logical path for reference
+    else:
+        # Fallback: Save locally ONLY if Cloudinary failed
+        filepath = os.path.join(output_dir, filename)
+        with open(filepath, 'wb') as f:
+            f.write(final_img_bytes)
 
+        final_url = f"{settings.MEDIA_URL}generated_campaigns/{filename}"
+        logger.warning(f"Cloudinary upload failed for {filename}, falling back to local storage.")
 
-    except Exception as e:
-        import traceback
-        logger.error(f"Global AI Error: {e}")
-        # traceback.print_exc()
-        return []
+    return {
+        'path': filepath,
+        'url': final_url,
+        'variants': variants.build(final_url, plan)
+    }
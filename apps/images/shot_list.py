@@ -0,0 +1,81 @@
+import json
+import logging
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Shot categories the Engineer may use (see PRIORITY LOGIC in prompts.py)
+CATEGORIES = ('hero', 'lifestyle', 'detail', 'ad')
+
+# Prompts shorter than this are fragments, not shot descriptions
+MIN_PROMPT_CHARS = 20
+
+# JSON schema the Engineer's response is constrained to
+SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'prompts': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'category': {'type': 'string', 'enum': list(CATEGORIES)},
+                    'prompt': {'type': 'string'},
+                },
+                'required': ['category', 'prompt'],
+            },
+        },
+    },
+    'required': ['prompts'],
+}
+
+
+def parse(response_text, limit, accepted=()):
+    """
+    Validate an Engineer response against SCHEMA and return its usable shots
+    ({'category', 'prompt'} dicts, at most `limit`). Items with an unknown
+    category, a fragmentary prompt, or a repeat of an `accepted` shot are
+    dropped, so they never reach an Artist call.
+    """
+    try:
+        data = json.loads(response_text)
+    except (TypeError, ValueError):
+        logger.warning(f"Engineer response is not JSON: {str(response_text)[:200]!r}")
+        metrics.ENGINEER_PROMPTS.labels('rejected').inc()
+        return []
+    items = data.get('prompts') if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        logger.warning("Engineer response has no prompt list")
+        metrics.ENGINEER_PROMPTS.labels('rejected').inc()
+        return []
+
+    seen = {shot['prompt'].casefold() for shot in accepted}
+    shots = []
+    for item in items:
+        shot = _validate(item)
+        if shot is None or shot['prompt'].casefold() in seen or len(shots) >= limit:
+            metrics.ENGINEER_PROMPTS.labels('rejected').inc()
+            continue
+        seen.add(shot['prompt'].casefold())
+        shots.append(shot)
+    metrics.ENGINEER_PROMPTS.labels('accepted').inc(len(shots))
+    return shots
+
+
+def _validate(item):
+    if not isinstance(item, dict):
+        return None
+    category = str(item.get('category', '')).strip().lower()
+    prompt = item.get('prompt')
+    if category not in CATEGORIES or not isinstance(prompt, str):
+        return None
+    prompt = prompt.strip()
+    if len(prompt) < MIN_PROMPT_CHARS:
+        return None
+    return {'category': category, 'prompt': prompt}
+
+
+def missing_categories(shots):
+    """Categories not covered yet (all of them once every one is used)."""
+    used = {shot['category'] for shot in shots}
+    return [c for c in CATEGORIES if c not in used] or list(CATEGORIES)
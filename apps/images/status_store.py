@@ -0,0 +1,106 @@
+import time
+import uuid
+import logging
+from django.conf import settings
+from django.core.cache import caches
+from .models import GenerationJob
+
+logger = logging.getLogger(__name__)
+
+FINISHED = ('success', 'error')
+
+
+class JobStatusStore:
+    """
+    What the status endpoint and the event stream report for a job. The
+    GenerationJob row is the durable record; a cache shared by the web
+    process and the huey consumer sits in front of it, keyed by task id.
+    The task running a job writes every change through (publish), finished
+    jobs are also cached on read, and reads never consume anything, so
+    repeated polls, other tabs and reconnects all see the same state.
+    In-flight entries are only written by the task, with a short TTL, so a
+    missed write can't hide progress for long.
+    """
+
+    def __init__(self, cache_alias, ttl, active_ttl):
+        self.cache_alias = cache_alias
+        self.ttl = ttl
+        self.active_ttl = active_ttl
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    @staticmethod
+    def _key(task_id):
+        return f"job-status:{task_id}"
+
+    @staticmethod
+    def entry(job):
+        return {
+            'user_id': job.user_id,
+            'status': job.status,
+            'phase': job.phase,
+            'total': job.total,
+            'urls': [r['url'] for r in job.results],
+            'variants': [r.get('variants') or {} for r in job.results],
+            'message': job.message,
+        }
+
+    def _timeout(self, entry):
+        return self.ttl if entry['status'] in FINISHED else self.active_ttl
+
+    def publish(self, job):
+        """Write a job's current state through to the cache (after its row was saved)."""
+        entry = self.entry(job)
+        self.cache.set(self._key(job.task_id), entry, self._timeout(entry))
+
+    def get(self, task_id, user_id):
+        """The job's status entry, or None when `user_id` has no job with this task id."""
+        entry = self.cache.get(self._key(task_id))
+        if entry is None:
+            job = GenerationJob.objects.only('user_id', 'status', 'phase', 'total', 'results', 'message').filter(task_id=task_id).first()
+            if job is None:
+                return None
+            entry = self.entry(job)
+            if entry['status'] in FINISHED:
+                self.cache.set(self._key(task_id), entry, self.ttl)
+        return entry if entry['user_id'] == user_id else None
+
+    def expire_task_results(self, huey, ttl):
+        """
+        Delete huey results no one needs: those of job-backed tasks at once
+        (the job row has the outcome), others `ttl` seconds after first seen
+        (huey's result store keeps no timestamps). Returns the number deleted.
+        """
+        keys = [key for key in huey.storage.result_items() if _is_task_id(key)]
+        finished = set(GenerationJob.objects.filter(task_id__in=keys, status__in=FINISHED).values_list('task_id', flat=True))
+        seen_keys = {key: f"huey-result-seen:{huey.name}:{key}" for key in keys if key not in finished}
+        seen = self.cache.get_many(seen_keys.values())
+        now = time.time()
+        expired = list(finished)
+        for key, seen_key in seen_keys.items():
+            if seen_key not in seen:
+                self.cache.set(seen_key, now, ttl * 2)
+            elif now - seen[seen_key] > ttl:
+                expired.append(key)
+                self.cache.delete(seen_key)
+        for key in expired:
+            huey.storage.delete_data(key)
+        return len(expired)
+
+
+def _is_task_id(key):
+    # The result store shares huey's key/value table with revocations ('r:<id>') and locks
+    try:
+        uuid.UUID(key)
+    except ValueError:
+        return False
+    return True
+
+
+status_store = JobStatusStore(
+    cache_alias='job_status',
+    ttl=settings.JOB_STATUS['ttl'],
+    active_ttl=settings.JOB_STATUS['active_ttl'],
+)
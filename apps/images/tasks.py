@@ -1,60 +1,320 @@
-from django_huey import db_task
-from .services import generate_campaign_images
-from .models import GeneratedImage
+import time
+from contextlib import nullcontext
+from datetime import timedelta
+from django_huey import db_task, db_periodic_task, on_startup, get_queue
+from huey import crontab
+from huey.exceptions import RetryTask
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .services import generate_campaign_images, agenerate_campaign_images
+from .runner import runner
+from . import clients, retry, metrics, catalog, scheduling
+from .models import GeneratedImage, GenerationJob, CatalogJob
+from .progress import JobProgress, CatalogProgress, delete_artifacts
+from .blobs import blob_store
+from .status_store import status_store
+from apps.accounts.models import UserProfile
 from django.contrib.auth.models import User
 import logging
 
 logger = logging.getLogger(__name__)
 
-@db_task()
-def generate_images_task(user_id, image_data, count, mode, user_prompt, plan):
+def warm_gemini_client():
+    """Open the pooled Gemini connection before the first job reaches this worker."""
+    if settings.GEMINI_WARM_UP and settings.GOOGLE_API_KEY:
+        clients.warm_up()
+
+for _queue in settings.GENERATION_QUEUES:
+    on_startup(queue=_queue)(warm_gemini_client)
+
+def generation_task(**options):
+    """
+    db_task registered on every GENERATION_QUEUES queue, so each plan tier's
+    consumer can run it. Returns the default queue's wrapper (what tasks queued
+    before plan-aware scheduling used) with all of them in `.queues`; queue
+    work through plan_task() and enqueue().
+    """
+    def decorator(fn):
+        wrappers = {name: db_task(queue=name, **options)(fn) for name in settings.GENERATION_QUEUES}
+        wrapper = wrappers[settings.DJANGO_HUEY['default']]
+        wrapper.queues = wrappers
+        return wrapper
+    return decorator
+
+def plan_task(task_fn, plan, /, **kwargs):
+    """task_fn's Task on the queue serving `plan`; pass it to enqueue() once its job is saved."""
+    return task_fn.queues[scheduling.queue_for(plan)].s(**kwargs)
+
+def enqueue(task, job):
+    """Queue `task` for `job`, behind the same user's jobs already waiting (fair share)."""
+    task.priority = scheduling.fair_priority(job)
+    get_queue(scheduling.queue_for(job.plan)).enqueue(task)
+
+@generation_task(context=True)
+def generate_images_task(user_id, image_data, count, mode, user_prompt, plan, input_blob=None, task=None):
     """
     Background task to generate images using Gemini and upload to Cloudinary.
+    The upload is memory-mapped from the blob store (`input_blob`); only tasks
+    queued before the blob store carry `image_data` bytes.
     """
-    try:
-        user = User.objects.get(id=user_id)
-        user_profile = user.userprofile
-        
-        logger.info(f"Starting background generation task for user {user.email}")
-        
-        # Call the existing service
-        # Note: image_data should be bytes
-        from io import BytesIO
-        image_file = BytesIO(image_data)
-        image_file.name = "input_image.png" # Dummy name for Cloudinary
-        
-        results = generate_campaign_images(
-            image_file,
-            count=count,
-            mode=mode,
-            user_prompt=user_prompt,
-            plan=plan
+    with _open_input(image_data, input_blob) as data:
+        return _run_generation(_load_job(task), user_id, data, count, mode, user_prompt, plan, use_async=False)
+
+@generation_task(context=True)
+def generate_images_async_task(user_id, image_data, count, mode, user_prompt, plan, input_blob=None, task=None):
+    """
+    Same job as generate_images_task, but the Gemini/Cloudinary I/O runs on the
+    shared event loop. The worker thread only waits on the result, so the
+    consumer can run many more workers (HUEY_WORKERS) than it has CPU for.
+    """
+    with _open_input(image_data, input_blob) as data:
+        return _run_generation(_load_job(task), user_id, data, count, mode, user_prompt, plan, use_async=True)
+
+@generation_task()
+def resume_generation_job(job_id):
+    """Re-run a job whose huey task was lost (worker killed, redeploy) from its checkpoints."""
+    job = GenerationJob.objects.select_related('user', 'catalog').filter(id=job_id).first()
+    if job is None or job.status in ('success', 'error'):
+        return None
+    logger.info(f"Resuming job {job.task_id} at phase {job.phase} ({len(job.results)}/{job.total} images done)")
+    return _run_stored_job(job)
+
+@generation_task()
+def generate_catalog_item(job_id):
+    """Generate one product of a bulk catalog from the input stored with its job."""
+    job = GenerationJob.objects.select_related('user', 'catalog').filter(id=job_id).first()
+    if job is None or job.status in ('success', 'error'):
+        return None
+    catalog.seed_job(job)
+    return _run_stored_job(job)
+
+def dispatch_catalog(catalog_id):
+    """Hand a catalog's next waiting products to huey, keeping at most CATALOG['max_parallel'] in flight."""
+    with transaction.atomic():
+        catalog_job = CatalogJob.objects.select_for_update().get(id=catalog_id)
+        unfinished = catalog_job.items.filter(status__in=['queued', 'processing'])
+        slots = settings.CATALOG['max_parallel'] - unfinished.filter(dispatched_at__isnull=False).count()
+        ready = list(unfinished.filter(dispatched_at__isnull=True).order_by('id')[:max(slots, 0)])
+        now = timezone.now()
+        GenerationJob.objects.filter(id__in=[job.id for job in ready]).update(dispatched_at=now, updated_at=now)
+        done = not unfinished.exists()
+    for job in ready:
+        task = plan_task(generate_catalog_item, job.plan, job_id=job.id)
+        task.id = job.task_id # So resume_stalled_jobs can revoke it, like the view's tasks
+        enqueue(task, job)
+    if done:
+        catalog.delete_context(catalog_job)
+        logger.info(f"Catalog {catalog_job.catalog_id}: all products finished")
+
+def _run_stored_job(job):
+    with blob_store.open(job.input_blob) as image_data:
+        return _run_generation(job, job.user_id, image_data, job.count, job.mode, job.user_prompt, job.plan,
+                               use_async=settings.GENERATION_ASYNC)
+
+def _open_input(image_data, input_blob):
+    return blob_store.open(input_blob) if input_blob else nullcontext(image_data)
+
+@db_periodic_task(crontab(minute='20'))
+def expire_task_results():
+    """Keep db.huey from growing: drop task results superseded by job records or older than JOB_STATUS['result_ttl']."""
+    for name in settings.GENERATION_QUEUES:
+        expired = status_store.expire_task_results(get_queue(name), settings.JOB_STATUS['result_ttl'])
+        if expired:
+            logger.info(f"Expired {expired} huey result(s) on queue {name}")
+
+@db_periodic_task(crontab(minute='40', hour='3'))
+def purge_finished_jobs():
+    """Delete finished job records older than JOB_STATUS['retention_days'] (images stay in GeneratedImage history)."""
+    days = settings.JOB_STATUS['retention_days']
+    if not days:
+        return
+    cutoff = timezone.now() - timedelta(days=days)
+    jobs = GenerationJob.objects.filter(catalog__isnull=True, status__in=['success', 'error'], updated_at__lt=cutoff).delete()[0]
+    # A catalog goes with its items once none of them is in flight or recent
+    catalogs = CatalogJob.objects.filter(updated_at__lt=cutoff).exclude(
+        items__status__in=['queued', 'processing']
+    ).exclude(items__updated_at__gte=cutoff).delete()[1].get(CatalogJob._meta.label, 0)
+    if jobs or catalogs:
+        logger.info(f"Purged {jobs} job record(s) and {catalogs} catalog record(s) older than {days} days")
+
+@db_periodic_task(crontab(minute='*/5'))
+def resume_stalled_jobs():
+    """
+    Find started jobs that stopped making progress, and queued jobs whose task
+    never reached a consumer (lost by huey, or the web process died before
+    handing it over), and resume them. Catalog products still waiting for a
+    catalog slot are not stalled.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.GENERATION_RETRY['stall_after'])
+    waiting = Q(status='queued') & (Q(catalog__isnull=True) | Q(dispatched_at__isnull=False))
+    stalled = GenerationJob.objects.filter(Q(status='processing') | waiting, updated_at__lt=cutoff).exclude(input_blob='')
+    for job in stalled:
+        # Claim the job first so only one consumer resumes it
+        claimed = GenerationJob.objects.filter(id=job.id, updated_at=job.updated_at).update(
+            updated_at=timezone.now(), message='Resuming after interruption'
         )
-        
-        if not results:
-            logger.error("Background generation failed: No results returned")
-            return {'status': 'error', 'message': 'Generation failed'}
-
-        # Save to database
-        created_count = 0
-        saved_urls = []
-        for res in results:
-            img_obj = GeneratedImage.objects.create(
-                user=user,
-                original_image=None, # We don't have the original File object easily here, but we can skip it for now or store the bytes if needed
-                image_url=res['url'],
-                count=count
-            )
-            saved_urls.append(res['url'])
-            created_count += 1
-            logger.info(f"Background task: GeneratedImage saved ID {img_obj.id}")
+        if not claimed:
+            continue
+        if job.status == 'queued':
+            # The original task may only be stuck behind a long queue: it must not run as well
+            get_queue(scheduling.queue_for(job.plan)).revoke_by_id(job.task_id)
+        enqueue(plan_task(resume_generation_job, job.plan, job_id=job.id), job)
 
-        return {
-            'status': 'success',
-            'urls': saved_urls,
-            'new_credits': user_profile.credits # Credits were already deducted in the view
-        }
+def _run_generation(job, user_id, image_data, count, mode, user_prompt, plan, use_async):
+    """Run the pipeline once, then finish the job or schedule a retry from its checkpoints."""
+    results, error = [], ''
+    started = time.perf_counter()
+    try:
+        user = User.objects.get(id=user_id)
+        if job:
+            _start_attempt(job, image_data)
+            if job.attempts == 1:
+                # Catalog items wait for their catalog slot first; count from when they were handed to huey
+                waited = timezone.now() - (job.dispatched_at or job.created_at)
+                metrics.TASK_WAIT_SECONDS.labels(scheduling.queue_for(job.plan), job.plan).observe(waited.total_seconds())
+        logger.info(f"Starting {'async ' if use_async else ''}generation task for user {user.email}")
 
+        if use_async:
+            results = runner.run(
+                agenerate_campaign_images(
+                    image_data,
+                    count=count,
+                    mode=mode,
+                    user_prompt=user_prompt,
+                    plan=plan,
+                    progress=_progress_for(job, count)
+                ),
+                timeout=settings.GENERATION_ASYNC_TIMEOUT
+            )
+        else:
+            # image_data is a memory-mapped blob or payload bytes, both used in place
+            results = generate_campaign_images(
+                image_data,
+                count=count,
+                mode=mode,
+                user_prompt=user_prompt,
+                plan=plan,
+                progress=_progress_for(job, count)
+            )
     except Exception as e:
         logger.error(f"Background task error: {str(e)}")
-        return {'status': 'error', 'message': str(e)}
+        error = str(e)
+        if job is None:
+            metrics.JOB_SECONDS.labels('error').observe(time.perf_counter() - started)
+            return {'status': 'error', 'message': error}
+
+    if job is None:
+        result = _save_results(user, results, count)
+    else:
+        try:
+            result = _settle_job(job, error)
+        except RetryTask:
+            metrics.JOB_SECONDS.labels('retry').observe(time.perf_counter() - started)
+            raise
+    metrics.JOB_SECONDS.labels(result['status']).observe(time.perf_counter() - started)
+    if job is None:
+        return result
+    if job.catalog_id:
+        dispatch_catalog(job.catalog_id)
+    # The outcome is on the job record (status_store); a huey result would only pile up in db.huey
+    return None
+
+def _load_job(task):
+    """The GenerationJob created by the view for this task (None for tasks queued before it existed)."""
+    if task is None:
+        return None
+    return GenerationJob.objects.select_related('user').filter(task_id=task.id).first()
+
+def _progress_for(job, count):
+    if job is None:
+        return None
+    return CatalogProgress(job, count) if job.catalog_id else JobProgress(job, count)
+
+def _start_attempt(job, image_data):
+    job.attempts += 1
+    fields = ['attempts', 'updated_at']
+    if not job.input_blob:
+        # Payload input: checkpoint it so the job can be resumed without it
+        job.input_blob = blob_store.put(image_data)
+        fields.append('input_blob')
+    job.save(update_fields=fields)
+
+def _settle_job(job, error=''):
+    """
+    Retry a job that came up short (with exponential backoff and jitter) while
+    attempts remain; otherwise finalize it and refund undelivered images.
+    """
+    delivered = len(job.results)
+    short = not delivered or delivered < job.total
+    if short and job.attempts < settings.GENERATION_RETRY['max_job_attempts']:
+        delay = retry.job_delay(job.attempts)
+        missing = max(job.total - delivered, 0)
+        GenerationJob.objects.filter(id=job.id).update(
+            status='processing',
+            message=f"Retrying {missing or 'all'} image(s) in {delay:.0f}s (attempt {job.attempts + 1})"[:500],
+            updated_at=timezone.now(),
+        )
+        logger.warning(f"Job {job.task_id}: {delivered}/{job.total} images after attempt {job.attempts}, retrying in {delay:.0f}s")
+        raise RetryTask(delay=delay)
+    return finalize_job(job, error)
+
+def finalize_job(job, error=''):
+    """
+    Close the job with what it delivered and refund the images it did not,
+    including a job that will never run (e.g. it could not be queued).
+    """
+    delivered = len(job.results)
+    refund = max(job.count - delivered, 0)
+    status = 'success' if delivered else 'error'
+    if delivered:
+        message = f"{refund} image(s) could not be generated; credits refunded" if refund else ''
+    else:
+        message = error or 'Generation failed'
+    finalized = GenerationJob.objects.filter(id=job.id, status__in=['queued', 'processing']).update(
+        status=status,
+        phase='done' if delivered else job.phase,
+        refunded=refund,
+        message=message[:500],
+        updated_at=timezone.now(),
+    )
+    if finalized:
+        job.status, job.message = status, message[:500]
+        job.phase = 'done' if delivered else job.phase
+        status_store.publish(job)
+    if finalized and refund:
+        UserProfile.objects.filter(user_id=job.user_id).update(credits=F('credits') + refund)
+        logger.info(f"Job {job.task_id}: refunded {refund} credit(s)")
+    delete_artifacts(job)
+
+    if not delivered:
+        logger.error("Background generation failed: No results returned")
+        return {'status': 'error', 'message': message}
+    return {
+        'status': 'success',
+        'urls': [res['url'] for res in job.results],
+        'new_credits': UserProfile.objects.values_list('credits', flat=True).get(user_id=job.user_id)
+    }
+
+def _save_results(user, results, count):
+    """Build the task result payload for tasks queued without a job record."""
+    if not results:
+        logger.error("Background generation failed: No results returned")
+        return {'status': 'error', 'message': 'Generation failed'}
+
+    for res in results:
+        img_obj = GeneratedImage.objects.create(
+            user=user,
+            original_image=None, # We don't have the original File object easily here, but we can skip it for now or store the bytes if needed
+            image_url=res['url'],
+            variants=res.get('variants') or {},
+            count=count
+        )
+        logger.info(f"Background task: GeneratedImage saved ID {img_obj.id}")
+
+    return {
+        'status': 'success',
+        'urls': [res['url'] for res in results],
+        'new_credits': user.userprofile.credits # Credits were already deducted in the view
+    }
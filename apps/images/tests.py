@@ -1,3 +1,677 @@
-from django.test import TestCase
+import os
+import json
+import time
+import uuid
+import hashlib
+import tempfile
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock, skipUnless
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from huey.exceptions import RetryTask
+from apps.images import postprocess, prompts, quota, services, shot_list, views
+from apps.images.backends import fake
+from apps.images.backends.fake import FakeImageModel, FakeStorage, FakeTextModel
+from apps.images.blobs import BlobStore, blob_store
+from apps.images.cache import ArtifactCache
+from apps.images.models import CatalogJob, GenerationJob, InputBlob, QuotaBucket
+from apps.images.tasks import _settle_job, resume_stalled_jobs
 
-# Create your tests here.
+# Job status entries go to a per-test memory cache instead of the shared file cache
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'job_status': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'job-status-tests'},
+}
+
+
+def create_user(username, credits):
+    user = User.objects.create_user(username, f'{username}@example.com', 'password')
+    profile = user.userprofile
+    profile.credits = credits
+    profile.phone_number = '+15550000000'
+    profile.save()
+    return user
+
+
+def png(color='red', size=64):
+    buffer = BytesIO()
+    Image.new('RGB', (size, size), color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class GenerateRequestTestCase(TestCase):
+    """Posts to the generate view with the blob store in a temporary directory and nothing handed to huey."""
+
+    credits = 10
+
+    def setUp(self):
+        self.user = create_user('generate', credits=self.credits)
+        self.client.force_login(self.user)
+        blob_root = tempfile.TemporaryDirectory()
+        self.addCleanup(blob_root.cleanup)
+        for patcher in (mock.patch.object(blob_store, 'root', blob_root.name), mock.patch.object(views, 'enqueue')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def generate(self, data=None, count=2, **extra):
+        upload = SimpleUploadedFile('product.png', png() if data is None else data)
+        return self.client.post(reverse('images:generate'), {'image': upload, 'count': count}, **extra)
+
+    def credits_left(self):
+        self.user.userprofile.refresh_from_db()
+        return self.user.userprofile.credits
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SettleJobTests(TestCase):
+    """
+    _settle_job re-runs a job that came up short while attempts remain, then
+    finalizes it and refunds exactly the images that were never delivered.
+    """
+
+    def setUp(self):
+        self.user = create_user('settle', credits=10)
+
+    def _job(self, delivered, count=4, attempts=3):
+        return GenerationJob.objects.create(
+            user=self.user,
+            task_id=str(uuid.uuid4()),
+            status='processing',
+            total=count,
+            count=count,
+            attempts=attempts,
+            results=[{'index': i, 'url': f'https://fake.invalid/{i}.png'} for i in range(delivered)],
+        )
+
+    def _credits(self):
+        self.user.userprofile.refresh_from_db()
+        return self.user.userprofile.credits
+
+    @override_settings(GENERATION_RETRY={'max_job_attempts': 3, 'job_base': 0, 'job_max_wait': 0})
+    def test_short_job_is_retried_without_refund(self):
+        job = self._job(delivered=1, attempts=1)
+        with self.assertRaises(RetryTask):
+            _settle_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.refunded), ('processing', 0))
+        self.assertEqual(self._credits(), 10)
+
+    def test_partial_job_refunds_undelivered_images(self):
+        job = self._job(delivered=3)
+        result = _settle_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.refunded), ('success', 1))
+        self.assertEqual(result['new_credits'], 11)
+        self.assertEqual(self._credits(), 11)
+
+    def test_failed_job_refunds_everything(self):
+        job = self._job(delivered=0)
+        result = _settle_job(job, 'Gemini unavailable')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.refunded, job.message), ('error', 4, 'Gemini unavailable'))
+        self.assertEqual(result['status'], 'error')
+        self.assertEqual(self._credits(), 14)
+
+    def test_complete_job_refunds_nothing(self):
+        job = self._job(delivered=4)
+        _settle_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.refunded), ('success', 0))
+        self.assertEqual(self._credits(), 10)
+
+    def test_job_settled_twice_is_refunded_once(self):
+        job = self._job(delivered=1)
+        _settle_job(job)
+        _settle_job(GenerationJob.objects.get(id=job.id))
+        self.assertEqual(self._credits(), 13)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class GenerateDeduplicationTests(GenerateRequestTestCase):
+    """Identical generate requests attach to the job in flight and are charged once."""
+
+    def test_identical_request_attaches_to_job_in_flight(self):
+        first = self.generate().json()
+        second = self.generate().json()
+        self.assertEqual(second['task_id'], first['task_id'])
+        self.assertTrue(second['duplicate'])
+        self.assertEqual(self.credits_left(), 8)
+        self.assertEqual(GenerationJob.objects.count(), 1)
+        self.assertEqual(InputBlob.objects.get().refs, 1)
+
+    def test_finished_job_does_not_absorb_a_new_request(self):
+        first = self.generate().json()
+        GenerationJob.objects.filter(task_id=first['task_id']).update(status='success')
+        second = self.generate().json()
+        self.assertNotEqual(second['task_id'], first['task_id'])
+        self.assertEqual(self.credits_left(), 6)
+
+    def test_idempotency_key_answers_after_the_job_finished(self):
+        first = self.generate(HTTP_IDEMPOTENCY_KEY='order-1').json()
+        GenerationJob.objects.filter(task_id=first['task_id']).update(status='success')
+        second = self.generate(data=png('blue'), HTTP_IDEMPOTENCY_KEY='order-1').json()
+        self.assertEqual(second['task_id'], first['task_id'])
+        self.assertEqual(self.credits_left(), 8)
+
+    def test_unique_constraint_race_attaches_to_the_winner(self):
+        first = self.generate().json()
+        lookup, missed = views._existing_job, []
+
+        def racing_lookup(*args):
+            # The first lookup misses the job, as if it was inserted right after
+            if not missed:
+                missed.append(True)
+                return None
+            return lookup(*args)
+
+        with mock.patch.object(views, '_existing_job', side_effect=racing_lookup):
+            second = self.generate().json()
+        self.assertEqual(second['task_id'], first['task_id'])
+        self.assertEqual(self.credits_left(), 8)
+        self.assertEqual(GenerationJob.objects.count(), 1)
+        self.assertEqual(InputBlob.objects.get().refs, 1)
+
+    def test_unique_constraint_race_with_finished_winner(self):
+        self.generate()
+        # Both lookups miss: the conflicting job finished before the second one
+        with mock.patch.object(views, '_existing_job', return_value=None):
+            response = self.generate()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.credits_left(), 8)
+        self.assertEqual(InputBlob.objects.get().refs, 1)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class GenerateEnqueueFailureTests(GenerateRequestTestCase):
+    """A job that can't be handed to huey fails at once and gives the credits back."""
+
+    def test_enqueue_failure_refunds_and_frees_the_request(self):
+        views.enqueue.side_effect = OSError('huey storage unavailable')
+        response = self.generate()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.credits_left(), self.credits)
+        self.assertEqual(GenerationJob.objects.get().status, 'error')
+        self.assertFalse(InputBlob.objects.exists())
+        # An identical resubmission starts a new job instead of attaching to the dead one
+        views.enqueue.side_effect = None
+        self.assertNotIn('duplicate', self.generate().json())
+        self.assertEqual(GenerationJob.objects.count(), 2)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class GenerateDatabaseFailureTests(GenerateRequestTestCase):
+    """A request that fails before its job is recorded leaves no blob reference behind."""
+
+    def test_database_error_releases_the_blob(self):
+        with mock.patch.object(GenerationJob.objects, 'create', side_effect=DatabaseError('database is locked')):
+            response = self.generate()
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.credits_left(), self.credits)
+        self.assertFalse(InputBlob.objects.exists())
+
+
+@override_settings(CACHES=TEST_CACHES, GENERATION_RETRY={'stall_after': 60})
+class ResumeStalledJobsTests(TestCase):
+    """Jobs that stopped progressing, or were never picked up, are resumed once."""
+
+    def setUp(self):
+        self.user = create_user('stalled', credits=0)
+        patcher = mock.patch('apps.images.tasks.get_queue')
+        self.get_queue = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _job(self, status, idle, **fields):
+        job = GenerationJob.objects.create(
+            user=self.user, task_id=str(uuid.uuid4()), status=status, total=2, count=2, input_blob='ab' * 32, **fields
+        )
+        GenerationJob.objects.filter(id=job.id).update(updated_at=timezone.now() - timedelta(seconds=idle))
+        return job
+
+    def resumed(self):
+        return [task.kwargs['job_id'] for task in (c.args[0] for c in self.get_queue.return_value.enqueue.call_args_list)]
+
+    def test_stalled_jobs_are_resumed(self):
+        processing = self._job('processing', idle=120)
+        lost = self._job('queued', idle=120)
+        self._job('processing', idle=10)
+        self._job('queued', idle=10)
+        resume_stalled_jobs.call_local()
+        self.assertCountEqual(self.resumed(), [processing.id, lost.id])
+        # Only the queued job's original task could still be waiting in huey
+        self.get_queue.return_value.revoke_by_id.assert_called_once_with(lost.task_id)
+        # Claimed: the next run leaves them alone
+        resume_stalled_jobs.call_local()
+        self.assertEqual(len(self.resumed()), 2)
+
+    def test_catalog_products_waiting_for_a_slot_are_not_stalled(self):
+        catalog_job = CatalogJob.objects.create(user=self.user, catalog_id=str(uuid.uuid4()))
+        self._job('queued', idle=120, catalog=catalog_job)
+        dispatched = self._job('queued', idle=120, catalog=catalog_job, dispatched_at=timezone.now())
+        resume_stalled_jobs.call_local()
+        self.assertEqual(self.resumed(), [dispatched.id])
+
+
+@override_settings(CACHES=TEST_CACHES, UPLOAD_LIMITS={'free': {'max_mb': 0.05, 'max_megapixels': 0.01}})
+class GenerateUploadRejectionTests(GenerateRequestTestCase):
+    """Uploads outside the plan's limits are refused while parsed: no job, no blob, credits untouched."""
+
+    def assertRejected(self, response, status):
+        self.assertEqual(response.status_code, status)
+        self.assertIn('error', response.json())
+        self.assertEqual(self.credits_left(), self.credits)
+        self.assertFalse(GenerationJob.objects.exists())
+        self.assertFalse(InputBlob.objects.exists())
+
+    def test_unsupported_format(self):
+        self.assertRejected(self.generate(data=b'%PDF-1.7 not an image at all'), 400)
+
+    def test_too_few_bytes_to_be_an_image(self):
+        self.assertRejected(self.generate(data=b'GIF8'), 400)
+
+    def test_too_many_megapixels(self):
+        # 200x200 = 0.04 MP in a tiny PNG: refused from the header alone
+        self.assertRejected(self.generate(data=png(size=200)), 413)
+
+    def test_too_many_bytes(self):
+        # A valid small image padded past the 0.05 MB limit
+        self.assertRejected(self.generate(data=png() + bytes(64 * 1024)), 413)
+
+    def test_accepted_upload_is_charged(self):
+        response = self.generate()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.credits_left(), self.credits - 2)
+        self.assertEqual(InputBlob.objects.get().refs, 1)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class MetricsViewTests(TestCase):
+    """/metrics answers the configured bearer token or staff, and is never public."""
+
+    def scrape(self, **extra):
+        return self.client.get(reverse('metrics'), **extra)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_closed_without_a_token(self):
+        self.assertEqual(self.scrape().status_code, 403)
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_bearer_token(self):
+        self.assertEqual(self.scrape().status_code, 401)
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION='Bearer scrape-secret').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_staff_without_a_token(self):
+        user = create_user('operator', credits=0)
+        self.client.force_login(user)
+        self.assertEqual(self.scrape().status_code, 403)
+        User.objects.filter(id=user.id).update(is_staff=True)
+        self.assertEqual(self.scrape().status_code, 200)
+
+
+class StoreFinalImageTests(TestCase):
+    """Images that fall back to local storage never overwrite one another."""
+
+    def test_same_index_in_the_same_second_gets_distinct_files(self):
+        storage = mock.Mock(name='offline')
+        storage.upload.side_effect = ConnectionError('storage unreachable')
+        output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(output_dir.cleanup)
+        with mock.patch.object(services.backends, 'storage', return_value=storage):
+            first = services._store_final_image(png('red'), 0, 'free', output_dir.name)
+            second = services._store_final_image(png('blue'), 0, 'free', output_dir.name)
+        self.assertNotEqual(first['path'], second['path'])
+        with open(first['path'], 'rb') as f:
+            self.assertEqual(f.read(), png('red'))
+
+
+@override_settings(GEMINI_QUOTA={'enabled': True, 'models': {'model-a': {'rpm': 60, 'burst': 1}}, 'backoff': 10})
+class QuotaGovernorTests(TestCase):
+    """The shared GCRA bucket books consecutive slots in one statement and takes 429s from every phase."""
+
+    def setUp(self):
+        self.governor = quota.QuotaGovernor()
+
+    def test_reservations_are_spaced_by_the_rate(self):
+        waits = [self.governor.reserve('model-a') for _ in range(3)]
+        self.assertEqual(waits[0], 0.0)
+        self.assertAlmostEqual(waits[1], 1.0, delta=0.1)
+        self.assertAlmostEqual(waits[2], 2.0, delta=0.1)
+        self.assertEqual(QuotaBucket.objects.get(model='model-a').granted, 3)
+
+    @skipUnless(quota._update_returning(), 'UPDATE ... RETURNING not supported by this database')
+    def test_reservation_is_one_statement_once_the_bucket_exists(self):
+        self.governor.reserve('model-a')
+        with self.assertNumQueries(1):
+            self.governor.reserve('model-a')
+
+    def test_deleted_bucket_is_recreated(self):
+        self.governor.reserve('model-a')
+        QuotaBucket.objects.all().delete()
+        self.assertEqual(self.governor.reserve('model-a'), 0.0)
+        self.assertEqual(QuotaBucket.objects.get(model='model-a').granted, 1)
+
+    def test_unlimited_model_is_not_booked(self):
+        self.assertEqual(self.governor.reserve('model-b'), 0.0)
+        self.assertFalse(QuotaBucket.objects.exists())
+
+    @override_settings(GEMINI_QUOTA={'enabled': True, 'models': {'model-a': {'rpm': 60, 'burst': 100}}, 'backoff': 10})
+    def test_director_and_engineer_429s_penalize_the_bucket(self):
+        throttled = Exception('429 RESOURCE_EXHAUSTED')
+        image_model = mock.Mock(model='model-a', **{'generate.side_effect': throttled})
+        text_model = mock.Mock(model='model-a', **{'generate_json.side_effect': throttled})
+        with mock.patch.object(quota, 'governor', self.governor):
+            with self.assertRaises(Exception):
+                services._run_director(image_model, None, 'creative', '')
+            with self.assertRaises(Exception):
+                services._run_engineer(text_model, '', None, None)
+        bucket = QuotaBucket.objects.get(model='model-a')
+        self.assertEqual(bucket.throttled, 2)
+        self.assertGreater(bucket.tat, time.time() + 15)
+
+
+class ScriptedTextModel(FakeTextModel):
+    """Prompt Engineer answering with canned responses, recording each instruction it was given."""
+
+    def __init__(self, *responses):
+        self.responses, self.instructions = list(responses), []
+
+    def _respond(self, contents):
+        self.instructions.append(fake._instruction(contents))
+        return self.responses.pop(0)
+
+
+class RecordingImageModel(FakeImageModel):
+    """Offline image model recording each instruction (Director first, then one per Artist call)."""
+
+    def __init__(self):
+        super().__init__()
+        self.instructions = []
+
+    def _respond(self, contents):
+        self.instructions.append(fake._instruction(contents))
+        return super()._respond(contents)
+
+
+def shots(*items):
+    return json.dumps({'prompts': [{'category': category, 'prompt': prompt} for category, prompt in items]})
+
+
+HERO = ('hero', 'Product on a marble plinth, soft key light')
+LIFESTYLE = ('lifestyle', 'Model holding the product on a sunny terrace')
+DETAIL = ('detail', 'Macro shot of the stitching under raking light')
+AD = ('ad', 'Bold flat-colour backdrop with room for a headline')
+
+NO_LATENCY = dict(settings.FAKE_BACKEND, image_latency=0, text_latency=0, upload_latency=0, image_size=64)
+
+
+class ShotListParseTests(SimpleTestCase):
+    """Engineer responses are validated item by item; anything unusable is dropped before an Artist sees it."""
+
+    def test_malformed_json_yields_nothing(self):
+        for response in ('not json', '{"prompts": [', '', None):
+            with self.subTest(response=response):
+                self.assertEqual(shot_list.parse(response, 4), [])
+
+    def test_response_without_a_prompt_list_yields_nothing(self):
+        for response in ('{"prompts": "hero shot"}', '{"shots": []}', '42'):
+            with self.subTest(response=response):
+                self.assertEqual(shot_list.parse(response, 4), [])
+
+    def test_items_breaking_the_schema_are_dropped(self):
+        response = json.dumps({'prompts': [
+            {'category': 'hero', 'prompt': HERO[1]},
+            {'category': 'portrait', 'prompt': LIFESTYLE[1]}, # unknown category
+            {'category': 'detail', 'prompt': 'Close-up'}, # fragment
+            {'category': 'ad', 'prompt': ['not', 'a', 'string']},
+            {'prompt': DETAIL[1]}, # no category
+            'ad: a bare string',
+            {'category': ' AD ', 'prompt': f"  {AD[1]}  "}, # normalized
+        ]})
+        self.assertEqual(shot_list.parse(response, 4), [
+            {'category': 'hero', 'prompt': HERO[1]},
+            {'category': 'ad', 'prompt': AD[1]},
+        ])
+
+    def test_repeats_and_extras_are_dropped(self):
+        accepted = [{'category': 'hero', 'prompt': HERO[1]}]
+        response = shots((HERO[0], HERO[1].upper()), LIFESTYLE, LIFESTYLE, DETAIL, AD)
+        self.assertEqual([shot['prompt'] for shot in shot_list.parse(response, 2, accepted=accepted)], [LIFESTYLE[1], DETAIL[1]])
+
+    def test_bare_list_is_accepted(self):
+        response = json.dumps([{'category': 'hero', 'prompt': HERO[1]}])
+        self.assertEqual(len(shot_list.parse(response, 4)), 1)
+
+
+@override_settings(FAKE_BACKEND=NO_LATENCY, GEMINI_QUOTA={'enabled': False, 'models': {}, 'backoff': 0})
+class EngineerReaskTests(SimpleTestCase):
+    """A short or broken prompt list is completed by re-asking for just the missing prompts."""
+
+    def engineer(self, text_model, count):
+        return services._engineer_prompts(text_model, None, None, count, 'creative', '')
+
+    def test_complete_list_is_not_reasked(self):
+        text_model = ScriptedTextModel(shots(HERO, LIFESTYLE, DETAIL))
+        self.assertEqual(self.engineer(text_model, 3), [HERO[1], LIFESTYLE[1], DETAIL[1]])
+        self.assertEqual(len(text_model.instructions), 1)
+
+    def test_short_list_is_completed_by_a_reask(self):
+        text_model = ScriptedTextModel(shots(HERO, ('ad', 'Too short')), shots(LIFESTYLE, DETAIL))
+        self.assertEqual(self.engineer(text_model, 3), [HERO[1], LIFESTYLE[1], DETAIL[1]])
+        reask = text_model.instructions[1]
+        self.assertIn('exactly 2 more', reask)
+        self.assertIn(HERO[1], reask) # Shown what it already has, so it doesn't repeat it
+
+    def test_malformed_response_is_reasked_in_full(self):
+        text_model = ScriptedTextModel('Sure! Here are your prompts: ...', shots(HERO, LIFESTYLE))
+        self.assertEqual(self.engineer(text_model, 2), [HERO[1], LIFESTYLE[1]])
+        self.assertIn('exactly 2 more', text_model.instructions[1])
+
+    def test_reask_repeating_an_accepted_prompt_stays_short(self):
+        text_model = ScriptedTextModel(shots(HERO), shots(HERO))
+        self.assertEqual(self.engineer(text_model, 2), [HERO[1]])
+
+    @override_settings(ENGINEER_REASKS=0)
+    def test_no_reask_budget_keeps_the_short_list(self):
+        text_model = ScriptedTextModel(shots(HERO))
+        self.assertEqual(self.engineer(text_model, 3), [HERO[1]])
+        self.assertEqual(len(text_model.instructions), 1)
+
+
+@override_settings(
+    FAKE_BACKEND=NO_LATENCY, ENGINEER_REASKS=0,
+    GEMINI_QUOTA={'enabled': False, 'models': {}, 'backoff': 0},
+    ARTIFACT_CACHE=dict(settings.ARTIFACT_CACHE, enabled=False),
+)
+class RejectedShotPipelineTests(TestCase):
+    """Prompts the Engineer got wrong never reach an Artist call."""
+
+    def test_only_accepted_prompts_are_rendered(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        image_model = RecordingImageModel()
+        text_model = ScriptedTextModel(shots(HERO, ('portrait', 'Unknown category but long enough'), ('ad', 'Too short'), DETAIL))
+        with override_settings(MEDIA_ROOT=media_root.name), \
+                mock.patch.object(services.backends, 'image_model', return_value=image_model), \
+                mock.patch.object(services.backends, 'text_model', return_value=text_model), \
+                mock.patch.object(services.backends, 'storage', return_value=FakeStorage()):
+            results = services.generate_campaign_images(png(), count=4)
+        self.assertEqual([result['prompt'] for result in results], [HERO[1], DETAIL[1]])
+        artist_instructions = image_model.instructions[1:]
+        self.assertEqual(len(artist_instructions), 2)
+        for instruction in artist_instructions:
+            self.assertNotIn('Unknown category', instruction)
+            self.assertNotIn('Too short', instruction)
+
+
+class BlobStoreTests(TestCase):
+    """Content-addressed input store: one file per distinct content, removed with its last reference."""
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.store = BlobStore(root.name)
+
+    def files(self):
+        return sorted(
+            os.path.relpath(os.path.join(path, name), self.store.root)
+            for path, _, names in os.walk(self.store.root) for name in names
+        )
+
+    def test_same_bytes_stored_twice_share_one_file(self):
+        data = png()
+        first, second = self.store.put(data), self.store.put(data)
+        self.assertEqual(first, second)
+        self.assertEqual(first, hashlib.sha256(data).hexdigest())
+        self.assertEqual(self.files(), [os.path.relpath(self.store.path(first), self.store.root)])
+        blob = InputBlob.objects.get(digest=first)
+        self.assertEqual((blob.refs, blob.size), (2, len(data)))
+
+    def test_release_to_zero_deletes_the_file(self):
+        digest = self.store.put(png())
+        self.store.put(png())
+        self.store.release(digest)
+        self.assertTrue(os.path.exists(self.store.path(digest)))
+        self.assertEqual(InputBlob.objects.get(digest=digest).refs, 1)
+        self.store.release(digest)
+        self.assertFalse(os.path.exists(self.store.path(digest)))
+        self.assertFalse(InputBlob.objects.exists())
+        # Releasing again is a no-op
+        self.store.release(digest)
+
+    def test_put_from_chunks_matches_put_from_bytes(self):
+        data = png(size=256)
+        chunked = self.store.put(data[i:i + 1000] for i in range(0, len(data), 1000))
+        self.assertEqual(self.store.put(data), chunked)
+        self.assertEqual(InputBlob.objects.get(digest=chunked).refs, 2)
+        with self.store.open(chunked) as mapped:
+            self.assertEqual(mapped[:], data)
+
+    def test_open_missing_digest(self):
+        with self.assertRaises(FileNotFoundError):
+            with self.store.open('0' * 64):
+                pass
+
+    def test_failed_put_leaves_nothing_behind(self):
+        def chunks():
+            yield png()
+            raise OSError('client disconnected')
+
+        with self.assertRaises(OSError):
+            self.store.put(chunks())
+        self.assertEqual(self.files(), [])
+        self.assertFalse(InputBlob.objects.exists())
+
+
+class ArtifactCacheTests(SimpleTestCase):
+    """Director/Engineer outputs expire after the TTL, are evicted least recently used first, and are keyed by prompt version."""
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.cache = ArtifactCache(root.name, max_bytes=250, ttl=3600)
+
+    def age(self, key, accessed=0, written=0):
+        """Move an entry's last access (atime) and write (mtime) that many seconds into the past."""
+        now = time.time()
+        os.utime(self.cache._path(key), (now - accessed, now - written))
+
+    def test_entry_expires_after_the_ttl(self):
+        self.cache.set('fresh', b'reference')
+        self.cache.set('stale', b'reference')
+        self.age('stale', written=3601)
+        self.assertEqual(self.cache.get('fresh'), b'reference')
+        self.assertIsNone(self.cache.get('stale'))
+        self.assertFalse(os.path.exists(self.cache._path('stale')))
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+
+    def test_hit_refreshes_recency_but_not_the_ttl(self):
+        self.cache.set('entry', b'reference')
+        self.age('entry', accessed=600, written=600)
+        self.cache.get('entry')
+        st = os.stat(self.cache._path('entry'))
+        self.assertAlmostEqual(st.st_atime, time.time(), delta=5)
+        self.assertAlmostEqual(st.st_mtime, time.time() - 600, delta=5)
+
+    def test_least_recently_used_entries_are_evicted_past_max_bytes(self):
+        self.cache.set('a', bytes(100))
+        self.cache.set('b', bytes(100))
+        self.age('a', accessed=200)
+        self.age('b', accessed=100)
+        self.cache.get('a') # 'a' is now the most recently used
+        self.cache.set('c', bytes(100))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('c'))
+        stats = self.cache.stats()
+        self.assertEqual((stats['evictions'], stats['bytes']), (1, 200))
+
+    def test_expired_entries_are_evicted_on_write(self):
+        self.cache.set('old', b'x')
+        self.age('old', written=3601)
+        self.cache.set('new', b'y')
+        self.assertEqual(self.cache.stats()['entries'], 1)
+
+    def test_key_changes_with_the_prompt_version(self):
+        image = png()
+        key = ArtifactCache.key('engineer', image, 'creative', '', 4)
+        self.assertEqual(ArtifactCache.key('engineer', image, 'creative', '', 4), key)
+        self.assertNotEqual(ArtifactCache.key('engineer', png('blue'), 'creative', '', 4), key)
+        self.assertNotEqual(ArtifactCache.key('director', image, 'creative', '', 4), key)
+        with mock.patch.object(prompts, 'PROMPT_VERSION', f"{prompts.PROMPT_VERSION}-next"):
+            self.assertNotEqual(ArtifactCache.key('engineer', image, 'creative', '', 4), key)
+
+
+@override_settings(CLOUDINARY_UPLOAD_LIMITS={'max_megapixels': 0.5, 'max_mb': 0.1, 'encoder': 'png'})
+class FitForUploadTests(SimpleTestCase):
+    """Final images are brought within the upload megapixel and byte budgets in one pass."""
+
+    def assertFits(self, data, fmt, max_megapixels, max_mb):
+        width, height, actual = postprocess.probe(data)
+        self.assertLessEqual(width * height, max_megapixels * 1000000)
+        self.assertLessEqual(len(data), max_mb * 1024 * 1024)
+        self.assertEqual(actual.lower(), fmt)
+
+    def test_image_within_limits_passes_through(self):
+        data = fake.synthetic_image('small', 64)
+        self.assertEqual(postprocess.fit_for_upload(data), (data, 'png'))
+
+    def test_megapixels_are_reduced_keeping_the_aspect_ratio(self):
+        data, fmt = postprocess.fit_for_upload(fake.synthetic_image('large', 1024), max_mb=5)
+        self.assertEqual(fmt, 'png')
+        self.assertFits(data, 'png', 0.5, 5)
+        width, height, _ = postprocess.probe(data)
+        self.assertEqual(width, height)
+
+    def test_lossless_over_the_byte_budget_falls_back_to_webp(self):
+        data, fmt = postprocess.fit_for_upload(fake.synthetic_image('large', 1024))
+        self.assertEqual(fmt, 'webp')
+        self.assertFits(data, 'webp', 0.5, 0.1)
+
+    def test_quality_search_picks_the_best_quality_that_fits(self):
+        img = Image.open(BytesIO(fake.synthetic_image('large', 512)))
+        sizes = {quality: len(postprocess.encode(img, 'webp', quality)) for quality in postprocess._QUALITIES}
+        budget = sorted(sizes.values())[len(sizes) // 2]
+        data, used = postprocess._encode_within(img, 'webp', budget)
+        best = next(quality for quality in postprocess._QUALITIES if sizes[quality] <= budget)
+        self.assertEqual(used, 'webp')
+        self.assertEqual(data, postprocess.encode(img, 'webp', best))
+
+    def test_size_rejection_retries_with_a_tighter_webp_budget(self):
+        storage = mock.Mock(name='cloudinary', **{'is_size_error.return_value': True})
+        storage.upload.side_effect = [Exception('File size too large'), 'https://res.cloudinary.com/demo/final.webp']
+        with mock.patch.object(services.backends, 'storage', return_value=storage):
+            stored = services._store_final_image(fake.synthetic_image('large', 1024), 0, 'free', tempfile.gettempdir())
+        self.assertEqual(stored['url'], 'https://res.cloudinary.com/demo/final.webp')
+        retried, _, fmt = storage.upload.call_args.args
+        self.assertEqual(fmt, 'webp')
+        self.assertFits(retried, 'webp', 0.5 * 0.8, 0.1 * 0.8)
@@ -0,0 +1,178 @@
+import json
+import hashlib
+import logging
+from io import BytesIO
+from PIL import Image
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler, StopUpload
+from . import ingest
+
+logger = logging.getLogger(__name__)
+
+# Leading bytes of an upload searched for the image header; JPEG EXIF blocks can run past 64 KB
+HEADER_SEARCH_BYTES = 1024 * 1024
+
+UNSUPPORTED_MESSAGE = "Upload a PNG, JPEG, WebP, HEIC, AVIF or GIF image"
+
+
+def plan_limits(plan):
+    return settings.UPLOAD_LIMITS.get(plan, settings.UPLOAD_LIMITS['free'])
+
+
+class UploadRejected(Exception):
+    """An upload failed ImageHeaderCheck; `status` is the HTTP status to answer with."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ImageHeaderCheck:
+    """
+    Checks an image from its leading bytes as they arrive (feed), raising
+    UploadRejected as soon as they aren't a supported image or its header
+    reports more than `max_pixels`. `mime` is the sniffed type once known.
+    """
+
+    def __init__(self, max_pixels):
+        self.max_pixels = max_pixels
+        self.head = bytearray() # Leading bytes until the header has been checked, then None
+        self.mime = None
+
+    def feed(self, data):
+        if self.head is not None:
+            self.head += data
+            self._inspect()
+
+    def _inspect(self):
+        if self.mime is None:
+            if len(self.head) < 16:
+                return
+            self.mime = ingest.sniff_mime(self.head)
+            if self.mime is None:
+                raise UploadRejected(400, UNSUPPORTED_MESSAGE)
+        try:
+            # Image.open only parses the header; no pixels are decoded here
+            with Image.open(BytesIO(self.head)) as img:
+                width, height = img.size
+        except Image.DecompressionBombError:
+            raise UploadRejected(413, self._pixels_message())
+        except (OSError, SyntaxError, ValueError, EOFError):
+            if len(self.head) >= HEADER_SEARCH_BYTES:
+                # No Pillow plugin for the format (e.g. HEIC): Gemini reads it natively
+                self.head = None
+            return
+        if width * height > self.max_pixels:
+            raise UploadRejected(413, self._pixels_message())
+        self.head = None
+
+    def _pixels_message(self):
+        return f"Images can be at most {self.max_pixels / 1_000_000:g} megapixels on your plan"
+
+    def finish(self):
+        """Call once all bytes were fed; returns the mime type."""
+        if self.mime is None:
+            # Fewer than 16 bytes arrived: sniff what there is
+            self.mime = ingest.sniff_mime(self.head)
+            if self.mime is None:
+                raise UploadRejected(400, UNSUPPORTED_MESSAGE)
+        return self.mime
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """
+    Upload handler for product photos, run while the multipart body is
+    parsed. A file is refused as soon as its first bytes aren't a supported
+    image, its header reports more megapixels than the user's plan allows, or
+    it grows past the plan's size limit; parsing then stops and `error` holds
+    (status, message) for the view. Accepted files are spooled to a temporary
+    file on disk, never to memory, and carry their sha256 (`content_digest`)
+    and sniffed `mime_type`.
+    """
+
+    def __init__(self, request):
+        super().__init__(request)
+        self.error = None
+        limits = plan_limits(request.user.userprofile.plan_type)
+        self.max_mb = limits['max_mb']
+        self.max_bytes = int(limits['max_mb'] * 1024 * 1024)
+        self.max_pixels = int(limits['max_megapixels'] * 1_000_000)
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+        self.header_check = ImageHeaderCheck(self.max_pixels)
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.max_bytes:
+            self._reject(413, f"Images can be at most {self.max_mb:g} MB on your plan")
+        try:
+            self.header_check.feed(raw_data)
+        except UploadRejected as e:
+            self._reject(e.status, e.message)
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        try:
+            mime = self.header_check.finish()
+        except UploadRejected as e:
+            self._reject(e.status, e.message)
+        upload = super().file_complete(file_size)
+        upload.content_digest = self.digest.hexdigest()
+        upload.mime_type = mime
+        return upload
+
+    def _reject(self, status, message):
+        self.error = (status, message)
+        logger.info(f"Upload {self.file_name!r} rejected: {message}")
+        self.upload_interrupted()
+        # Leave the rest of the body unread
+        raise StopUpload(connection_reset=True)
+
+
+class RequestBodyLimit:
+    """
+    ASGI middleware refusing request bodies over `limits[path]` bytes before
+    Django spools them: with a 413 when Content-Length is already too large,
+    or by cutting off a streamed body once it passes the limit (also 413).
+    """
+
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope['path']) if scope['type'] == 'http' else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        length = dict(scope['headers']).get(b'content-length', b'')
+        if length.isdigit() and int(length) > limit:
+            return await self._too_large(send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            received += len(message.get('body', b''))
+            if received > limit:
+                # Django drops a request whose client went away, without responding
+                return {'type': 'http.disconnect'}
+            return message
+
+        await self.app(scope, limited_receive, send)
+        if received > limit:
+            await self._too_large(send)
+
+    @staticmethod
+    async def _too_large(send):
+        await send({'type': 'http.response.start', 'status': 413, 'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': json.dumps({'error': 'Upload too large'}).encode()})
+
+
+def max_request_bytes():
+    """Largest generate request any plan may send: its biggest image plus room for the other form fields."""
+    return int(max(limits['max_mb'] for limits in settings.UPLOAD_LIMITS.values()) * 1024 * 1024) + 64 * 1024
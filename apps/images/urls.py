@@ -6,4 +6,9 @@ app_name = 'images'
 urlpatterns = [
     path('generate/', views.generate_image, name='generate'),
     path('status/<str:task_id>/', views.task_status, name='task_status'),
+    path('status/<str:task_id>/events/', views.task_events, name='task_events'),
+    path('catalog/', views.generate_catalog, name='catalog'),
+    path('catalog/<str:catalog_id>/', views.catalog_status, name='catalog_status'),
+    path('catalog/<str:catalog_id>/manifest.csv', views.catalog_manifest, name='catalog_manifest'),
+    path('quota/', views.quota_status, name='quota_status'),
 ]
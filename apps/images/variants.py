@@ -0,0 +1,77 @@
+from django.conf import settings
+
+# Responsive variants of published images, built as Cloudinary delivery URLs
+# (the transformation goes after /upload/). Every width in the srcset ladder
+# and the plan's high-res download are requested eagerly at upload and derived
+# in the background (eager_async), so the upload doesn't wait for them and the
+# first view is usually served from a stored derivation rather than a cold one.
+# Eager derivations can't use f_auto, hence the explicit WebP thumbnails.
+
+
+def thumbnail_transformation(width):
+    return f"w_{width},c_scale,q_auto,f_webp"
+
+
+def high_res_transformation(width):
+    return f"w_{width},c_scale,q_auto:best"
+
+
+def _widths():
+    config = settings.IMAGE_VARIANTS
+    return sorted(set(config['widths']) | {config['thumbnail_width']})
+
+
+def _high_res_width(plan):
+    widths = settings.IMAGE_VARIANTS['high_res_widths']
+    return widths.get(plan, widths['free'])
+
+
+def _is_derivable(url):
+    return 'cloudinary.com' in url and '/upload/' in url
+
+
+def _derive(url, transformation):
+    return url.replace('/upload/', f'/upload/{transformation}/', 1)
+
+
+def eager_transformations(plan):
+    """Transformations to request at upload time (empty when eager derivation is off)."""
+    if not settings.IMAGE_VARIANTS['eager']:
+        return []
+    return [thumbnail_transformation(w) for w in _widths()] + [high_res_transformation(_high_res_width(plan))]
+
+
+def build(url, plan):
+    """
+    {'plan', 'thumbnail', 'srcset', 'high_res'} for a published image.
+    Images outside Cloudinary (local fallback) have no derivations: every
+    variant is the original and srcset is empty.
+    """
+    if not _is_derivable(url):
+        return {'plan': plan, 'thumbnail': url, 'srcset': '', 'high_res': url}
+    return {
+        'plan': plan,
+        'thumbnail': _derive(url, thumbnail_transformation(settings.IMAGE_VARIANTS['thumbnail_width'])),
+        'srcset': ', '.join(f"{_derive(url, thumbnail_transformation(w))} {w}w" for w in _widths()),
+        'high_res': high_res_url(url, plan),
+    }
+
+
+def high_res_url(url, plan):
+    if not _is_derivable(url):
+        return url
+    return _derive(url, high_res_transformation(_high_res_width(plan)))
+
+
+def for_image(url, plan, stored=None):
+    """
+    Variants to render for an image: those stored at upload when present
+    (derived eagerly, and kept if the ladder changes later), otherwise built
+    from the URL (images published before variants were stored).
+    """
+    if not stored:
+        return build(url, plan)
+    if stored.get('plan') != plan:
+        # The plan changed since upload, and with it the high-res width
+        return dict(stored, plan=plan, high_res=high_res_url(url, plan))
+    return stored
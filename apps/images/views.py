@@ -1,41 +1,130 @@
-from django.http import JsonResponse
+import csv
+import json
+import time
+import uuid
+import hmac
+import asyncio
+import hashlib
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from prometheus_client import CONTENT_TYPE_LATEST
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from .tasks import generate_images_task
-from .models import GeneratedImage
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import transaction, IntegrityError, DatabaseError, connection, connections
+from django.utils import timezone
+from .tasks import generate_images_task, generate_images_async_task, dispatch_catalog, plan_task, enqueue, finalize_job
+from .models import GeneratedImage, GenerationJob, CatalogJob
+from .blobs import blob_store
+from .status_store import status_store
+from .uploads import ImageUploadHandler
+from .quota import governor
+from . import metrics, catalog, variants
 import logging
 
 logger = logging.getLogger(__name__)
 
+@csrf_exempt
 @login_required
+@metrics.count_requests('generate')
 def generate_image(request):
+    # The upload is validated and spooled to disk while it is parsed, so the handler
+    # must be in place before anything (CSRF included) reads request.POST/FILES
+    upload_handler = ImageUploadHandler(request)
+    request.upload_handlers = [upload_handler]
+    return _generate_image(request, upload_handler)
+
+@csrf_protect
+def _generate_image(request, upload_handler):
     if request.method == 'POST':
         try:
             image_file = request.FILES.get('image')
-            count = int(request.POST.get('count', 4))
+            if upload_handler.error:
+                status, message = upload_handler.error
+                return JsonResponse({'error': message}, status=status)
+            if image_file is None:
+                return JsonResponse({'error': 'No image uploaded'}, status=400)
+            try:
+                count = int(request.POST.get('count', 4))
+            except ValueError:
+                count = 0
+            if count < 1:
+                return JsonResponse({'error': 'Invalid image count'}, status=400)
             mode = request.POST.get('mode', 'creative')
+            if mode not in catalog.MODES:
+                return JsonResponse({'error': 'Invalid mode'}, status=400)
             user_prompt = request.POST.get('user_prompt', '')
             
             user_profile = request.user.userprofile
+            
+            # Hashed by the upload handler as the body was parsed
+            content_digest = image_file.content_digest
+            
+            # 0. Attach double-clicks, browser retries and resubmits to the job already running
+            request_key, client_key = _request_key(request, content_digest, count, mode, user_prompt, user_profile.plan_type)
+            existing = _existing_job(request.user, request_key, client_key)
+            if existing:
+                return _attached_response(existing, user_profile)
+            
             if user_profile.credits < count:
                 return JsonResponse({'error': 'Not enough credits'}, status=402)
             
-            # Read image data once to pass to background task
-            image_data = image_file.read()
+            # 1. Spool the upload to the blob store: the task payload carries only its digest
+            input_blob = blob_store.put(image_file.chunks())
             
-            # 1. Deduct credits immediately to prevent double-spending
-            user_profile.credits -= count
-            user_profile.save()
+            # 2. Deduct credits and record the job together (with a progress record the status endpoint can read)
+            try:
+                task_fn = generate_images_async_task if settings.GENERATION_ASYNC else generate_images_task
+                task = plan_task(
+                    task_fn,
+                    user_profile.plan_type,
+                    user_id=request.user.id,
+                    image_data=None,
+                    count=count,
+                    mode=mode,
+                    user_prompt=user_prompt,
+                    plan=user_profile.plan_type,
+                    input_blob=input_blob
+                )
+                with transaction.atomic():
+                    job = GenerationJob.objects.create(
+                        user=request.user,
+                        task_id=task.id,
+                        total=count,
+                        count=count,
+                        mode=mode,
+                        user_prompt=user_prompt,
+                        plan=user_profile.plan_type,
+                        request_key=request_key,
+                        input_blob=input_blob
+                    )
+                    user_profile.credits -= count
+                    user_profile.save()
+            except IntegrityError:
+                # An identical request created its job between our lookup and insert
+                blob_store.release(input_blob)
+                user_profile.refresh_from_db()
+                existing = _existing_job(request.user, request_key, client_key)
+                if existing is None:
+                    # ...and it already finished: nothing to attach to, and no credits were taken
+                    return JsonResponse({'error': 'An identical request just finished. Submit again to start a new one.'}, status=409)
+                return _attached_response(existing, user_profile)
+            except Exception:
+                # No job owns the blob's reference yet: give it back before failing
+                blob_store.release(input_blob)
+                raise
             logger.info(f"Credits deducted. New balance: {user_profile.credits}")
             
-            # 2. Trigger background task
-            task = generate_images_task(
-                user_id=request.user.id,
-                image_data=image_data,
-                count=count,
-                mode=mode,
-                user_prompt=user_prompt,
-                plan=user_profile.plan_type
-            )
+            # 3. Trigger background task on the plan's queue
+            try:
+                enqueue(task, job)
+            except Exception as e:
+                logger.error(f"Could not queue job {task.id}: {e}")
+                finalize_job(job, 'The job could not be queued')
+                return JsonResponse({'error': 'Could not start the generation, your credits were refunded. Please try again.'}, status=503)
             
             return JsonResponse({
                 'status': 'queued',
@@ -49,16 +138,256 @@ def generate_image(request):
             
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
+def _request_key(request, content_digest, count, mode, user_prompt, plan):
+    """
+    Single-flight key of a generate request: the client's Idempotency-Key
+    when given, otherwise a hash of the input image and parameters.
+    Returns (key, whether it came from the client).
+    """
+    client_key = request.headers.get('Idempotency-Key') or request.POST.get('idempotency_key', '')
+    digest = hashlib.sha256(f"{request.user.id}:".encode())
+    if client_key:
+        digest.update(f"client:{client_key}".encode())
+    else:
+        digest.update(content_digest.encode())
+        digest.update(json.dumps([count, mode, user_prompt, plan]).encode())
+    return digest.hexdigest(), bool(client_key)
+
+def _existing_job(user, request_key, client_key):
+    jobs = GenerationJob.objects.filter(user=user, request_key=request_key)
+    if client_key:
+        # A client key keeps answering with its job after it finishes
+        cutoff = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+        return jobs.filter(created_at__gte=cutoff).order_by('-created_at').first()
+    return jobs.filter(status__in=['queued', 'processing']).first()
+
+def _attached_response(job, user_profile):
+    logger.info(f"Duplicate generate request attached to job {job.task_id}")
+    metrics.DEDUPLICATED.inc()
+    return JsonResponse({
+        'status': 'queued',
+        'task_id': job.task_id,
+        'new_credits': user_profile.credits,
+        'duplicate': True
+    })
+
 @login_required
+@metrics.count_requests('status')
 def task_status(request, task_id):
     """
     Check the status of a specific background task.
+    Images are returned as soon as they are published, with phase/progress info.
     """
+    plan = request.user.userprofile.plan_type
+    entry = status_store.get(task_id, request.user.id)
+    if entry is None:
+        return _legacy_task_status(task_id, plan)
+    return JsonResponse(_job_status(entry, plan))
+
+def _job_status(entry, plan):
+    """Status payload of a job (a status_store entry), shared by the polling endpoint and the event stream."""
+    if entry['status'] == 'error' and not entry['urls']:
+        return {
+            'status': 'error',
+            'message': entry['message'] or 'Unknown error in background task'
+        }
+
+    urls = entry['urls']
+    return {
+        'status': 'success' if entry['status'] in ('success', 'error') else 'processing',
+        'phase': entry['phase'],
+        'completed': len(urls),
+        'total': entry['total'],
+        'urls': urls,
+        # Entries cached before variants were stored have none
+        **_image_variants(urls, plan, entry.get('variants'))
+    }
+
+def _image_variants(urls, plan, stored=None):
+    images = [variants.for_image(url, plan, s) for url, s in zip(urls, stored or [None] * len(urls))]
+    return {
+        'high_res_urls': [image['high_res'] for image in images],
+        'variants': [{'thumbnail': image['thumbnail'], 'srcset': image['srcset']} for image in images],
+        'sizes': settings.IMAGE_VARIANTS['sizes']
+    }
+
+@login_required
+@metrics.count_requests('events')
+async def task_events(request, task_id):
+    """
+    Server-Sent Events stream of a job's progress: a `progress` event with the
+    task_status payload whenever the phase or the published images change,
+    ending once the job finishes. Served over ASGI, so an open stream waits
+    on the event loop instead of holding a server thread. Jobs without a
+    GenerationJob record get a 404 and the dashboard falls back to polling.
+    """
+    user = await request.auser()
+    entry, plan = await sync_to_async(_event_stream_target)(user, task_id)
+    if entry is None:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    response = StreamingHttpResponse(_job_events(task_id, user.id, plan), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # Keep reverse proxies from buffering the stream
+    return response
+
+def _event_stream_target(user, task_id):
+    entry = status_store.get(task_id, user.id)
+    plan = user.userprofile.plan_type
+    # The stream outlives this request's own queries: don't keep a connection open per stream
+    connections.close_all()
+    return entry, plan
+
+@sync_to_async(thread_sensitive=False)
+def _job_snapshot(task_id, user_id):
+    # Runs on the shared executor, so open streams share its threads' few database connections
+    try:
+        return status_store.get(task_id, user_id)
+    except DatabaseError:
+        connection.close() # Reconnect on the next check; the browser reopens the stream
+        raise
+
+async def _job_events(task_id, user_id, plan):
+    config = settings.GENERATION_EVENTS
+    metrics.EVENT_STREAMS.inc()
+    try:
+        # Reconnect delay for EventSource after the stream is closed at max_seconds
+        yield f"retry: {int(config['retry'] * 1000)}\n\n"
+        last, quiet = None, 0.0
+        deadline = time.monotonic() + config['max_seconds']
+        while time.monotonic() < deadline:
+            entry = await _job_snapshot(task_id, user_id)
+            if entry is None:
+                return
+            payload = _job_status(entry, plan)
+            if payload != last:
+                yield f"event: progress\ndata: {json.dumps(payload)}\n\n"
+                last, quiet = payload, 0.0
+            elif quiet >= config['heartbeat']:
+                yield ": keepalive\n\n"
+                quiet = 0.0
+            if payload['status'] != 'processing':
+                return
+            await asyncio.sleep(config['interval'])
+            quiet += config['interval']
+    finally:
+        metrics.EVENT_STREAMS.dec()
+
+@csrf_exempt
+@login_required
+@metrics.count_requests('catalog')
+def generate_catalog(request):
+    """
+    Bulk generation: a ZIP (`archive`) and/or several `images`, with an
+    optional CSV `manifest` of per-product mode/user_prompt/count. Each
+    product becomes its own GenerationJob; the catalog dispatches them a few
+    at a time and the status endpoint aggregates their progress.
+    """
+    # Spool every uploaded file to disk (not just the large ones) before anything reads request.FILES
+    request.upload_handlers = [TemporaryFileUploadHandler(request)]
+    return _generate_catalog(request)
+
+@csrf_protect
+def _generate_catalog(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    user_profile = request.user.userprofile
+    try:
+        products = catalog.read_products(
+            user_profile.plan_type,
+            archive=request.FILES.get('archive'),
+            files=request.FILES.getlist('images'),
+            manifest=request.FILES.get('manifest'),
+            mode=request.POST.get('mode', 'creative'),
+            user_prompt=request.POST.get('user_prompt', ''),
+            count=request.POST.get('count', 4),
+        )
+    except catalog.CatalogError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    try:
+        credits = sum(p['count'] for p in products)
+        if user_profile.credits < credits:
+            catalog.release_products(products)
+            return JsonResponse({'error': 'Not enough credits'}, status=402)
+
+        share_context = request.POST.get('share_context', str(settings.CATALOG['share_context'])).lower() in ('1', 'true', 'on')
+        with transaction.atomic():
+            user_profile.credits -= credits
+            user_profile.save()
+            catalog_job = CatalogJob.objects.create(
+                user=request.user,
+                catalog_id=str(uuid.uuid4()),
+                plan=user_profile.plan_type,
+                share_context=share_context
+            )
+            for product in products:
+                # Products wait for a catalog slot, so their input lives in the blob store rather than a huey payload
+                GenerationJob.objects.create(
+                    user=request.user,
+                    task_id=str(uuid.uuid4()),
+                    total=product['count'],
+                    count=product['count'],
+                    mode=product['mode'],
+                    user_prompt=product['user_prompt'],
+                    plan=user_profile.plan_type,
+                    catalog=catalog_job,
+                    product=product['name'],
+                    input_blob=product['input_blob']
+                )
+    except Exception as e:
+        catalog.release_products(products)
+        logger.error(f"Error triggering catalog: {str(e)}")
+        return JsonResponse({'error': f'Server Error: {str(e)}'}, status=500)
+
+    logger.info(f"Catalog {catalog_job.catalog_id}: {len(products)} products, {credits} credits deducted")
+    try:
+        dispatch_catalog(catalog_job.id)
+    except Exception as e:
+        # The jobs own their blobs now; nothing to release
+        logger.error(f"Error dispatching catalog {catalog_job.catalog_id}: {str(e)}")
+        return JsonResponse({'error': f'Server Error: {str(e)}'}, status=500)
+    return JsonResponse({
+        'status': 'queued',
+        'catalog_id': catalog_job.catalog_id,
+        'products': len(products),
+        'new_credits': user_profile.credits
+    })
+
+@login_required
+@metrics.count_requests('catalog_status')
+def catalog_status(request, catalog_id):
+    """Aggregate progress of a catalog and, per product, the images published so far."""
+    catalog_job = CatalogJob.objects.filter(catalog_id=catalog_id, user=request.user).first()
+    if catalog_job is None:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    items = list(catalog_job.items.order_by('id'))
+    return JsonResponse(catalog.summary(catalog_job, items))
+
+@login_required
+def catalog_manifest(request, catalog_id):
+    """CSV manifest of a catalog's results: one row per generated image (or per product without images)."""
+    catalog_job = CatalogJob.objects.filter(catalog_id=catalog_id, user=request.user).first()
+    if catalog_job is None:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    response = HttpResponse(content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="catalog-{catalog_id}.csv"'
+    writer = csv.writer(response)
+    writer.writerow(['file', 'mode', 'status', 'image', 'url', 'prompt'])
+    for item in catalog_job.items.order_by('id'):
+        for r in item.results:
+            writer.writerow([item.product, item.mode, item.status, r['index'] + 1, r['url'], r.get('prompt', '')])
+        if not item.results:
+            writer.writerow([item.product, item.mode, item.status, '', '', item.message])
+    return response
+
+def _legacy_task_status(task_id, plan):
+    """Status of tasks queued before GenerationJob existed, read from Huey's result store."""
     # This requires reaching into Huey's result store
     # Given we use django-huey, we can use the result() method
     from django_huey import get_queue
     queue = get_queue('default')
-    result = queue.result(task_id)
+    # Peek: reading must not consume the result, or the next poll (another tab, a retry) never sees it
+    result = queue.result(task_id, preserve=True)
     
     if result is None:
         return JsonResponse({'status': 'processing'})
@@ -69,26 +398,31 @@ def task_status(request, task_id):
             'message': result.get('message', 'Unknown error in background task')
         })
         
-    # Prepare high-res versions for the frontend
+    # Prepare responsive and high-res versions for the frontend
     urls = result.get('urls', [])
-    plan = request.user.userprofile.plan_type
-    res_limit = "w_4096" if plan == 'agency' else "w_2048"
-    
-    logger.info(f"Task status: User plan is '{plan}', using resolution limit: {res_limit}")
-    
-    high_res_urls = []
-    for url in urls:
-        if 'cloudinary.com' in url and '/upload/' in url:
-            high_res_url = url.replace('/upload/', f'/upload/{res_limit},c_scale,q_auto:best/')
-            high_res_urls.append(high_res_url)
-            logger.info(f"Generated high-res URL: {high_res_url}")
-        else:
-            high_res_urls.append(url)
-
     return JsonResponse({
         'status': 'success',
         'urls': urls,
-        'high_res_urls': high_res_urls
+        **_image_variants(urls, plan)
     })
 
 
+@staff_member_required
+def quota_status(request):
+    """Current Gemini quota utilization per model, shared across all workers."""
+    return JsonResponse({'enabled': settings.GEMINI_QUOTA['enabled'], 'models': governor.snapshot()})
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint, for `Authorization: Bearer <METRICS_TOKEN>` or
+    a logged-in staff member. Without a configured token it is closed to
+    everyone else, never public.
+    """
+    token = settings.METRICS_TOKEN
+    if not request.user.is_staff:
+        if not token:
+            return HttpResponse(status=403)
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+            return HttpResponse(status=401)
+    return HttpResponse(metrics.render(), content_type=CONTENT_TYPE_LATEST)
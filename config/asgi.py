@@ -13,4 +13,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the app registry is ready (get_asgi_application sets it up)
+from django.urls import reverse
+from apps.images import catalog
+from apps.images.uploads import RequestBodyLimit, max_request_bytes
+
+# Refuse oversized generate and catalog uploads before Django spools their body to disk
+application = RequestBodyLimit(django_application, {
+    reverse('images:generate'): max_request_bytes(),
+    reverse('images:catalog'): catalog.max_request_bytes(),
+})
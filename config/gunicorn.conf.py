@@ -0,0 +1,9 @@
+# Gunicorn hooks (command-line flags live in entrypoint.sh)
+import os
+
+
+def child_exit(server, worker):
+    # Drop the exited worker's live gauges from the shared Prometheus metrics
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
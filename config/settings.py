@@ -98,19 +98,21 @@ WSGI_APPLICATION = 'config.wsgi.application'
 DATABASES = {
     'default': dj_database_url.config(
         default=f"sqlite:///{BASE_DIR / 'db.sqlite3'}",
-        conn_max_age=600
+        # Served over ASGI, each request runs its sync code on its own thread, so a persistent
+        # connection would never be reused: connections come from the pool below instead
+        conn_max_age=int(os.getenv('DB_CONN_MAX_AGE', 0))
     )
 }
 
-# Advanced Connection Pooling (Postgres only)
-# Disabled - Django's built-in connection pooling via conn_max_age is sufficient
-# if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
-#     DATABASES['default']['ENGINE'] = 'dj_db_conn_pool.backends.postgresql'
-#     DATABASES['default']['POOL_OPTIONS'] = {
-#         'POOL_SIZE': 10,
-#         'MAX_OVERFLOW': 10,
-#         'RECYCLE': 24 * 60 * 60, # 1 day
-#     }
+# Connection pooling (Postgres, psycopg 3): requests and huey tasks borrow an open
+# connection from a per-process pool instead of connecting every time.
+# Django only pools without persistent connections (DB_CONN_MAX_AGE=0).
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql' and not DATABASES['default']['CONN_MAX_AGE']:
+    DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+        'timeout': float(os.getenv('DB_POOL_TIMEOUT', 30)), # Seconds to wait for a free connection
+    }
 
 
 # Password validation
@@ -216,6 +218,208 @@ ACCOUNT_SIGNUP_FORM_CLASS = 'apps.accounts.forms.CustomSignupForm'
 # Google AI Studio
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY') or os.getenv('GEMINI_API_KEY')
 
+# Bearer token for the Prometheus /metrics endpoint (staff sessions only when empty)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Pipeline backends (apps/images/backends). GENERATION_BACKEND=fake runs everything offline.
+_FAKE_BACKENDS = os.getenv('GENERATION_BACKEND', 'gemini') == 'fake'
+GENERATION_BACKENDS = {
+    'image_model': 'apps.images.backends.fake.FakeImageModel' if _FAKE_BACKENDS else 'apps.images.backends.gemini.GeminiImageModel',
+    'text_model': 'apps.images.backends.fake.FakeTextModel' if _FAKE_BACKENDS else 'apps.images.backends.gemini.GeminiTextModel',
+    'storage': 'apps.images.backends.fake.FakeStorage' if _FAKE_BACKENDS else 'apps.images.backends.cloudinary_store.CloudinaryStorage',
+}
+
+# Offline stand-in behaviour (load testing / benchmarks)
+FAKE_BACKEND = {
+    'image_latency': float(os.getenv('FAKE_IMAGE_LATENCY', 8.0)), # seconds per Director/Artist call
+    'text_latency': float(os.getenv('FAKE_TEXT_LATENCY', 3.0)), # seconds per Engineer call
+    'upload_latency': float(os.getenv('FAKE_UPLOAD_LATENCY', 0.5)),
+    'jitter': float(os.getenv('FAKE_JITTER', 0.2)), # +/- fraction of each latency
+    'error_rate': float(os.getenv('FAKE_ERROR_RATE', 0.0)), # chance of a 503 per call
+    'throttle_rate': float(os.getenv('FAKE_THROTTLE_RATE', 0.0)), # chance a call starts a 429 burst
+    'throttle_burst': int(os.getenv('FAKE_THROTTLE_BURST', 3)), # consecutive 429s per burst
+    'image_size': int(os.getenv('FAKE_IMAGE_SIZE', 1024)), # px, square
+    'seed': int(os.getenv('FAKE_SEED', 0)),
+}
+
+# Max concurrent Phase 3 (Artist) calls per job, by plan
+GENERATION_CONCURRENCY = {
+    'free': int(os.getenv('GENERATION_CONCURRENCY_FREE', 1)),
+    'starter': int(os.getenv('GENERATION_CONCURRENCY_STARTER', 2)),
+    'growth': int(os.getenv('GENERATION_CONCURRENCY_GROWTH', 3)),
+    'agency': int(os.getenv('GENERATION_CONCURRENCY_AGENCY', 4)),
+}
+
+# Adaptive (AIMD) limiter shared by all Gemini calls to the same model in a process
+GEMINI_RATE_LIMIT = {
+    'rate': float(os.getenv('GEMINI_RATE', 0.5)),          # starting requests/second
+    'min_rate': float(os.getenv('GEMINI_MIN_RATE', 0.05)),
+    'max_rate': float(os.getenv('GEMINI_MAX_RATE', 2.0)),
+    'burst': int(os.getenv('GEMINI_BURST', 4)),
+}
+GEMINI_MAX_RETRIES = int(os.getenv('GEMINI_MAX_RETRIES', 3)) # Retries per call after a 429
+ENGINEER_REASKS = int(os.getenv('ENGINEER_REASKS', 1)) # Follow-up Engineer calls for prompts missing from its answer
+
+# Cluster-wide quota shared by all web/huey workers through the database (apps/images/quota.py)
+GEMINI_QUOTA = {
+    'enabled': os.getenv('GEMINI_QUOTA_ENABLED', 'True') == 'True',
+    'models': {
+        'gemini-3-pro-image-preview': {
+            'rpm': float(os.getenv('GEMINI_IMAGE_RPM', 20)),
+            'burst': int(os.getenv('GEMINI_IMAGE_BURST', 4)),
+        },
+        'gemini-3-pro-preview': {
+            'rpm': float(os.getenv('GEMINI_TEXT_RPM', 60)),
+            'burst': int(os.getenv('GEMINI_TEXT_BURST', 8)),
+        },
+    },
+    'backoff': float(os.getenv('GEMINI_QUOTA_BACKOFF', 10)), # Seconds every worker pauses after a 429
+}
+
+# Cloudinary uploads run on their own pool so they overlap with the next Artist call
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', 2))
+UPLOAD_MAX_PENDING = int(os.getenv('UPLOAD_MAX_PENDING', 4)) # Artists block once this many uploads are queued
+
+# Final images are fitted to these limits (just under Cloudinary's 25 MP / 10 MB) before upload.
+# Encoder: 'png' (fast level), 'webp-lossless', 'webp' or 'avif' (quality-searched to the byte budget)
+CLOUDINARY_UPLOAD_LIMITS = {
+    'max_megapixels': float(os.getenv('UPLOAD_MAX_MEGAPIXELS', 24.0)),
+    'max_mb': float(os.getenv('UPLOAD_MAX_MB', 9.5)),
+    'encoder': os.getenv('UPLOAD_ENCODER', 'png'),
+}
+
+# Responsive variants of final images (apps/images/variants.py): a srcset width ladder of WebP
+# thumbnails plus the plan's high-res download, derived by Cloudinary at upload time (eager)
+# so the first gallery view doesn't wait for an on-the-fly transformation.
+IMAGE_VARIANTS = {
+    'eager': os.getenv('IMAGE_VARIANTS_EAGER', 'True') == 'True',
+    'widths': [int(w) for w in os.getenv('IMAGE_VARIANTS_WIDTHS', '320,480,960,1280').split(',')],
+    'thumbnail_width': int(os.getenv('IMAGE_VARIANTS_THUMBNAIL_WIDTH', 600)), # src fallback, part of the ladder
+    'sizes': os.getenv('IMAGE_VARIANTS_SIZES', '(max-width: 640px) 50vw, 300px'), # Rendered width of gallery tiles
+    'high_res_widths': {'free': 2048, 'starter': 2048, 'growth': 2048, 'agency': 4096},
+}
+
+# Images per page of the history view and of each infinite-scroll fetch
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 24))
+
+# Keep-alive HTTP pool of the process-wide Gemini client (apps.images.clients)
+GEMINI_HTTP_POOL = {
+    'max_connections': int(os.getenv('GEMINI_MAX_CONNECTIONS', 20)),
+    'max_keepalive_connections': int(os.getenv('GEMINI_MAX_KEEPALIVE', 10)),
+    'keepalive_expiry': float(os.getenv('GEMINI_KEEPALIVE_EXPIRY', 120)), # seconds
+}
+GEMINI_WARM_UP = os.getenv('GEMINI_WARM_UP', 'True') == 'True' # Open a connection when each huey worker starts
+
+# Product photos are normalized once (EXIF orientation, downsample, compact re-encode)
+# and the same buffer is sent to every Director/Engineer/Artist call
+GEMINI_INPUT = {
+    'max_edge': int(os.getenv('GEMINI_INPUT_MAX_EDGE', 2048)), # px; larger inputs don't improve results
+    'jpeg_quality': int(os.getenv('GEMINI_INPUT_JPEG_QUALITY', 90)),
+    'passthrough_bytes': int(os.getenv('GEMINI_INPUT_PASSTHROUGH_KB', 1024)) * 1024, # Small native inputs are sent untouched
+}
+
+# Upload each input image once to the Gemini Files API and reference it by URI
+GEMINI_FILE_REFS = {
+    'enabled': os.getenv('GEMINI_FILE_REFS', 'True') == 'True',
+    'min_bytes': int(os.getenv('GEMINI_FILE_REFS_MIN_KB', 256)) * 1024, # Smaller inputs are cheaper to inline
+    'expiry_margin': int(os.getenv('GEMINI_FILE_REFS_EXPIRY_MARGIN', 3600)), # Re-upload refs expiring within this many seconds
+}
+
+# Local disk cache for Phase 1 (reference image) and Phase 2 (prompt list) artifacts
+ARTIFACT_CACHE = {
+    'enabled': os.getenv('ARTIFACT_CACHE_ENABLED', 'True') == 'True',
+    'root': os.getenv('ARTIFACT_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'artifacts')),
+    'max_bytes': int(os.getenv('ARTIFACT_CACHE_MAX_MB', 512)) * 1024 * 1024,
+    'ttl': int(os.getenv('ARTIFACT_CACHE_TTL', 7 * 24 * 3600)), # seconds
+}
+
+# Uploaded product images, content-addressed on local disk; huey payloads carry only the digest.
+# Must be a directory shared by the web process and the huey consumer.
+BLOB_STORE = {
+    'root': os.getenv('BLOB_STORE_DIR', os.path.join(BASE_DIR, 'cache', 'blobs')),
+}
+
+# Product photo uploads to /images/generate/, per plan. Checked while the request body is parsed
+# (format from the first bytes, megapixels from the header), before any credits are touched;
+# accepted uploads are spooled to disk (FILE_UPLOAD_TEMP_DIR), never held in memory.
+UPLOAD_LIMITS = {
+    'free': {
+        'max_mb': float(os.getenv('UPLOAD_MAX_MB_FREE', 10)),
+        'max_megapixels': float(os.getenv('UPLOAD_MAX_MEGAPIXELS_FREE', 25)),
+    },
+    'starter': {
+        'max_mb': float(os.getenv('UPLOAD_MAX_MB_STARTER', 20)),
+        'max_megapixels': float(os.getenv('UPLOAD_MAX_MEGAPIXELS_STARTER', 50)),
+    },
+    'growth': {
+        'max_mb': float(os.getenv('UPLOAD_MAX_MB_GROWTH', 25)),
+        'max_megapixels': float(os.getenv('UPLOAD_MAX_MEGAPIXELS_GROWTH', 50)),
+    },
+    'agency': {
+        'max_mb': float(os.getenv('UPLOAD_MAX_MB_AGENCY', 40)),
+        'max_megapixels': float(os.getenv('UPLOAD_MAX_MEGAPIXELS_AGENCY', 100)),
+    },
+}
+
+# Run jobs on the shared asyncio loop (google-genai client.aio) instead of one thread per job.
+# When enabled, raise HUEY_WORKERS: async workers only wait on the loop, so dozens are cheap.
+GENERATION_ASYNC = os.getenv('GENERATION_ASYNC', 'False') == 'True'
+GENERATION_ASYNC_TIMEOUT = int(os.getenv('GENERATION_ASYNC_TIMEOUT', 900)) # seconds per job
+
+# Transient failures (429, 5xx, network) are retried per phase, except Artist 429s, which
+# only its limiter loop retries (GEMINI_MAX_RETRIES); a job that still comes up
+# short is re-run from its last checkpoint (GenerationJob) up to max_job_attempts times.
+GENERATION_RETRY = {
+    'attempts': int(os.getenv('GENERATION_RETRY_ATTEMPTS', 4)), # Tries per Director/Engineer/Artist call
+    'base': float(os.getenv('GENERATION_RETRY_BASE', 2)), # Seconds, doubled per attempt (full jitter)
+    'max_wait': float(os.getenv('GENERATION_RETRY_MAX_WAIT', 60)),
+    'max_job_attempts': int(os.getenv('GENERATION_MAX_JOB_ATTEMPTS', 3)),
+    'job_base': float(os.getenv('GENERATION_JOB_RETRY_BASE', 30)),
+    'job_max_wait': float(os.getenv('GENERATION_JOB_RETRY_MAX_WAIT', 600)),
+    'stall_after': int(os.getenv('GENERATION_STALL_AFTER', 1800)), # Seconds without progress before a job is resumed
+}
+
+# Seconds a client-supplied Idempotency-Key keeps returning the job it created
+# (identical requests without a key are deduplicated only while their job is in flight)
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', 86400))
+
+# Bulk catalog submissions (/images/catalog/): one job per product, a few in flight at a time.
+CATALOG = {
+    'max_products': int(os.getenv('CATALOG_MAX_PRODUCTS', 50)),
+    'max_file_mb': float(os.getenv('CATALOG_MAX_FILE_MB', 20)), # Per product image (checked before unzipping)
+    'max_parallel': int(os.getenv('CATALOG_MAX_PARALLEL', 2)), # Products of one catalog generating at once
+    'share_context': os.getenv('CATALOG_SHARE_CONTEXT', 'True') == 'True', # Default for reusing Director/Engineer output
+}
+
+# Job status store (apps/images/status_store.py): GenerationJob rows are the durable record and the
+# `job_status` cache answers status polls and event streams without a query. The default file cache
+# must be a directory shared by the web process and the huey consumer.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'job_status': {
+        'BACKEND': os.getenv('JOB_STATUS_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('JOB_STATUS_CACHE_LOCATION', os.path.join(BASE_DIR, 'cache', 'job-status')),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('JOB_STATUS_CACHE_MAX_ENTRIES', 10000))},
+    },
+}
+JOB_STATUS = {
+    'ttl': int(os.getenv('JOB_STATUS_TTL', 86400)), # Seconds a finished job's status stays cached
+    'active_ttl': int(os.getenv('JOB_STATUS_ACTIVE_TTL', 300)), # In-flight entries, refreshed by each progress write
+    'retention_days': int(os.getenv('JOB_RETENTION_DAYS', 30)), # Finished job records are purged after this (0 keeps them)
+    'result_ttl': int(os.getenv('HUEY_RESULT_TTL', 86400)), # Seconds huey keeps results of tasks without a job record
+}
+
+# Job progress stream (/images/status/<task_id>/events/, Server-Sent Events over ASGI).
+# Each open stream reads its job row every `interval` seconds; the dashboard polls if it can't connect.
+GENERATION_EVENTS = {
+    'interval': float(os.getenv('GENERATION_EVENTS_INTERVAL', 1)), # Seconds between job checks
+    'heartbeat': float(os.getenv('GENERATION_EVENTS_HEARTBEAT', 15)), # Keep-alive comment when nothing changed
+    'max_seconds': int(os.getenv('GENERATION_EVENTS_MAX_SECONDS', 600)), # Then the browser reconnects
+    'retry': float(os.getenv('GENERATION_EVENTS_RETRY', 2)), # Reconnect delay sent to EventSource, seconds
+}
+
 # Security Settings for Reverse Proxy (Coolify/Traefik)
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 USE_X_FORWARDED_HOST = True
@@ -273,20 +477,30 @@ LOGGING = {
         },
     },
 }
+# Plan-aware scheduling: every tier gets its own huey queue and consumer with its own workers,
+# so a burst of free-trial jobs can't hold the workers paying plans run on. Within a queue,
+# each user's waiting jobs are spread out by priority (round-robin between users).
+GENERATION_QUEUES = {
+    'priority': {'plans': ['agency'], 'workers': int(os.getenv('HUEY_PRIORITY_WORKERS', 2))},
+    'paid': {'plans': ['starter', 'growth'], 'workers': int(os.getenv('HUEY_PAID_WORKERS', 2))},
+    'default': {'plans': ['free'], 'workers': int(os.getenv('HUEY_WORKERS', 2))}, # Also periodic and legacy tasks
+}
+
 # Huey Configuration (Background Tasks)
 DJANGO_HUEY = {
     'default': 'default',
     'queues': {
-        'default': {
+        name: {
             'huey_class': 'huey.SqliteHuey',
-            'filename': os.path.join(BASE_DIR, 'db.huey'),
+            'filename': os.path.join(BASE_DIR, 'db.huey' if name == 'default' else f'db-{name}.huey'),
             'results': True,
             'store_none': False,
             'immediate': False,
             'consumer': {
-                'workers': 2,
+                'workers': queue['workers'],
                 'worker_type': 'thread',
             },
         }
+        for name, queue in GENERATION_QUEUES.items()
     }
 }
@@ -3,6 +3,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from apps.accounts import webhooks
+from apps.images import views as image_views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -12,6 +13,7 @@ urlpatterns = [
     path('', include('apps.core.urls')), # Main dashboard
     # Specific webhook path to match user configuration
     path('webhook/products/polar', webhooks.polar_webhook, name='polar_webhook_products'),
+    path('metrics', image_views.metrics_view, name='metrics'), # Prometheus scrape target
 ]
 
 if settings.DEBUG:
@@ -13,10 +13,18 @@ python manage.py createsuperuser --noinput || true # Create admin if env vars ar
 echo "Collect static files..."
 python manage.py collectstatic --noinput
 
-# Start Huey background consumer
-echo "Starting Huey consumer..."
-python manage.py djangohuey &
+# Prometheus metrics are shared by gunicorn workers and the huey consumer through this directory
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
 
-# Start server
+# Start one Huey consumer per plan tier, for every queue settings.py derives from GENERATION_QUEUES
+QUEUES=$(python manage.py shell -v 0 -c "from django.conf import settings; print(' '.join(settings.DJANGO_HUEY['queues']))")
+for queue in $QUEUES; do
+    echo "Starting Huey consumer ($queue)..."
+    python manage.py djangohuey --queue "$queue" &
+done
+
+# Start server: ASGI (config/asgi.py) on uvicorn workers, so open progress streams wait on the
+# event loop instead of holding a thread; sync views still run in threads (asgiref).
 echo "Starting Gunicorn..."
-exec gunicorn --bind 0.0.0.0:8000 --timeout 300 --workers 2 --worker-class gthread --threads 4 config.wsgi:application
+exec gunicorn --config config/gunicorn.conf.py --bind 0.0.0.0:8000 --timeout 300 --workers 2 --worker-class uvicorn_worker.UvicornWorker config.asgi:application
@@ -130,8 +130,8 @@ document.addEventListener('DOMContentLoaded', () => {
                     creditValueEl.textContent = data.new_credits;
                 }
 
-                // Start polling
-                pollTaskStatus(taskId);
+                // Follow progress (event stream, or polling as a fallback)
+                watchTask(taskId);
             } else {
                 throw new Error(data.error || 'Generation failed');
             }
@@ -146,8 +146,111 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
-    // New Polling Function
-    async function pollTaskStatus(taskId) {
+    // Human-readable labels for the pipeline phases reported by the status endpoint
+    const phaseLabels = {
+        queued: 'Waiting in queue...',
+        director: 'Phase 1: Designing the reference shot...',
+        engineer: 'Phase 2: Writing the shot list...',
+        artist: 'Phase 3: Shooting final images...',
+    };
+
+    // variant: {thumbnail, srcset} derived at upload (legacy payloads have none: show the original)
+    function renderResult(url, highResUrl, variant, sizes) {
+        const thumbUrl = (variant && variant.thumbnail) || url;
+        const srcset = variant && variant.srcset ? ` srcset="${variant.srcset}" sizes="${sizes}"` : '';
+
+        const wrap = document.createElement('div');
+        wrap.className = 'thumb-wrap';
+        wrap.innerHTML = `
+            <img src="${thumbUrl}"${srcset} alt="Generated image" loading="lazy">
+            <a href="${highResUrl}" download class="dl-icon" title="Download">
+                <svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24" fill="currentColor" class="w-6 h-6">
+                    <path fillRule="evenodd" d="M12 2.25a.75.75 0 01.75.75v11.69l3.22-3.22a.75.75 0 111.06 1.06l-4.5 4.5a.75.75 0 01-1.06 0l-4.5-4.5a.75.75 0 111.06-1.06l3.22 3.22V3a.75.75 0 01.75-.75zm-9 13.5a.75.75 0 01.75.75v2.25a1.5 1.5 0 001.5 1.5h13.5a1.5 1.5 0 001.5-1.5v-2.25a.75.75 0 011.5 0v2.25a3 3 0 01-3 3H4.5a3 3 0 01-3-3v-2.25a.75.75 0 01.75-.75z" clipRule="evenodd" />
+                </svg>
+            </a>
+        `;
+        resultsGallery.appendChild(wrap);
+    }
+
+    // Progress display shared by the event stream and polling.
+    // update(data) takes a status payload and returns true once the task has finished.
+    function taskView() {
+        let rendered = 0;
+
+        resultsGallery.innerHTML = '';
+
+        // Render any images published since the last update (partial results)
+        const renderNew = (data) => {
+            const urls = data.urls || [];
+            const highResUrls = data.high_res_urls || urls;
+            const variants = data.variants || [];
+            for (; rendered < urls.length; rendered++) {
+                renderResult(urls[rendered], highResUrls[rendered] || urls[rendered], variants[rendered], data.sizes);
+            }
+            if (rendered > 0) {
+                resultsCard.style.display = 'block';
+            }
+        };
+
+        const fail = (message) => {
+            errorMsg.textContent = message;
+            errorMsg.style.display = 'block';
+            statusMsg.textContent = '';
+            resetUI();
+        };
+
+        const update = (data) => {
+            if (data.status === 'success') {
+                renderNew(data);
+                statusMsg.textContent = 'Images generated successfully';
+                generatingCard.style.display = 'none';
+                resultsCard.style.display = 'block';
+                resetUI();
+                return true;
+            }
+            if (data.status === 'error') {
+                fail(data.message || 'Background task failed');
+                return true;
+            }
+            // Still processing: show what is ready so far
+            renderNew(data);
+            if (data.total) {
+                const label = phaseLabels[data.phase] || 'Please wait...';
+                statusMsg.textContent = data.phase === 'artist' ? `${label} (${data.completed}/${data.total})` : label;
+            }
+            return false;
+        };
+
+        return { update, fail };
+    }
+
+    // Follow a task over Server-Sent Events; poll when the browser or the server can't stream
+    function watchTask(taskId) {
+        const view = taskView();
+        if (!window.EventSource) {
+            pollTaskStatus(taskId, view);
+            return;
+        }
+
+        const source = new EventSource(`/images/status/${taskId}/events/`);
+        let received = false;
+        source.addEventListener('progress', (event) => {
+            received = true;
+            if (view.update(JSON.parse(event.data))) {
+                source.close();
+            }
+        });
+        source.onerror = () => {
+            // After a working stream drops, EventSource reconnects by itself;
+            // it gives up (CLOSED) on an error response such as a legacy task's 404
+            if (!received || source.readyState === EventSource.CLOSED) {
+                source.close();
+                pollTaskStatus(taskId, view);
+            }
+        };
+    }
+
+    async function pollTaskStatus(taskId, view) {
         const pollInterval = 3000; // 3 seconds
         let attempts = 0;
         const maxAttempts = 60; // 3 minutes total
@@ -157,44 +260,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 const res = await fetch(`/images/status/${taskId}/`);
                 const data = await res.json();
 
-                if (data.status === 'success') {
-                    statusMsg.textContent = 'Images generated successfully';
-                    generatingCard.style.display = 'none';
-                    resultsCard.style.display = 'block';
-
-                    // Render Gallery
-                    resultsGallery.innerHTML = '';
-                    const urls = data.urls || [];
-                    const highResUrls = data.high_res_urls || urls;
-
-                    urls.forEach((url, index) => {
-                        const highResUrl = highResUrls[index] || url;
-                        const thumbUrl = url.includes('cloudinary.com') ? url.replace('/upload/', '/upload/w_600,c_scale,q_auto,f_auto/') : url;
-
-                        console.log(`Image ${index + 1}:`, {
-                            original: url,
-                            thumbnail: thumbUrl,
-                            highRes: highResUrl
-                        });
-
-                        const wrap = document.createElement('div');
-                        wrap.className = 'thumb-wrap';
-                        wrap.innerHTML = `
-                            <img src="${thumbUrl}" alt="Generated image" loading="lazy">
-                            <a href="${highResUrl}" download class="dl-icon" title="Download">
-                                <svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24" fill="currentColor" class="w-6 h-6">
-                                    <path fillRule="evenodd" d="M12 2.25a.75.75 0 01.75.75v11.69l3.22-3.22a.75.75 0 111.06 1.06l-4.5 4.5a.75.75 0 01-1.06 0l-4.5-4.5a.75.75 0 111.06-1.06l3.22 3.22V3a.75.75 0 01.75-.75zm-9 13.5a.75.75 0 01.75.75v2.25a1.5 1.5 0 001.5 1.5h13.5a1.5 1.5 0 001.5-1.5v-2.25a.75.75 0 011.5 0v2.25a3 3 0 01-3 3H4.5a3 3 0 01-3-3v-2.25a.75.75 0 01.75-.75z" clipRule="evenodd" />
-                                </svg>
-                            </a>
-                        `;
-                        resultsGallery.prepend(wrap);
-                    });
-
-                    resetUI();
-                } else if (data.status === 'error') {
-                    throw new Error(data.message || 'Background task failed');
-                } else {
-                    // Still processing
+                if (!view.update(data)) {
                     attempts++;
                     if (attempts < maxAttempts) {
                         setTimeout(checkStatus, pollInterval);
@@ -203,10 +269,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     }
                 }
             } catch (err) {
-                errorMsg.textContent = err.message;
-                errorMsg.style.display = 'block';
-                statusMsg.textContent = '';
-                resetUI();
+                view.fail(err.message);
             }
         };
 